@@ -0,0 +1,823 @@
+# benchmark.py
+# 性能基准测试（无需图形界面）：python benchmark.py [项目名 ...]
+import os, sys, time, threading, json, tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from textbuffer import GapBuffer
+from wrapindex import WrapIndex
+from terminal_core import TerminalCore, SerialProtocol
+
+# ---------- 配置 ----------
+BUFFER_SIZES = [10 * 1024, 1024 * 1024, 10 * 1024 * 1024]
+INSERTS_PER_SIZE = 2000
+TEXT_COLS, TEXT_ROWS = 40, 8
+
+# -------------------------
+
+def _fmt_size(n):
+    if n >= 1024 * 1024:
+        return f"{n // (1024 * 1024)} MB"
+    return f"{n // 1024} KB"
+
+def _make_text(size):
+    line = "The quick brown fox jumps over the lazy dog 0123456789\n"
+    return (line * (size // len(line) + 1))[:size]
+
+def bench_text_buffer():
+    """
+    对比 str 切片拼接与 GapBuffer 在不同文本大小下的单次插入耗时（光标在文本中部）
+    """
+    print("== 文本缓冲区：单次插入耗时 ==")
+    print(f"{'size':>8} {'str (us)':>12} {'GapBuffer (us)':>16} {'speedup':>9}")
+    for size in BUFFER_SIZES:
+        text = _make_text(size)
+        pos = size // 2
+
+        # str 拼接（旧实现）；大文本时减少次数避免耗时过长
+        n_str = max(20, min(INSERTS_PER_SIZE, (50 * 1024 * 1024) // size))
+        s = text
+        t0 = time.perf_counter()
+        for k in range(n_str):
+            s = s[:pos + k] + "x" + s[pos + k:]
+        str_us = (time.perf_counter() - t0) / n_str * 1e6
+
+        gb = GapBuffer(text)
+        gb.insert(pos, "x")  # 首次把间隙移到光标处
+        t0 = time.perf_counter()
+        for k in range(1, INSERTS_PER_SIZE + 1):
+            gb.insert(pos + k, "x")
+        gb_us = (time.perf_counter() - t0) / INSERTS_PER_SIZE * 1e6
+
+        print(f"{_fmt_size(size):>8} {str_us:>12.2f} {gb_us:>16.2f} {str_us / gb_us:>8.1f}x")
+
+def bench_wrap_index():
+    """
+    模拟一次按键：在末尾插入字符 + 光标定位 + 取可视区 TEXT_ROWS 行文本，
+    观察耗时是否随滚动缓冲区增大而保持平稳
+    """
+    print("== 折行索引：每次按键（插入 + 光标映射 + 取可视行）耗时 ==")
+    print(f"{'size':>8} {'lines':>10} {'us/key':>10}")
+    for size in BUFFER_SIZES:
+        text = GapBuffer(_make_text(size))
+        wrap = WrapIndex(text, TEXT_COLS)
+        cursor = len(text)
+        t0 = time.perf_counter()
+        for k in range(INSERTS_PER_SIZE):
+            ch = "\n" if k % 50 == 49 else "x"
+            text.insert(cursor, ch)
+            wrap.insert(cursor, ch)
+            cursor += 1
+            line, _ = wrap.raw_index_to_display_pos(cursor)
+            start = max(0, line - TEXT_ROWS + 1)
+            for i in range(start, line + 1):
+                wrap.line_text(i)
+        us = (time.perf_counter() - t0) / INSERTS_PER_SIZE * 1e6
+        print(f"{_fmt_size(size):>8} {wrap.line_count():>10} {us:>10.2f}")
+
+def open_pty_serial():
+    """
+    用 pty.openpty() 创建一对回环终端：master 端模拟 Model 100，slave 端作为串口交给 pyserial 打开。
+    返回 (master_fd, ser)
+    """
+    import pty
+    import serial
+    master, slave = pty.openpty()
+    ser = serial.Serial(os.ttyname(slave), baudrate=9600, timeout=0.3)
+    os.close(slave)
+    return master, ser
+
+def bench_serial_reader():
+    """
+    pty 回环：测量 SerialReader 的吞吐量，以及空闲时每秒唤醒次数（正确性由 tests/test_serial_io.py 检查）
+    """
+    from serial_io import SerialReader
+    print("== 串口读取（pty 回环）==")
+    master, ser = open_pty_serial()
+    reader = SerialReader(ser, timeout=1.0)
+    stop = threading.Event()
+    received = bytearray()
+    t = threading.Thread(target=reader.run, args=(received.extend, stop), daemon=True)
+    t.start()
+
+    # 空闲：1 秒内没有任何数据
+    time.sleep(1.0)
+    idle_wakeups = reader.wakeups
+    print(f"idle wakeups/sec:       {idle_wakeups:.1f}")
+
+    # 9600 波特率节奏（约 960 字节/秒）发送 1 秒
+    payload = b"0123456789ABCDEF" * 60
+    t0 = time.perf_counter()
+    for i in range(0, len(payload), 16):
+        os.write(master, payload[i:i + 16])
+        time.sleep(16 / 960)
+    while len(received) < len(payload) and time.perf_counter() - t0 < 5:
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - t0
+    print(f"9600-baud paced:        {len(received) / elapsed:.0f} B/s, {len(received)}/{len(payload)} bytes")
+
+    # 不限速：测量最大吞吐
+    received.clear()
+    total = 256 * 1024
+    block = b"x" * 4096
+    w0 = reader.wakeups
+    t0 = time.perf_counter()
+    for _ in range(total // len(block)):
+        os.write(master, block)
+    while len(received) < total and time.perf_counter() - t0 < 10:
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - t0
+    print(f"unthrottled:            {len(received) / elapsed / 1024:.0f} KB/s, "
+          f"{len(received) / max(1, reader.wakeups - w0):.0f} bytes/wakeup")
+
+    stop.set()
+    t.join(2)
+    ser.close()
+    os.close(master)
+
+class MockOpenAIServer:
+    """
+    本地模拟的 OpenAI 兼容服务器（/chat/completions，支持 stream=True 的 SSE 输出）。
+    first_delay：首段延迟（模拟模型思考）；token_delay：之后每段的间隔。
+    """
+
+    def __init__(self, reply="Hello from the mock model. " * 8, first_delay=0.5, token_delay=0.02):
+        self.reply = reply
+        self.first_delay = first_delay
+        self.token_delay = token_delay
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                server.requests += 1
+                server.last_request = body
+                time.sleep(server.first_delay)
+                words = server.reply.split(" ")
+                if not body.get("stream"):
+                    self._send_json({
+                        "id": "mock", "object": "chat.completion", "created": 0, "model": body.get("model", ""),
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": server.reply}}],
+                    })
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for i, w in enumerate(words):
+                    if i:
+                        time.sleep(server.token_delay)
+                    self._chunk(body, (" " if i else "") + w)
+                self._write(b"data: [DONE]\n\n")
+                self._write(b"")
+
+            def _chunk(self, body, text):
+                payload = {"id": "mock", "object": "chat.completion.chunk", "created": 0,
+                           "model": body.get("model", ""),
+                           "choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}]}
+                self._write(f"data: {json.dumps(payload)}\n\n".encode())
+
+            def _write(self, data):
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            def _send_json(self, obj):
+                data = json.dumps(obj).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def bench_serial_mux():
+    """
+    多个 pty 串口共用一个 SerialMux 读取线程：每个端口按 9600 波特率节奏输入，
+    测量端口数增加时的 CPU 占用与唤醒次数
+    """
+    from serial_io import SerialMux
+    print("== 多串口共用读取线程（pty 回环，每端口约 960 B/s）==")
+    print(f"{'ports':>6} {'CPU %':>7} {'wakeups/s':>10} {'received':>10}")
+    for nports in (1, 4, 8):
+        pairs = [open_pty_serial() for _ in range(nports)]
+        received = [0]
+
+        def on_data(data):
+            received[0] += len(data)
+
+        mux = SerialMux(timeout=1.0)
+        for _, ser in pairs:
+            mux.add(ser, on_data)
+        mux.start()
+        duration = 2.0
+        cpu0, t0 = time.process_time(), time.perf_counter()
+        sent = 0
+        while time.perf_counter() - t0 < duration:
+            for master, _ in pairs:
+                os.write(master, b"0123456789ABCDEF")
+            sent += 16 * nports
+            time.sleep(16 / 960)
+        time.sleep(0.1)
+        cpu = time.process_time() - cpu0
+        elapsed = time.perf_counter() - t0
+        print(f"{nports:>6} {cpu / elapsed * 100:>6.1f}% {mux.wakeups / elapsed:>10.0f} {received[0]:>5}/{sent}")
+        mux.close()
+        time.sleep(1.1)
+        for master, ser in pairs:
+            ser.close()
+            os.close(master)
+
+def bench_idle():
+    """
+    空闲模式：一个 pty 串口 + SerialMux，分别测量
+    活动（有数据输入，1 秒超时，500ms 光标闪烁定时器）、空闲但仍轮询（无数据，1 秒超时 + 闪烁）、
+    空闲模式（完全阻塞，无闪烁）下读取线程与整个进程的每秒唤醒次数和 CPU 占用，
+    以及空闲模式下收到一个字节的唤醒延迟。闪烁定时器在这里用一个线程模拟 Tk 的 after()
+    """
+    from serial_io import SerialMux
+    from metrics import process_wakeups
+    print("== 空闲模式（pty 回环）==")
+    print(f"{'mode':>14} {'CPU %':>7} {'reader/s':>9} {'process/s':>10}")
+    master, ser = open_pty_serial()
+    received = threading.Event()
+    mux = SerialMux(timeout=1.0)
+    mux.add(ser, lambda data: received.set())
+    mux.start()
+    duration = 3.0
+    for mode in ("active", "idle polling", "idle blocking"):
+        mux.set_timeout(None if mode == "idle blocking" else 1.0)
+        stop = threading.Event()
+        blink = None
+        if mode != "idle blocking":
+            def blink_loop(stop=stop):
+                while not stop.wait(0.5):
+                    pass
+            blink = threading.Thread(target=blink_loop, daemon=True)
+            blink.start()
+        time.sleep(0.2)
+        w0, p0 = mux.wakeups, process_wakeups()
+        cpu0, t0 = time.process_time(), time.perf_counter()
+        while time.perf_counter() - t0 < duration:
+            if mode == "active":
+                os.write(master, b"0123456789ABCDEF")
+                time.sleep(16 / 960)
+            else:
+                time.sleep(duration)
+        elapsed = time.perf_counter() - t0
+        cpu = time.process_time() - cpu0
+        # 主线程本身的 sleep 唤醒不计入（active 模式下它在模拟输入）
+        proc = process_wakeups() - p0 - (0 if mode == "active" else 1)
+        print(f"{mode:>14} {cpu / elapsed * 100:>6.2f}% {(mux.wakeups - w0) / elapsed:>9.1f} {proc / elapsed:>10.1f}")
+        stop.set()
+        if blink is not None:
+            blink.join()
+    # 完全阻塞时一个字节的唤醒延迟
+    lat = []
+    for _ in range(20):
+        received.clear()
+        t0 = time.perf_counter()
+        os.write(master, b"x")
+        received.wait(1.0)
+        lat.append(time.perf_counter() - t0)
+        time.sleep(0.01)
+    lat.sort()
+    print(f"wake on byte (blocking): p50 {lat[len(lat) // 2] * 1e6:.0f} us, max {lat[-1] * 1e6:.0f} us")
+    t0 = time.perf_counter()
+    mux.close()
+    mux.thread.join(2.0)
+    print(f"close while blocking: {(time.perf_counter() - t0) * 1000:.1f} ms")
+    ser.close()
+    os.close(master)
+
+def bench_deepseek_stream():
+    """
+    对本地模拟服务器测量流式后端的首字时间（time-to-first-token）与总耗时；
+    最后几次开启回复缓存（第一次未命中，之后命中）
+    """
+    import tempfile
+    from llm import ChatBackend, OpenAICompatibleProvider, ResponseCache
+    print("== DeepSeek 流式后端（本地模拟服务器）==")
+    server = MockOpenAIServer()
+    provider = OpenAICompatibleProvider("mock-server", "test-key", server.url, "mock-model")
+    backend = ChatBackend([provider], "You are a helpful assistant")
+    tmp = tempfile.TemporaryDirectory()
+    try:
+        for run in range(5):
+            if run == 2:
+                backend.cache = ResponseCache(os.path.join(tmp.name, "cache.sqlite3"))
+            t0 = time.perf_counter()
+            first = []
+            parts = []
+            done = threading.Event()
+
+            def on_token(t):
+                if not first:
+                    first.append(time.perf_counter() - t0)
+                parts.append(t)
+
+            backend.submit("hello", on_token, done.set)
+            assert done.wait(30), f"run {run}: reply did not finish"
+            total = time.perf_counter() - t0
+            ok = "".join(parts) == server.reply
+            label = "cache" if backend.cache is not None else "no cache"
+            print(f"run {run} ({label}): first token {first[0] * 1000:.1f} ms, total {total * 1000:.1f} ms, "
+                  f"{'ok' if ok else 'MISMATCH'}")
+            assert ok, f"run {run}: streamed reply does not match the server's"
+        print(f"cache: {backend.cache.stats()}")
+    finally:
+        backend.close()
+        server.close()
+        tmp.cleanup()
+
+def bench_llm_tail():
+    """
+    首段文本的尾延迟：主提供方 20% 的请求很慢（3 秒），对比不对冲与 1 秒后对冲到第二个提供方；
+    以及主提供方前两次失败时的重试
+    """
+    import random
+    from llm import ChatBackend, MockProvider
+
+    class JitteryProvider(MockProvider):
+        def stream(self, messages, timeout, cancelled):
+            self.first_delay = 3.0 if random.random() < 0.2 else 0.2
+            return super().stream(messages, timeout, cancelled)
+
+    def run(backend, n):
+        for _ in range(n):
+            done = threading.Event()
+            backend.submit("hello", lambda t: None, done.set)
+            done.wait(30)
+        return backend.stats()
+
+    print("== 模型请求尾延迟（模拟提供方）==")
+    random.seed(1)
+    n = 30
+    for label, hedge in (("no hedge", None), ("hedge @1s", 1.0)):
+        backend = ChatBackend([JitteryProvider("primary", token_delay=0), MockProvider("backup", first_delay=0.4, token_delay=0)],
+                              "sys", hedge_after=hedge)
+        st = run(backend, n)
+        print(f"{label:>10}: first token p50 {st['first_token_p50'] * 1000:>5.0f} ms, "
+              f"p99 {st['first_token_p99'] * 1000:>5.0f} ms, hedged {st['hedged']}, hedge wins {st['hedge_wins']}")
+        backend.close()
+    backend = ChatBackend([MockProvider("flaky", fail_first=2, first_delay=0.05, token_delay=0)], "sys", backoff=0.1)
+    st = run(backend, 1)
+    print(f"{'retry':>10}: {st['retries']} retries, {st['failures']} failures, "
+          f"first token {st['first_token_p50'] * 1000:.0f} ms")
+    backend.close()
+
+def bench_startup():
+    """
+    冷启动：在新进程中导入各模块的耗时（openai 延迟到第一次请求时导入），
+    以及背景图直接解码 / 缩放与读取缓存的耗时（字体选择需要显示器，见程序首帧时的启动耗时输出）
+    """
+    import subprocess
+    print("== 冷启动 ==")
+    here = os.path.dirname(os.path.abspath(__file__))
+    for module in ("llm", "model100", "openai"):
+        code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+        runs = []
+        for _ in range(3):
+            out = subprocess.run([sys.executable, "-c", code], cwd=here, capture_output=True, text=True)
+            if out.returncode != 0:
+                break
+            runs.append(float(out.stdout.strip().splitlines()[-1]))
+        if runs:
+            print(f"import {module:>8}: {min(runs) * 1000:7.1f} ms")
+        else:
+            print(f"import {module:>8}: failed")
+    try:
+        from PIL import Image
+        import model100
+    except ImportError as e:
+        print(f"背景图: 跳过（{e}）")
+        return
+    path = os.path.join(here, model100.BG_FILENAME)
+    if not os.path.exists(path):
+        return
+    import shutil, tempfile
+    size = (model100.WINDOW_W, model100.WINDOW_H)
+    t0 = time.perf_counter()
+    img = Image.open(path)
+    img = img if img.size == size else img.resize(size, Image.LANCZOS)
+    img.load()
+    direct = time.perf_counter() - t0
+    # load_background 把缓存写在背景图旁边：用临时目录中的副本，不在源码目录留下文件
+    with tempfile.TemporaryDirectory() as tmp:
+        copy = os.path.join(tmp, model100.BG_FILENAME)
+        shutil.copy2(path, copy)
+        model100.load_background(copy, size)     # 建立缓存
+        t0 = time.perf_counter()
+        model100.load_background(copy, size)
+        cached = time.perf_counter() - t0
+    print(f"background: direct {direct * 1000:.1f} ms, cached {cached * 1000:.1f} ms")
+
+def bench_core():
+    """
+    TerminalCore：每秒插入次数（单字符 / 整行），以及滚动缓冲区增长时的内存占用
+    """
+    print("== TerminalCore：插入速率 ==")
+    for label, chunk in (("1 char", "x"), ("40-char line", "y" * 39 + "\n")):
+        core = TerminalCore(TEXT_COLS, TEXT_ROWS)
+        n = 200000 if len(chunk) == 1 else 50000
+        t0 = time.perf_counter()
+        for _ in range(n):
+            core.insert(chunk)
+        elapsed = time.perf_counter() - t0
+        print(f"{label:>14}: {n / elapsed:>10.0f} inserts/s, {n * len(chunk) / elapsed / 1024:>8.0f} KB/s")
+
+    print("== TerminalCore：滚动缓冲区增长时的内存（tracemalloc）==")
+    line = "The quick brown fox jumps over the lazy dog 0123456789\n"
+    results = {}
+    for label, max_chars in (("unbounded", None), ("512 KB cap", 512 * 1024)):
+        tracemalloc.start()
+        core = TerminalCore(TEXT_COLS, TEXT_ROWS, max_chars=max_chars)
+        fed = 0
+        for target in BUFFER_SIZES:
+            while fed < target:
+                core.insert(line)
+                fed += len(line)
+            results.setdefault(target, []).append(tracemalloc.get_traced_memory()[0])
+        tracemalloc.stop()
+        del core
+    print(f"{'fed':>8} {'unbounded':>12} {'512 KB cap':>12}")
+    for target, (a_mem, b_mem) in results.items():
+        print(f"{_fmt_size(target):>8} {a_mem / 1024 / 1024:>9.1f} MB {b_mem / 1024 / 1024:>9.1f} MB")
+
+def _menu_screen(n):
+    # 类似 TELCOM 菜单的全屏画面：清屏、逐行定位、反显标题
+    out = ["\x1bE\x1bp" + f" MENU {n:<{TEXT_COLS - 6}}"[:TEXT_COLS] + "\x1bq"]
+    for r in range(1, TEXT_ROWS):
+        out.append(f"\x1bY{chr(32 + r)}{chr(32 + 2)}item {r}.{n}\x1bK")
+    return "".join(out)
+
+def bench_raster():
+    """
+    光栅 LCD 后端：整屏合成（每帧所有格子都变化的滚屏 / 只改一个字符）与转为 PIL 图像的每帧耗时。
+    推送到 PhotoImage 需要显示器，不在此测量
+    """
+    try:
+        from raster import GlyphAtlas, RasterFrame, load_pil_font
+    except ImportError as e:
+        print(f"== 光栅渲染：跳过（{e}）==")
+        return
+    print("== 光栅渲染（NumPy 合成）==")
+    here = os.path.dirname(os.path.abspath(__file__))
+    family = "Another Mans Treasure MIA Raw"
+    font = load_pil_font(family, 40, {family: os.path.join(here, "..", "fonts", "AnotherMansTreasureMIARaw.ttf")})
+    # 每行各不相同，滚动一行时几乎所有格子都变化
+    rows = ["".join(chr(33 + (k * 7 + c * 13) % 94) for c in range(TEXT_COLS)) for k in range(97)]
+    for grid in (0, 3):
+        t0 = time.perf_counter()
+        atlas = GlyphAtlas(font, 26, 40, pixel_grid=grid)
+        atlas_ms = (time.perf_counter() - t0) * 1000
+        frame = RasterFrame(atlas, TEXT_COLS, TEXT_ROWS)
+        # 滚屏：每帧所有行都换一行
+        n = 500
+        t0 = time.perf_counter()
+        cells = 0
+        for k in range(n):
+            cells += frame.compose([rows[(k + r) % len(rows)] for r in range(TEXT_ROWS)])
+            frame.image()
+        scroll = (time.perf_counter() - t0) / n
+        # 输入：每帧只多一个字符
+        line = ""
+        t0 = time.perf_counter()
+        for k in range(n):
+            line = (line + "x") if len(line) < TEXT_COLS else ""
+            frame.compose(["prompt", line])
+            frame.image()
+        typing = (time.perf_counter() - t0) / n
+        print(f"pixel_grid {grid}: atlas {atlas_ms:.1f} ms, scroll {scroll * 1000:.2f} ms/frame "
+              f"({cells // n} cells), typing {typing * 1000:.3f} ms/frame")
+
+def bench_search():
+    """
+    滚动缓冲区搜索：约 4 MB 文本（行模式），比较
+    带三字组索引的 TerminalCore.search() 与每次扫描整个 raw_text（lower().find）的查询耗时，
+    以及索引对插入吞吐量的影响、空闲时分批建索引（模拟界面每插入 100 块调用一次 index_pending(4)）的
+    单批最长耗时、之后首次搜索的耗时和索引大小
+    """
+    import random
+    print("== 滚动缓冲区搜索（约 4 MB）==")
+    rnd = random.Random(7)
+    words = ("serial model telcom basic modem battery memory display keyboard printer cassette "
+             "deepseek buffer cursor screen scroll").split()
+    chunks = []
+    for k in range(60000):
+        chunks.append(" ".join(rnd.choice(words) for _ in range(rnd.randint(3, 12))) + f" #{k}\n")
+    for indexed in (False, True):
+        core = TerminalCore(TEXT_COLS, TEXT_ROWS, search_index=indexed)
+        inserting = indexing = worst = 0.0
+        for k, c in enumerate(chunks):
+            t0 = time.perf_counter()
+            core.insert(c)
+            t1 = time.perf_counter()
+            inserting += t1 - t0
+            if indexed and k % 100 == 99:
+                core.index_pending(4)
+                t2 = time.perf_counter()
+                indexing += t2 - t1
+                worst = max(worst, t2 - t1)
+        label = "indexed" if indexed else "no index"
+        extra = ""
+        if indexed:
+            t0 = time.perf_counter()
+            core.search("#0 ", 0, 0)
+            first = time.perf_counter() - t0
+            extra = (f", idle indexing {indexing * 1000:.0f} ms total (max {worst * 1000:.1f} ms/batch), "
+                     f"first search {first * 1000:.1f} ms, index {core.search_index.memory_bytes() / 1024 / 1024:.1f} MB")
+        print(f"{label:>9}: insert {len(chunks) / inserting:>8.0f} chunks/s, {len(core.raw_text) / 1024 / 1024:.1f} MB{extra}")
+    queries = ["#59999", "#123", "printer cassette modem", "keyboard #4242", "no such text"]
+    text = str(core.raw_text)
+    print(f"{'query':>24} {'raw scan':>10} {'indexed':>10}")
+    for q in queries:
+        t0 = time.perf_counter()
+        text.lower().find(q.lower())
+        scan = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        pos = core.search(q, 0, 0)
+        fast = time.perf_counter() - t0
+        print(f"{q:>24} {scan * 1000:>8.1f}ms {fast * 1000:>8.2f}ms  {pos}")
+
+def bench_vt52():
+    """
+    VT52 解析：全屏菜单画面（清屏 + 光标定位 + 反显）按整块与逐字节送入时的吞吐量
+    """
+    print("== VT52 转义序列解析 ==")
+    screens = [_menu_screen(n) for n in range(2000)]
+    total = sum(len(x) for x in screens)
+    for label, step in (("whole chunk", None), ("1 byte", 1)):
+        core = TerminalCore(TEXT_COLS, TEXT_ROWS)
+        t0 = time.perf_counter()
+        for screen in screens:
+            if step is None:
+                core.write(screen)
+            else:
+                for i in range(0, len(screen), step):
+                    core.write(screen[i:i + step])
+        elapsed = time.perf_counter() - t0
+        print(f"{label:>12}: {len(screens) / elapsed:>8.0f} screens/s, {total / elapsed / 1024:>8.0f} KB/s")
+    # 回车：全屏模式下回到行首覆盖写入（经 SerialProtocol，与串口路径相同）
+    core = TerminalCore(TEXT_COLS, TEXT_ROWS)
+    proto = SerialProtocol(display=core.write, send=lambda t: None, query=lambda t: None)
+    proto.feed(b"\x1bEabc\rX")
+    got = core.screen.lines()[0].rstrip()
+    print(f"  CR overwrite: {got!r} ({'ok' if got == 'Xbc' else 'FAIL, expected Xbc'})")
+    assert got == "Xbc", f"CR overwrite: got {got!r}, expected 'Xbc'"
+
+_MARKDOWN_REPLY = (
+    "## Summary\n\n"
+    "The **TRS-80 Model 100** is a *portable* computer from 1983 \u2014 it runs on four AA batteries "
+    "and has a built-in modem. See [the manual](https://example.com/m100/manual.pdf) for details.\n\n"
+    "- Display: 40\u00d78 characters\n"
+    "- Memory: 8\u201332 KB\n"
+    "* Software: BASIC, TEXT, TELCOM\u2026\n\n"
+    "```basic\n10 PRINT \u201cHELLO\u201d\n20 GOTO 10\n```\n\n"
+    "> Tip: use `CALL 63012` to reset.\n\n"
+    "\u4e2d\u6587\u56de\u590d\u4e5f\u4f1a\u88ab\u66ff\u6362\u3002 Caf\u00e9 na\u00efve r\u00e9sum\u00e9.\n"
+)
+
+def bench_reflow():
+    """
+    回复整理（去 Markdown + 转写 + 折行）：逐段送入与一次送入的输出是否一致、
+    吞吐量，以及串口上节省的字节数
+    """
+    from reflow import ReplyFormatter
+    print("== 回复整理（Markdown / 转写 / 折行）==")
+    reply = _MARKDOWN_REPLY * 20
+    whole = ReplyFormatter(TEXT_COLS)
+    expected = whole.feed(reply) + whole.flush()
+    for label, step in (("whole", None), ("4 chars", 4), ("1 char", 1)):
+        fmt = ReplyFormatter(TEXT_COLS)
+        t0 = time.perf_counter()
+        if step is None:
+            out = fmt.feed(reply) + fmt.flush()
+        else:
+            out = "".join(fmt.feed(reply[i:i + step]) for i in range(0, len(reply), step)) + fmt.flush()
+        elapsed = time.perf_counter() - t0
+        same = "same" if out == expected else "DIFFERENT"
+        print(f"{label:>8}: {len(reply) / elapsed / 1024:>8.0f} KB/s  ({same})")
+        assert out == expected, f"{label} reflow differs from whole-buffer reflow"
+    width = max(len(line) for line in expected.splitlines())
+    raw_bytes = len(reply.replace("\n", "\r\n").encode())
+    out_bytes = len(expected.replace("\n", "\r\n").encode())
+    print(f"wire bytes: {raw_bytes} -> {out_bytes} ({100 - out_bytes * 100 / raw_bytes:.1f}% saved), "
+          f"widest line {width}, ascii {expected.isascii()}")
+    print(expected[:len(expected) // 20])
+
+def bench_xmodem():
+    """
+    pty 回环上的 XMODEM：两端都用 Transfer（发送方在串口端，接收方在 master 端），
+    测量有效吞吐、协议效率（有效字节 / 线路字节）和 9600 波特率下的理论速率
+    """
+    import tempfile
+    from serial_io import SerialReader
+    from transfer import Transfer
+    print("== XMODEM（pty 回环）==")
+    master, ser = open_pty_serial()
+    payload = bytes(range(256)) * 256
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, "src.bin")
+        dst = os.path.join(tmp, "dst.bin")
+        with open(src, "wb") as f:
+            f.write(payload)
+        done = threading.Event()
+        sender = Transfer("xmodem-send", src, ser.write, lambda d, t: None, lambda ok, m: None, 9600)
+        receiver = Transfer("xmodem-recv", dst, lambda b: os.write(master, b), lambda d, t: None,
+                            lambda ok, m: done.set(), 9600)
+        stop = threading.Event()
+        reader = SerialReader(ser, timeout=0.2)
+        reader_thread = threading.Thread(target=reader.run, args=(sender.feed, stop), daemon=True)
+        reader_thread.start()
+
+        def pump_master():
+            import select
+            while not stop.is_set():
+                if select.select([master], [], [], 0.2)[0]:
+                    receiver.feed(os.read(master, 4096))
+
+        pump = threading.Thread(target=pump_master, daemon=True)
+        pump.start()
+        sender.start()
+        receiver.start()
+        finished = done.wait(60)
+        # 两个线程都退出后才能关闭它们正在读的文件描述符
+        stop.set()
+        pump.join()
+        reader_thread.join()
+        with open(dst, "rb") as f:
+            ok = f.read() == payload
+        efficiency = sender.payload_bytes / max(1, sender.wire_bytes)
+        print(f"transferred:            {len(payload) // 1024} KB, intact={ok}, retries={sender.retransmits}")
+        print(f"pty throughput:         {receiver.rate() / 1024:.0f} KB/s")
+        print(f"protocol efficiency:    {efficiency * 100:.1f}% -> {960 * efficiency:.0f} B/s at 9600 8N1")
+        assert finished, "XMODEM transfer did not finish"
+        assert ok, "XMODEM transfer: received file differs from the sent file"
+
+        # 纯文本接收：CRLF 被拆在两次读取之间（先到 '\r'，稍后到 '\n'）不应多出空行
+        text_dst = os.path.join(tmp, "up.txt")
+        text_done = threading.Event()
+        text_recv = Transfer("text-recv", text_dst, lambda b: None, lambda d, t: None,
+                             lambda ok, m: text_done.set(), 9600, timeout=0.5)
+        text_recv.start()
+        for piece in (b"line 1\r", b"\nline 2\r\nline 3\r", b"\n\x1a"):
+            text_recv.feed(piece)
+            time.sleep(0.3)
+        assert text_done.wait(5), "text-recv did not finish"
+        with open(text_dst, "rb") as f:
+            got = f.read()
+        ok = got == b"line 1\nline 2\nline 3\n"
+        print(f"text-recv split CRLF:   {got!r} ({'ok' if ok else 'FAIL'})")
+        assert ok, f"text-recv split CRLF: got {got!r}"
+    ser.close()
+    os.close(master)
+
+def bench_pty_terminal():
+    """
+    用 pty 模拟 Model 100，驱动无界面的 SerialReader -> SerialProtocol -> TerminalCore：
+    - 按键到屏幕延迟：写出一个字符，模拟设备回显，直到它出现在可视区；
+    - 串口吞吐：设备整块输出，直到全部显示。
+    """
+    from serial_io import SerialReader
+    print("== 终端（pty 模拟 Model 100）==")
+    master, ser = open_pty_serial()
+    core = TerminalCore(TEXT_COLS, TEXT_ROWS, max_chars=512 * 1024)
+    shown = threading.Condition()
+
+    def display(text):
+        with shown:
+            core.write(text)
+            core.visible_lines()
+            shown.notify_all()
+
+    protocol = SerialProtocol(display=display, send=lambda t: None, query=lambda t: None)
+    reader = SerialReader(ser, timeout=0.5)
+    stop = threading.Event()
+    threading.Thread(target=reader.run, args=(protocol.feed, stop), daemon=True).start()
+
+    # 模拟设备：把收到的字符原样回显
+    echo_on = threading.Event()
+    echo_on.set()
+
+    def device():
+        while not stop.is_set():
+            try:
+                data = os.read(master, 1024)
+            except OSError:
+                return
+            if echo_on.is_set():
+                os.write(master, data)
+
+    threading.Thread(target=device, daemon=True).start()
+
+    latencies = []
+    for i in range(200):
+        ch = chr(ord("a") + i % 26)
+        with shown:
+            before = core.chars_inserted
+            t0 = time.perf_counter()
+            ser.write(ch.encode())
+            ok = shown.wait_for(lambda: core.chars_inserted > before, timeout=2)
+            latencies.append(time.perf_counter() - t0)
+        assert ok, f"keystroke {ch!r} was not echoed to the screen"
+    latencies.sort()
+    print(f"keystroke->screen:      p50 {latencies[len(latencies) // 2] * 1000:.2f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f} ms")
+
+    echo_on.clear()
+    payload = ("The quick brown fox jumps over the lazy dog 0123456789\r\n" * 4000).encode()
+    expected = core.chars_inserted + len(payload.replace(b"\r", b""))
+    t0 = time.perf_counter()
+    os.write(master, payload)
+    with shown:
+        ok = shown.wait_for(lambda: core.chars_inserted >= expected, timeout=30)
+    elapsed = time.perf_counter() - t0
+    assert ok, f"serial -> screen: {core.chars_inserted}/{expected} characters shown"
+    assert core.chars_inserted == expected, f"serial -> screen: {core.chars_inserted} characters shown, expected {expected}"
+    print(f"serial -> screen:       {len(payload) / elapsed / 1024:.0f} KB/s, "
+          f"{core.inserts} inserts, {reader.wakeups} wakeups")
+
+    stop.set()
+    ser.close()
+    os.close(master)
+
+def bench_capture():
+    """
+    会话录制与回放：串口路径上 record() 的每次调用耗时（后台线程写盘），
+    以及把约 0.6 MB 的录制（文本行与全屏菜单画面交替）尽快回放经过 SerialProtocol + TerminalCore 的吞吐量
+    """
+    import tempfile
+    from capture import CaptureWriter, KIND_IN, KIND_OUT, replay
+    print("== 会话录制与回放 ==")
+    chunks = []
+    for n in range(6000):
+        if n % 3 == 0:
+            chunks.append((KIND_IN, _menu_screen(n).encode()))
+        else:
+            chunks.append((KIND_IN, f"line {n} the quick brown fox jumps over the lazy dog\r\n".encode()))
+        if n % 50 == 0:
+            chunks.append((KIND_OUT, b"ok\r\n"))
+    total = sum(len(d) for _, d in chunks)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.m100cap")
+        writer = CaptureWriter(path)
+        worst = 0.0
+        t0 = time.perf_counter()
+        for kind, data in chunks:
+            t = time.perf_counter()
+            writer.record(kind, 0, data)
+            worst = max(worst, time.perf_counter() - t)
+        elapsed = time.perf_counter() - t0
+        writer.close()
+        st = writer.stats()
+        print(f"  record: {elapsed / len(chunks) * 1e6:.2f} us/call (max {worst * 1e6:.0f} us), "
+              f"{st['records']} records, {st['bytes'] / 1024 / 1024:.1f} MB in {st['flushes']} writes, "
+              f"dropped {st['dropped']}")
+        cores, rs = replay(path, TEXT_COLS, TEXT_ROWS, speed=None)
+        ch = rs["chunk"]
+        print(f"  replay: {rs['records'] / rs['elapsed']:>8.0f} records/s, {total / rs['elapsed'] / 1024 / 1024:.1f} MB/s, "
+              f"chunk mean {ch['mean'] * 1e6:.0f} us p99 {ch['p99'] * 1e6:.0f} us, {cores[0].line_count()} lines")
+
+BENCHMARKS = {
+    "buffer": bench_text_buffer,
+    "wrap": bench_wrap_index,
+    "serial": bench_serial_reader,
+    "mux": bench_serial_mux,
+    "idle": bench_idle,
+    "deepseek": bench_deepseek_stream,
+    "llm": bench_llm_tail,
+    "core": bench_core,
+    "search": bench_search,
+    "startup": bench_startup,
+    "vt52": bench_vt52,
+    "raster": bench_raster,
+    "reflow": bench_reflow,
+    "xmodem": bench_xmodem,
+    "terminal": bench_pty_terminal,
+    "capture": bench_capture,
+}
+
+def main():
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"未知的测试项目: {name}（可选: {', '.join(BENCHMARKS)}）")
+            sys.exit(1)
+        BENCHMARKS[name]()
+        print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+# capture.py
+# 串口会话录制与回放：收发的每一块数据带时间戳追加到紧凑的二进制日志，由后台线程批量写盘；
+# 回放把录制的数据送回终端核心（按录制速度或尽快），兼作负载测试：
+#   python capture.py 录制文件 [--fast | --speed 倍数] [--session 会话号] [--echo]
+import argparse, os, struct, sys, threading, time
+
+from metrics import Histogram
+from terminal_core import TerminalCore, SerialProtocol
+
+MAGIC = b"M100CAP1"
+# 记录头：时间偏移（微秒，相对本次录制开始）、类型、会话号、数据长度；其后为数据
+_RECORD = struct.Struct("<QBBI")
+
+KIND_IN = 0             # 从 Model 100 收到（交给串口协议处理）
+KIND_OUT = 1            # 发往 Model 100
+KIND_START = 2          # 一次录制开始或换新文件（数据为当时的 UNIX 时间），之后的时间偏移相对该记录计
+KIND_TRANSFER_IN = 3    # 文件传输期间收到的原始字节
+KIND_TRANSFER_OUT = 4   # 文件传输发出的原始字节
+
+KIND_NAMES = {KIND_IN: "in", KIND_OUT: "out", KIND_START: "start",
+              KIND_TRANSFER_IN: "xfer-in", KIND_TRANSFER_OUT: "xfer-out"}
+
+
+class CaptureWriter:
+    """
+    追加写入的录制文件（所有会话共用一个，记录中带会话号）。
+    record() 可在任意线程中调用，只把打包好的记录追加到内存缓冲区（不做 I/O）；
+    后台线程在有数据后等待 flush_interval 秒攒成一批（或缓冲区达到 flush_bytes 时立即）整批写盘，
+    没有数据时完全阻塞，不产生定时唤醒。
+    磁盘跟不上、积压超过 max_pending 字节时丢弃新记录并计数，串口路径永远不会等待磁盘。
+    文件超过 max_file_bytes 时改名为 path + ".1"（保留上一份）并开始新文件：打开时检查一次，
+    之后由后台线程在每批写入前检查，长时间运行的会话也不会无限增长。
+    """
+
+    def __init__(self, path, flush_interval=0.5, flush_bytes=64 * 1024, max_pending=8 * 1024 * 1024,
+                 max_file_bytes=None):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.max_pending = max_pending
+        self.max_file_bytes = max_file_bytes
+        if max_file_bytes and os.path.exists(path) and os.path.getsize(path) > max_file_bytes:
+            os.replace(path, path + ".1")
+        self.file = open(path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+        self.t0 = time.monotonic()
+
+        self.cond = threading.Condition()
+        self.pending = []
+        self.pending_bytes = 0
+        self.closed = False
+
+        # 统计
+        self.records = 0
+        self.dropped = 0
+        self.bytes_written = 0
+        self.flushes = 0
+        self.rotations = 0
+        self.errors = 0
+
+        self.record(KIND_START, 0, repr(time.time()).encode())
+        self.thread = threading.Thread(target=self._run, name="capture-writer", daemon=True)
+        self.thread.start()
+
+    def record(self, kind, session, data):
+        if not data:
+            return
+        t = int((time.monotonic() - self.t0) * 1e6)
+        rec = _RECORD.pack(t, kind, session, len(data)) + data
+        with self.cond:
+            if self.closed:
+                return
+            if self.pending_bytes + len(rec) > self.max_pending:
+                self.dropped += 1
+                return
+            was_empty = not self.pending
+            self.pending.append(rec)
+            self.pending_bytes += len(rec)
+            self.records += 1
+            if was_empty or self.pending_bytes >= self.flush_bytes:
+                self.cond.notify()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.pending and not self.closed:
+                    self.cond.wait()
+                if not self.closed and self.pending_bytes < self.flush_bytes:
+                    # 攒一批再写，减少系统调用
+                    self.cond.wait(self.flush_interval)
+                batch, self.pending, self.pending_bytes = self.pending, [], 0
+                closed = self.closed
+            if batch:
+                self._write(b"".join(batch))
+            if closed:
+                return
+
+    def _write(self, data):
+        try:
+            size = self.file.tell()
+            if self.max_file_bytes and size > len(MAGIC) and size + len(data) > self.max_file_bytes:
+                self._rotate(_RECORD.unpack_from(data)[0])
+            self.file.write(data)
+            self.file.flush()
+            self.bytes_written += len(data)
+            self.flushes += 1
+        except OSError as e:
+            self.errors += 1
+            if self.errors == 1:
+                print(f"录制文件写入错误: {e}")
+
+    def _rotate(self, t):
+        """
+        当前文件改名为 path + ".1"，之后的记录写入新文件；新文件以时间偏移为 t（本批第一条记录的时间）的
+        KIND_START 记录开头，回放时从这里计时
+        """
+        self.file.close()
+        try:
+            os.replace(self.path, self.path + ".1")
+        finally:
+            # 改名失败时继续追加到原文件，下一批再试
+            self.file = open(self.path, "ab")
+        if self.file.tell() == 0:
+            start = repr(time.time()).encode()
+            self.file.write(MAGIC + _RECORD.pack(t, KIND_START, 0, len(start)) + start)
+        self.rotations += 1
+
+    def close(self):
+        """
+        写出剩余的记录并关闭文件
+        """
+        with self.cond:
+            if self.closed:
+                return
+            self.closed = True
+            self.cond.notify()
+        self.thread.join()
+        self.file.close()
+
+    def stats(self):
+        return {"records": self.records, "dropped": self.dropped, "bytes": self.bytes_written,
+                "flushes": self.flushes, "rotations": self.rotations, "errors": self.errors}
+
+
+def read_capture(path):
+    """
+    逐条读出录制文件，生成 (时间偏移秒, 类型, 会话号, 数据)；
+    末尾不完整的记录（程序在写入中途退出）忽略
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"不是录制文件: {path}")
+        size = _RECORD.size
+        while True:
+            head = f.read(size)
+            if len(head) < size:
+                return
+            t, kind, session, n = _RECORD.unpack(head)
+            data = f.read(n)
+            if len(data) < n:
+                return
+            yield t / 1e6, kind, session, data
+
+
+def replay(path, cols=40, rows=8, speed=1.0, session=None, echo=False, max_chars=None):
+    """
+    回放录制文件：每个会话一个 TerminalCore，收到的数据经 SerialProtocol 交给 core.write()，
+    与程序中的处理路径相同（命令会被识别，但回送和 DeepSeek 提问只计数）。
+    发往设备的数据在程序中经本地回显另行显示，默认只计数；echo 为 True 时作为回显插入（近似）。
+    文件传输的原始字节只计数。session 不为 None 时只回放该会话。
+    speed 为 None 时尽快回放，否则按录制的时间间隔除以 speed 等待。
+    返回 (各会话的 TerminalCore, 统计)；统计中 chunk 为每块数据的处理耗时分布，lag 为落后于录制时间的最大值。
+    """
+    cores = {}
+    protocols = {}
+    counts = {"queries": 0, "replies": 0}
+    chunk = Histogram()
+    stats = {"records": 0, "bytes_in": 0, "bytes_out": 0, "bytes_transfer": 0, "runs": 0, "lag": 0.0}
+
+    def query(text):
+        counts["queries"] += 1
+
+    def send(text):
+        counts["replies"] += 1
+
+    def session_state(index):
+        core = cores.get(index)
+        if core is None:
+            core = cores[index] = TerminalCore(cols, rows, max_chars)
+            protocols[index] = SerialProtocol(display=core.write, send=send, query=query)
+        return core, protocols[index]
+
+    start = time.perf_counter()
+    base = 0.0      # 当前录制段在整个回放时间线上的起点
+    origin = 0.0    # 当前录制段 KIND_START 记录的时间偏移（换新文件时不为 0）
+    last = 0.0
+    for t, kind, index, data in read_capture(path):
+        if kind == KIND_START:
+            # 新的一次录制：接在上一段之后，不回放两次运行之间的间隔
+            base = last
+            origin = t
+            stats["runs"] += 1
+            continue
+        if session is not None and index != session:
+            continue
+        last = base + t - origin
+        if speed is not None:
+            delay = start + last / speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                stats["lag"] = max(stats["lag"], -delay)
+        stats["records"] += 1
+        t0 = time.perf_counter()
+        if kind == KIND_IN:
+            stats["bytes_in"] += len(data)
+            session_state(index)[1].feed(data)
+        elif kind == KIND_OUT:
+            stats["bytes_out"] += len(data)
+            if echo:
+                session_state(index)[0].insert(data.decode("utf-8", errors="replace").replace("\r", ""))
+        else:
+            stats["bytes_transfer"] += len(data)
+        chunk.observe(time.perf_counter() - t0)
+    stats["elapsed"] = time.perf_counter() - start
+    stats["recorded"] = last
+    stats["chunk"] = chunk.snapshot()
+    stats.update(counts)
+    return cores, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回放串口会话录制文件（兼作负载测试）")
+    parser.add_argument("path")
+    parser.add_argument("--fast", action="store_true", help="尽快回放（不按录制时间等待）")
+    parser.add_argument("--speed", type=float, default=1.0, help="回放速度倍数（默认按录制速度）")
+    parser.add_argument("--session", type=int, default=None, help="只回放该会话号（默认全部）")
+    parser.add_argument("--echo", action="store_true", help="发往设备的数据也作为本地回显插入")
+    parser.add_argument("--cols", type=int, default=40)
+    parser.add_argument("--rows", type=int, default=8)
+    args = parser.parse_args()
+    try:
+        cores, st = replay(args.path, args.cols, args.rows, None if args.fast else args.speed,
+                           args.session, args.echo)
+    except (OSError, ValueError) as e:
+        print(f"回放失败: {e}")
+        sys.exit(1)
+    elapsed = max(st["elapsed"], 1e-9)
+    ch = st["chunk"]
+    print(f"回放 {st['records']} 条记录（{st['runs']} 次录制）, 录制时长 {st['recorded']:.1f} s, "
+          f"回放耗时 {st['elapsed']:.2f} s")
+    print(f"收到 {st['bytes_in']} 字节（{st['bytes_in'] / elapsed / 1024:.0f} KB/s）, 发出 {st['bytes_out']} 字节, "
+          f"文件传输 {st['bytes_transfer']} 字节")
+    print(f"每块处理耗时 平均 {ch['mean'] * 1e6:.0f} us / p99 {ch['p99'] * 1e6:.0f} us / 最大 {ch['max'] * 1e6:.0f} us, "
+          f"最大落后 {st['lag'] * 1000:.1f} ms")
+    print(f"识别到提问 {st['queries']} 次, 回送 {st['replies']} 次")
+    for index, core in sorted(cores.items()):
+        print(f"--- 会话 {index}: {core.line_count()} 行，可视区 ---")
+        for line in core.visible_lines():
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# commands.py
+# 串口协议中的 ##COMMAND## 命令：流式匹配器 + 可扩展的命令注册表
+
+
+class CommandMatcher:
+    """
+    Aho-Corasick 多模式流式匹配器。
+    每个输入字符只处理一次，状态在多次 feed() 之间保留，命令被拆在两次读取中也能识别。
+    """
+
+    def __init__(self, patterns=()):
+        self.patterns = list(patterns)
+        self._build()
+        self.state = 0
+
+    def _build(self):
+        # goto 表、失败指针、输出（以该状态结尾的模式）
+        goto = [{}]
+        out = [[]]
+        for pat in self.patterns:
+            s = 0
+            for ch in pat:
+                nxt = goto[s].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[s][ch] = nxt
+                    goto.append({})
+                    out.append([])
+                s = nxt
+            out[s].append(pat)
+        fail = [0] * len(goto)
+        queue = list(goto[0].values())
+        for s in queue:
+            for ch, t in goto[s].items():
+                f = fail[s]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[t] = goto[f].get(ch, 0)
+                out[t] = out[t] + out[fail[t]]
+                queue.append(t)
+        self._goto = goto
+        self._fail = fail
+        self._out = out
+        # 模式首字符集合：处于初始状态且块中不含这些字符时可整块跳过
+        self._first = frozenset(p[0] for p in self.patterns if p)
+
+    def reset(self):
+        self.state = 0
+
+    def feed(self, text):
+        """
+        处理一段文本，返回其中完成匹配的模式列表（按出现顺序）
+        """
+        if self.state == 0 and not any(ch in text for ch in self._first):
+            return []
+        goto, fail, out = self._goto, self._fail, self._out
+        s = self.state
+        found = []
+        for ch in text:
+            while s and ch not in goto[s]:
+                s = fail[s]
+            s = goto[s].get(ch, 0)
+            if out[s]:
+                found.extend(out[s])
+        self.state = s
+        return found
+
+
+class CommandRegistry:
+    """
+    ##NAME## 命令注册表。
+    register("NAME", handler) 后，串口上出现 ##NAME## 的那一行结束时调用 handler(protocol, line)。
+    新命令只需注册，不必修改读取循环。
+    """
+
+    def __init__(self):
+        self.handlers = {}
+        self.version = 0    # 每次注册递增，使用者据此重建匹配器
+
+    @staticmethod
+    def pattern(name):
+        return f"##{name}##"
+
+    def register(self, name, handler):
+        self.handlers[self.pattern(name)] = handler
+        self.version += 1
+
+    def command(self, name):
+        """
+        装饰器形式的 register
+        """
+        def deco(fn):
+            self.register(name, fn)
+            return fn
+        return deco
+
+    def new_matcher(self):
+        return CommandMatcher(self.handlers)
+
+    def handler_for(self, pattern):
+        return self.handlers.get(pattern)
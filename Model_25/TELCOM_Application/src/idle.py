@@ -0,0 +1,95 @@
+# idle.py
+# 空闲调度：一段时间没有按键和串口收发时停止定时器、让读取线程完全阻塞（电池供电时省电）
+import time
+
+
+class IdleGovernor:
+    """
+    timeout 秒内没有 poke()（按键、串口收发）就进入空闲并调用 on_idle()；
+    空闲后第一次 poke() 立即调用 on_active() 恢复。
+    活动期间 poke() 只记录时间、不重新安排定时器，检查定时器每 timeout 秒最多运行一次；
+    空闲期间不安排任何定时器。poke() 只能在 Tk 主线程中调用。
+    """
+
+    def __init__(self, root, timeout, on_idle, on_active):
+        self.root = root
+        self.timeout = timeout
+        self.on_idle = on_idle
+        self.on_active = on_active
+        self.idle = False
+        self.last_activity = time.monotonic()
+        self.idle_since = 0.0
+        self.check_id = None
+
+        # 统计：进入空闲次数 / 累计空闲时间（秒）
+        self.idle_count = 0
+        self.idle_seconds = 0.0
+
+        if timeout > 0:
+            self._schedule(timeout)
+
+    def poke(self):
+        now = time.monotonic()
+        self.last_activity = now
+        if not self.idle:
+            return
+        self.idle = False
+        self.idle_seconds += now - self.idle_since
+        self.on_active()
+        self._schedule(self.timeout)
+
+    def _schedule(self, delay):
+        self.check_id = self.root.after(max(1, int(delay * 1000)), self._check)
+
+    def _check(self):
+        self.check_id = None
+        remaining = self.last_activity + self.timeout - time.monotonic()
+        if remaining > 0:
+            self._schedule(remaining)
+            return
+        self.idle = True
+        self.idle_since = time.monotonic()
+        self.idle_count += 1
+        self.on_idle()
+
+    def cancel(self):
+        if self.check_id is not None:
+            self.root.after_cancel(self.check_id)
+            self.check_id = None
+
+    def stats(self):
+        idle_seconds = self.idle_seconds + (time.monotonic() - self.idle_since if self.idle else 0.0)
+        return {"idle": self.idle, "idle_count": self.idle_count, "idle_seconds": idle_seconds}
+
+
+class IdleTask:
+    """
+    分批执行的后台工作（例如为滚动缓冲区建立搜索索引），在 Tk 主线程中运行。
+    request() 表示有新的工作：没有已安排的批次时在 delay_ms 毫秒后运行一次 step()；
+    step() 每次只做有限的工作，返回 True 表示还有剩余，隔 delay_ms 毫秒再运行下一批。
+    工作做完后不再安排定时器，不会在空闲时产生唤醒。
+    """
+
+    def __init__(self, root, step, delay_ms=50):
+        self.root = root
+        self.step = step
+        self.delay_ms = delay_ms
+        self.pending_id = None
+
+        # 统计：运行的批次数
+        self.runs = 0
+
+    def request(self):
+        if self.pending_id is None:
+            self.pending_id = self.root.after(self.delay_ms, self._run)
+
+    def _run(self):
+        self.pending_id = None
+        self.runs += 1
+        if self.step():
+            self.request()
+
+    def cancel(self):
+        if self.pending_id is not None:
+            self.root.after_cancel(self.pending_id)
+            self.pending_id = None
@@ -0,0 +1,518 @@
+# llm.py
+import hashlib, json, os, queue, random, sqlite3, threading, time, zlib
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ResponseCache:
+    """
+    DeepSeek 回复的本地磁盘缓存（SQLite）。
+    - 键：规范化后的提问（合并空白、忽略大小写）+ 模型 + 系统提示词 的 SHA-256；
+    - 按回复总字节数做 LRU 淘汰（超过 max_bytes 时删除最久未使用的条目）；
+    - 超过 ttl 秒的条目视为未命中并删除；
+    - 统计命中 / 未命中次数。
+    可在多个线程中使用（内部加锁）。
+    """
+
+    def __init__(self, path, max_bytes=1024 * 1024, ttl=24 * 3600):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, reply TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS cache_lru ON cache (last_used)")
+        self.total_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+
+        # 统计
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(prompt, model, system_prompt, context=""):
+        """
+        context：对话历史的摘要（Conversation.digest()），有上下文时只命中相同上下文下的提问
+        """
+        normalized = " ".join(prompt.split()).casefold()
+        return hashlib.sha256("\0".join((model, system_prompt, context, normalized)).encode()).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT reply, size, created FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[2] > self.ttl:
+                self._db.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self.total_bytes -= row[1]
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE cache SET last_used = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, reply):
+        size = len(reply.encode())
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            old = self._db.execute("SELECT size FROM cache WHERE key = ?", (key,)).fetchone()
+            if old is not None:
+                self.total_bytes -= old[0]
+            self._db.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)", (key, reply, size, now, now))
+            self.total_bytes += size
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # 从最久未使用的条目开始删除，直到总大小不超过上限
+        rows = self._db.execute("SELECT key, size FROM cache ORDER BY last_used").fetchall()
+        doomed = []
+        for key, size in rows:
+            if self.total_bytes <= self.max_bytes:
+                break
+            doomed.append((key,))
+            self.total_bytes -= size
+        self._db.executemany("DELETE FROM cache WHERE key = ?", doomed)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0, "bytes": self.total_bytes}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def estimate_tokens(text):
+    """
+    粗略估计 token 数（约 4 个字符一个 token，中日韩字符约一字一个），不依赖分词器
+    """
+    wide = sum(1 for ch in text if ord(ch) > 0x2E80)
+    return (len(text) - wide) // 4 + wide + 1
+
+
+class Conversation:
+    """
+    一个会话的对话历史（DeepSeek 模式下的多轮上下文）。
+    - messages() 按 token 预算从最新一轮往前取历史；放不下的旧轮次压缩成一条简短摘要
+      （每轮只保留提问的开头），摘要本身限制在预算的 1/4 以内，请求大小和延迟保持有界；
+    - 每次变化后以 zlib 压缩的 JSON 原子写入 path，重启后恢复；
+    - reset() 清空历史（##RESET## 命令）。
+    可在多个线程中使用（内部加锁）。
+    """
+
+    SUMMARY_CHARS = 60      # 摘要中每轮提问保留的字符数
+
+    def __init__(self, path=None, token_budget=2000, max_turns=200):
+        self.path = path
+        self.token_budget = token_budget
+        self.max_turns = max_turns
+        self.turns = []         # [(user, assistant)]
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "rb") as f:
+                data = json.loads(zlib.decompress(f.read()))
+            self.turns = [tuple(t) for t in data.get("turns", [])]
+        except (OSError, ValueError, zlib.error) as e:
+            print(f"对话历史读取失败: {e}")
+            self.turns = []
+
+    def save(self):
+        if not self.path:
+            return
+        data = zlib.compress(json.dumps({"turns": self.turns}, ensure_ascii=False,
+                                        separators=(",", ":")).encode(), 9)
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"对话历史保存失败: {e}")
+
+    def add(self, user, assistant):
+        with self._lock:
+            self.turns.append((user, assistant))
+            # 磁盘上也只保留最近 max_turns 轮
+            del self.turns[:-self.max_turns]
+            self.save()
+
+    def reset(self):
+        with self._lock:
+            self.turns = []
+            self.save()
+
+    def digest(self):
+        """
+        历史内容的摘要值（用于回复缓存的键）；没有历史时为空字符串
+        """
+        with self._lock:
+            if not self.turns:
+                return ""
+            return hashlib.sha256(json.dumps(self.turns[-8:]).encode()).hexdigest()[:16]
+
+    @staticmethod
+    def _fit(turns, budget):
+        # 从最新一轮往前，取预算内尽可能多的完整轮次
+        kept = []
+        for user, assistant in reversed(turns):
+            cost = estimate_tokens(user) + estimate_tokens(assistant)
+            if cost > budget:
+                break
+            budget -= cost
+            kept.append((user, assistant))
+        kept.reverse()
+        return kept
+
+    def messages(self, system_prompt, text):
+        """
+        组装请求消息：系统提示词 +（旧轮次摘要）+ 预算内的最近几轮 + 本次提问
+        """
+        with self._lock:
+            turns = list(self.turns)
+        budget = self.token_budget - estimate_tokens(system_prompt) - estimate_tokens(text)
+        summary_budget = self.token_budget // 4
+        kept = self._fit(turns, budget)
+        if len(kept) < len(turns):
+            # 有旧轮次放不下：为摘要留出空间后重新取
+            kept = self._fit(turns, budget - summary_budget)
+        dropped = turns[:len(turns) - len(kept)]
+
+        messages = [{"role": "system", "content": system_prompt}]
+        if dropped:
+            topics = []
+            for user, _ in reversed(dropped):
+                topic = " ".join(user.split())[:self.SUMMARY_CHARS]
+                summary_budget -= estimate_tokens(topic)
+                if summary_budget < 0:
+                    break
+                topics.append(topic)
+            if topics:
+                topics.reverse()
+                messages.append({"role": "system",
+                                 "content": "Earlier in this conversation the user asked about: " + "; ".join(topics)})
+        for user, assistant in kept:
+            messages.append({"role": "user", "content": user})
+            messages.append({"role": "assistant", "content": assistant})
+        messages.append({"role": "user", "content": text})
+        return messages
+
+
+class ProviderError(Exception):
+    pass
+
+
+class OpenAICompatibleProvider:
+    """
+    OpenAI 兼容接口的模型提供方：DeepSeek，或 Pi 上的本地服务器（如 llama.cpp server）。
+    客户端在第一次使用时创建并长期复用，HTTP 连接在多次请求之间复用。
+    """
+
+    def __init__(self, name, api_key, base_url, model):
+        self.name = name
+        self.api_key = api_key
+        self.base_url = base_url
+        self.model = model
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                # openai 包导入较慢（Pi 上约数百毫秒），第一次请求时才导入
+                from openai import OpenAI
+                self._client = OpenAI(api_key=self.api_key, base_url=self.base_url, max_retries=0)
+            return self._client
+
+    def stream(self, messages, timeout, cancelled):
+        """
+        流式请求，逐段产出回复文本；timeout 为本次请求剩余的秒数，cancelled 被设置时尽快停止
+        """
+        stream = self.client.with_options(timeout=timeout).chat.completions.create(
+            model=self.model,
+            messages=messages,
+            stream=True
+        )
+        try:
+            for chunk in stream:
+                if cancelled.is_set():
+                    break
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+        finally:
+            stream.close()
+
+    def close(self):
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+
+class MockProvider:
+    """
+    离线模拟的提供方（不访问网络）：first_delay 秒后逐词产出 reply，
+    fail_first 次请求直接失败，用于测试和无网络时演示重试/对冲。
+    """
+
+    def __init__(self, name="mock", reply="This is a mock reply.", first_delay=0.2, token_delay=0.02,
+                 fail_first=0):
+        self.name = name
+        self.model = name
+        self.reply = reply
+        self.first_delay = first_delay
+        self.token_delay = token_delay
+        self.fail_first = fail_first
+        self.requests = 0
+
+    def stream(self, messages, timeout, cancelled):
+        self.requests += 1
+        if self.requests <= self.fail_first:
+            raise ProviderError("mock failure")
+        if cancelled.wait(self.first_delay):
+            return
+        for i, word in enumerate(self.reply.split(" ")):
+            if i and cancelled.wait(self.token_delay):
+                return
+            yield (" " if i else "") + word
+
+    def close(self):
+        pass
+
+
+class _Attempt:
+    """
+    对某个提供方的一次请求，在自己的线程中运行；产出的文本和结果放进协调队列：
+    (attempt, "token", text) / (attempt, "done", None) / (attempt, "error", exception)
+    """
+
+    def __init__(self, provider, messages, timeout, out):
+        self.provider = provider
+        self.cancelled = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(messages, timeout, out), daemon=True)
+        self.thread.start()
+
+    def _run(self, messages, timeout, out):
+        try:
+            for delta in self.provider.stream(messages, timeout, self.cancelled):
+                if self.cancelled.is_set():
+                    return
+                out.put((self, "token", delta))
+            out.put((self, "done", None))
+        except Exception as e:
+            out.put((self, "error", e))
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+class ChatBackend:
+    """
+    DeepSeek 模式的对话后端，提供方可替换（DeepSeek / 本地 OpenAI 兼容服务器 / 模拟）。
+    - 请求在独立的工作线程中执行，不阻塞串口读取线程和界面；以流式方式回调 on_token；
+    - deadline：每次请求的总时限（含重试），超时后停止并给出错误提示；
+    - 在收到任何文本之前失败时按指数退避（带随机抖动）重试，重试依次轮换提供方；
+    - 对冲请求：配置了第二个提供方且第一个在 hedge_after 秒内没有返回首段文本时，
+      并发请求第二个，先返回首段文本的一方胜出，另一方被取消；
+    - 有 cache（ResponseCache）时，相同的提问直接返回缓存的回复，第一个提供方成功的回复写入缓存；
+    - 传入 history（Conversation）时带上预算内的对话历史，回复完成后记入历史。
+    """
+
+    def __init__(self, providers, system_prompt, deadline=30.0, retries=2, backoff=0.5, backoff_max=4.0,
+                 hedge_after=None, max_workers=1, cache=None):
+        self.providers = list(providers)
+        self.system_prompt = system_prompt
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.hedge_after = hedge_after
+        self.cache = cache
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm")
+
+        # 统计
+        self.requests = 0
+        self.retried = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.failures = 0
+        self.first_token_times = []
+
+    @property
+    def model(self):
+        return self.providers[0].model
+
+    def submit(self, text, on_token, on_done=None, history=None, on_first=None):
+        """
+        提交一次请求，立即返回 Future。
+        on_token(str) 在工作线程中对每段回复文本调用；结束（含出错）后调用 on_done()。
+        on_first() 只在提供方流式返回第一段文本时调用（在对应的 on_token 之前），
+        缓存命中与出错提示不调用，可用于统计真实的首段时间。
+        缓存查询和历史写入也在工作线程中进行（调用方通常是串口读取线程，不能等待磁盘）。
+        """
+        return self._executor.submit(self._run, text, on_token, on_done, history, on_first)
+
+    def _run(self, text, on_token, on_done, history=None, on_first=None):
+        try:
+            context = None
+            if self.cache is not None:
+                context = history.digest() if history is not None else ""
+                key = self.cache.make_key(text, self.model, self.system_prompt, context)
+                reply = self._lookup(key)
+                if reply is not None:
+                    on_token(reply)
+                    if history is not None:
+                        history.add(text, reply)
+                    return
+            self.requests += 1
+            if history is not None:
+                messages = history.messages(self.system_prompt, text)
+            else:
+                messages = [
+                    {"role": "system", "content": self.system_prompt},
+                    {"role": "user", "content": text},
+                ]
+            reply, provider = self._complete(messages, on_token, on_first)
+            if context is not None and reply and provider is self.providers[0]:
+                # 只缓存第一个提供方的回复（查询只用它的模型作键）；对冲或重试时由其他提供方给出的回复不缓存，
+                # 否则这些条目永远不会命中，还会把有效条目挤出 LRU
+                self._store(key, reply)
+            if history is not None and reply:
+                history.add(text, reply)
+        except Exception as e:
+            self.failures += 1
+            reason = "timeout" if isinstance(e, TimeoutError) else type(e).__name__
+            print(f"LLM 请求失败: {e!r}")
+            on_token(f"[DeepSeek Error: {reason}]\n")
+        finally:
+            if on_done:
+                on_done()
+
+    def _complete(self, messages, on_token, on_first=None):
+        """
+        协调一次请求的各个尝试（重试 / 对冲），把胜出一方的文本转给 on_token，返回 (完整回复, 胜出的提供方)
+        """
+        t0 = time.monotonic()
+        deadline = t0 + self.deadline
+        out = queue.SimpleQueue()
+        active = set()
+        winner = None
+        parts = []
+        failures = 0
+
+        def start(provider):
+            active.add(_Attempt(provider, messages, max(0.1, deadline - time.monotonic()), out))
+
+        def cancel_all():
+            for att in active:
+                att.cancel()
+            active.clear()
+
+        start(self.providers[0])
+        attempt_start = t0
+        hedged = False
+        try:
+            while True:
+                now = time.monotonic()
+                if now >= deadline:
+                    raise TimeoutError(f"no reply within {self.deadline:.0f}s")
+                wait = deadline - now
+                can_hedge = (winner is None and not hedged and self.hedge_after is not None
+                             and len(self.providers) > 1)
+                if can_hedge:
+                    wait = min(wait, attempt_start + self.hedge_after - now)
+                try:
+                    att, kind, payload = out.get(timeout=max(0.0, wait))
+                except queue.Empty:
+                    if can_hedge and time.monotonic() >= attempt_start + self.hedge_after:
+                        # 首段文本迟迟不来：并发请求另一个提供方
+                        hedged = True
+                        self.hedged += 1
+                        start(self.providers[(failures + 1) % len(self.providers)])
+                    continue
+                if att not in active or (winner is not None and att is not winner):
+                    continue
+                if kind == "token":
+                    if winner is None:
+                        winner = att
+                        self.first_token_times.append(time.monotonic() - t0)
+                        if on_first is not None:
+                            on_first()
+                        if att.provider is not self.providers[failures % len(self.providers)]:
+                            self.hedge_wins += 1
+                        for other in list(active):
+                            if other is not att:
+                                other.cancel()
+                                active.discard(other)
+                    parts.append(payload)
+                    on_token(payload)
+                elif kind == "done":
+                    active.discard(att)
+                    return "".join(parts), att.provider
+                else:
+                    active.discard(att)
+                    if att is winner:
+                        # 已经输出了部分文本，无法透明重试
+                        raise payload
+                    if active:
+                        # 对冲中的另一个请求仍在进行
+                        continue
+                    failures += 1
+                    if failures > self.retries:
+                        raise payload
+                    delay = min(self.backoff_max, self.backoff * 2 ** (failures - 1)) * random.uniform(0.5, 1.0)
+                    if time.monotonic() + delay >= deadline:
+                        raise payload
+                    time.sleep(delay)
+                    self.retried += 1
+                    start(self.providers[failures % len(self.providers)])
+                    attempt_start = time.monotonic()
+                    hedged = False
+        finally:
+            cancel_all()
+
+    def stats(self):
+        times = sorted(self.first_token_times)
+
+        def pct(p):
+            return times[min(len(times) - 1, int(len(times) * p))] if times else 0.0
+
+        return {"requests": self.requests, "retries": self.retried, "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins, "failures": self.failures,
+                "first_token_p50": pct(0.5), "first_token_p99": pct(0.99)}
+
+    def _lookup(self, key):
+        try:
+            return self.cache.get(key)
+        except sqlite3.Error as e:
+            print(f"回复缓存读取失败: {e}")
+            return None
+
+    def _store(self, key, reply):
+        try:
+            self.cache.put(key, reply)
+        except sqlite3.Error as e:
+            print(f"回复缓存写入失败: {e}")
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        if self.cache is not None:
+            self.cache.close()
+        for provider in self.providers:
+            provider.close()
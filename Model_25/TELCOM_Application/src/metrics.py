@@ -0,0 +1,184 @@
+# metrics.py
+# 热路径计数器、延迟直方图与 cProfile 采集（屏幕 HUD 与 JSON 导出共用）
+import bisect, json, os, threading, time
+
+# 直方图桶上界（秒）：0.1ms 起每档乘以 2^(1/4)（相对误差约 19%），约到 190s；更大的值落入最后一个溢出桶
+_BOUNDS = [0.0001 * 2 ** (i / 4) for i in range(84)]
+
+
+def process_wakeups():
+    """
+    本进程所有线程的自愿上下文切换次数之和（线程每次阻塞后被唤醒计 1）；仅 Linux，其他平台返回 0
+    """
+    total = 0
+    try:
+        tids = os.listdir("/proc/self/task")
+    except OSError:
+        return 0
+    for tid in tids:
+        try:
+            with open(f"/proc/self/task/{tid}/status") as f:
+                for line in f:
+                    if line.startswith("voluntary_ctxt_switches"):
+                        total += int(line.split()[1])
+                        break
+        except OSError:
+            # 线程已退出
+            continue
+    return total
+
+
+class Histogram:
+    """
+    对数分桶的延迟直方图：observe() 只做一次桶查找和计数，
+    百分位取所在桶的上界（并不超过实际最大值）。可在任意线程中调用。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = [0] * (len(_BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = 0.0
+
+    def observe(self, seconds):
+        i = bisect.bisect_left(_BOUNDS, seconds)
+        with self.lock:
+            self.buckets[i] += 1
+            self.count += 1
+            self.sum += seconds
+            if self.min is None or seconds < self.min:
+                self.min = seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def percentile(self, p):
+        with self.lock:
+            if not self.count:
+                return 0.0
+            rank = p * self.count
+            seen = 0
+            for i, n in enumerate(self.buckets):
+                seen += n
+                if seen >= rank and n:
+                    bound = _BOUNDS[i] if i < len(_BOUNDS) else self.max
+                    return min(bound, self.max)
+            return self.max
+
+    def snapshot(self):
+        mean = self.sum / self.count if self.count else 0.0
+        return {"count": self.count, "mean": mean, "min": self.min or 0.0, "max": self.max,
+                "p50": self.percentile(0.5), "p90": self.percentile(0.9), "p99": self.percentile(0.99),
+                "buckets": {f"{b * 1000:.3g}ms": n for b, n in zip(_BOUNDS, self.buckets) if n}}
+
+
+class Counter:
+    """
+    累计计数器，附带每秒速率（至少间隔 1 秒更新一次窗口）。
+    source 不为 None 时总数从 source() 读取（例如读取线程自己维护的唤醒次数）。
+    """
+
+    def __init__(self, source=None):
+        self.lock = threading.Lock()
+        self.source = source
+        self._total = 0
+        self.window_start = time.monotonic()
+        self.window_total = 0
+        self.last_rate = 0.0
+
+    def add(self, n=1):
+        with self.lock:
+            self._total += n
+
+    @property
+    def total(self):
+        return self.source() if self.source is not None else self._total
+
+    def rate(self):
+        now = time.monotonic()
+        dt = now - self.window_start
+        if dt >= 1.0:
+            total = self.total
+            self.last_rate = (total - self.window_total) / dt
+            self.window_start, self.window_total = now, total
+        return self.last_rate
+
+
+class Metrics:
+    """
+    按名称登记的计数器 / 直方图 / 瞬时值（gauge，调用函数取值）
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def histogram(self, name):
+        h = self.histograms.get(name)
+        if h is None:
+            h = self.histograms[name] = Histogram()
+        return h
+
+    def counter(self, name, source=None):
+        c = self.counters.get(name)
+        if c is None:
+            c = self.counters[name] = Counter(source)
+        return c
+
+    def gauge(self, name, fn):
+        self.gauges[name] = fn
+
+    def observe(self, name, seconds):
+        self.histogram(name).observe(seconds)
+
+    def add(self, name, n=1):
+        self.counter(name).add(n)
+
+    def snapshot(self):
+        return {
+            "time": time.time(),
+            "uptime": time.time() - self.started,
+            "histograms": {name: h.snapshot() for name, h in self.histograms.items()},
+            "counters": {name: {"total": c.total, "per_sec": c.rate()} for name, c in self.counters.items()},
+            "gauges": {name: fn() for name, fn in self.gauges.items()},
+        }
+
+    def dump(self, path):
+        """
+        写入 JSON 文件（先写临时文件再替换）
+        """
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(tmp, path)
+
+
+class Profiler:
+    """
+    cProfile 采集开关：第一次 toggle() 开始，第二次停止并写出 .prof 文件，返回耗时最多的函数摘要
+    """
+
+    def __init__(self, path, top=15):
+        self.path = path
+        self.top = top
+        self.profile = None
+
+    @property
+    def active(self):
+        return self.profile is not None
+
+    def toggle(self):
+        import cProfile, io, pstats
+        if self.profile is None:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+            return None
+        self.profile.disable()
+        self.profile.dump_stats(self.path)
+        out = io.StringIO()
+        pstats.Stats(self.profile, stream=out).sort_stats("cumulative").print_stats(self.top)
+        self.profile = None
+        return out.getvalue()
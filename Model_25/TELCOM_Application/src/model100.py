@@ -1,23 +1,44 @@
 # transparent_editor.py
+import time
+BOOT_T0 = time.perf_counter()   # 启动计时起点（首帧时报告启动耗时）
 import tkinter as tk
 import tkinter.font as tkfont
 from PIL import Image, ImageTk
-import os, sys, platform, time
-import serial, threading
-from openai import OpenAI
+import os, sys, platform, sqlite3, json, hashlib
+import serial
+from textbuffer import SpillRing
+from terminal_core import TerminalCore, SerialProtocol, default_commands
+from renderer import CellGridRenderer, FrameScheduler
+from serial_io import GuiBridge, SerialMux, OutputPacer, WriteCoalescer
+from llm import ChatBackend, OpenAICompatibleProvider, MockProvider, ResponseCache, Conversation
+from transfer import Transfer, transfer_path
+from reflow import ReplyFormatter
+from metrics import Metrics, Profiler, process_wakeups
+from idle import IdleGovernor, IdleTask
+from capture import CaptureWriter, KIND_IN, KIND_OUT, KIND_TRANSFER_IN, KIND_TRANSFER_OUT
+BOOT_IMPORTED = time.perf_counter()
 
 # ---------- 配置 ----------
 
 # 串口配置
 SERIAL_PORT = "COM5"
+SERIAL_PORTS = [SERIAL_PORT]  # 多台 Model 100：列出全部串口，Ctrl+Tab / Ctrl+1..9 切换显示的会话
 BAUDRATE = 9600
 BYTESIZE = 8
 PARITY = "N"
 STOPBITS = 1
+SERIAL_READ_TIMEOUT = 1.0   # 读取线程阻塞等待的超时（秒）；空闲模式下改为完全阻塞
+IDLE_TIMEOUT = 30.0         # 无按键和串口收发超过该秒数进入空闲模式（停止光标闪烁）；<= 0 关闭
+FLOW_CONTROL = "none"       # 流控: "none" / "xonxoff" / "rtscts"
+PACER_INTERVAL_MS = 20      # 输出节拍（毫秒），每拍按波特率发送一块
+WRITE_COALESCE_MS = 4       # 键盘回显合并写入的最长等待（毫秒，小于一帧）
+WRITE_COALESCE_BYTES = 32   # 缓冲区达到该字节数立即写出
 
 # 图形界面配置
 WINDOW_W, WINDOW_H = 1280, 480
 BG_FILENAME = "Background.png"
+BG_CACHE = True                     # 缩放到窗口大小的背景图缓存为未压缩 PNG（背景图更新后自动重建）
+STARTUP_CACHE_FILENAME = "startup_cache.json"   # 字体选择结果缓存（按字体列表与几何参数区分）
 
 TEXT_X, TEXT_Y = 110, 100
 TEXT_W_PIXELS, TEXT_H_PIXELS = 1060, 270
@@ -25,55 +46,189 @@ TEXT_COLS, TEXT_ROWS = 40, 8
 TEXT_SIZE_RATIO = 1.3
 TEXT_SPACING = 5
 LINE_SPACING = -6
+FRAME_RATE = 60         # 最高重绘帧率；<= 0 表示只在空闲时（after_idle）合并重绘
+RENDER_BACKEND = "canvas"   # "canvas"：每格一个画布文本项；"raster"：NumPy 合成整屏图像（需要 numpy）
+LCD_CONTRAST = 1.0          # raster 后端：字形覆盖度放大倍数
+LCD_PIXEL_GRID = 0          # raster 后端：> 1 时把字形量化为该像素大小的点阵（LCD 像素网格效果）
+# raster 后端：字体名 -> 字体文件（其余字体用 fc-match 查找）
+FONT_FILES = {"Another Mans Treasure MIA Raw": os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                            "..", "fonts", "AnotherMansTreasureMIARaw.ttf")}
 PREFERRED_FONTS = ["Another Mans Treasure MIA Raw", "Consolas", "Courier New", "Courier", "Menlo", "Monaco"]
 
+# 滚动缓冲区
+SCROLLBACK_MAX_CHARS = 512 * 1024   # 内存中保留的最大字符数（None 表示不限制）
+                                    # 间隙缓冲区约 8 字节/字符，该上限使其保持在约 4 MB；设为 None 时内存随会话无限增长
+SCROLLBACK_MAX_LINES = None         # 内存中保留的最大显示行数（None 表示不限制）
+SCROLLBACK_SPILL = True             # 超出部分溢出到磁盘文件（仍可滚动查看）；False 则直接丢弃
+SPILL_FILENAME = "scrollback.spill"
+SPILL_MAX_LINES = 200000            # 磁盘环形文件最多保存的显示行数
+SERIAL_LINE_MAX = 4096              # 串口未换行数据缓冲的最大长度
+
+# 文件传输（Model 100 上输入 ##XGET## 文件名 / ##XPUT## 文件名 / ##DOWN## 文件名 / ##UP## 文件名）
+TRANSFER_DIR = "transfer"           # 传输文件所在目录
+TEXT_UPLOAD_NEWLINE = b"\r"         # 纯文本发送时的换行（Model 100 文档以 CR 分行）
+TEXT_LINE_DELAY_MS = 0              # 纯文本发送时每行之后的额外等待（毫秒）
+TEXT_START_DELAY = 5.0              # 纯文本发送前的等待（秒），用于在 TELCOM 中启动 DOWN
+TRANSFER_TIMEOUT = 10.0             # 等待应答/数据的超时（秒）
+
+# 会话录制（串口收发的每一块数据带时间戳追加到录制文件；回放：python capture.py 录制文件 [--fast]）
+CAPTURE = True
+CAPTURE_FILENAME = "session.m100cap"
+CAPTURE_MAX_BYTES = 64 * 1024 * 1024    # 录制文件超过该大小则改名为 .1 重新开始（启动时和运行中都检查）
+CAPTURE_FLUSH_INTERVAL = 0.5            # 后台写盘的最长间隔（秒）
+
 # 退出区域
 EXIT_X, EXIT_Y, EXIT_W, EXIT_H = 1059, 403, 88, 22
 
 # DEEPSEEK
 API_KEY = "YOUR API KEY"
+DEEPSEEK_BASE_URL = "https://api.deepseek.com"
+DEEPSEEK_MODEL = "deepseek-chat"
+SYSTEM_PROMPT = "You are a helpful assistant"
+# 模型提供方："deepseek" / "local"（Pi 上的 OpenAI 兼容服务器，如 llama.cpp server）/ "mock"（离线模拟）
+LLM_PROVIDER = "deepseek"
+LLM_HEDGE_PROVIDER = None                       # 对冲用的第二个提供方（如 "local"），None 表示不对冲
+LLM_HEDGE_AFTER = 3.0                           # 第一个提供方超过该秒数仍无首段文本时并发请求第二个
+LLM_DEADLINE = 45.0                             # 每次提问的总时限（秒，含重试）
+LLM_RETRIES = 2                                 # 收到文本之前失败时的重试次数
+LLM_BACKOFF = 0.5                               # 重试退避的初始间隔（秒），之后每次翻倍
+LOCAL_LLM_BASE_URL = "http://127.0.0.1:8080/v1"
+LOCAL_LLM_MODEL = "local"
+RESPONSE_CACHE = True                           # 相同提问直接使用本地缓存的回复
+RESPONSE_CACHE_FILENAME = "deepseek_cache.sqlite3"
+RESPONSE_CACHE_MAX_BYTES = 4 * 1024 * 1024      # 缓存回复的总大小上限（超出按 LRU 淘汰）
+RESPONSE_CACHE_TTL = 24 * 3600                  # 缓存有效期（秒）
+HISTORY_FILENAME = "history.z"                  # 对话历史（每个会话一个文件，zlib 压缩的 JSON）
+HISTORY_TOKEN_BUDGET = 2000                     # 每次请求中系统提示词 + 历史 + 提问的 token 上限
+REPLY_REFLOW = True                             # 回复去掉 Markdown、转写为 ASCII 并按 TEXT_COLS 折行后再发送
+
+# 性能统计
+HUD_KEY = "<F12>"                   # 显示 / 隐藏性能 HUD
+METRICS_DUMP_KEY = "<Control-F12>"  # 把统计导出到 METRICS_FILENAME
+PROFILE_KEY = "<Shift-F12>"         # 开始 / 停止 cProfile 采集（停止时写出 PROFILE_FILENAME）
+HUD_INTERVAL_MS = 500               # HUD 刷新间隔（毫秒）
+METRICS_FILENAME = "metrics.json"
+PROFILE_FILENAME = "model100.prof"
+
+# 滚动缓冲区搜索
+SEARCH_KEY = "<Control-f>"          # 开始增量搜索；搜索中再按一次跳到下一个匹配
+SEARCH_INDEX_BLOCKS = 4             # 文本变化后空闲时分批建立搜索索引，每批最多索引的块数（每块 64 行）
+SEARCH_INDEX_DELAY_MS = 50          # 两批之间的间隔（毫秒）
 
 # -------------------------
 
+def _load_startup_cache():
+    try:
+        with open(STARTUP_CACHE_FILENAME, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_startup_cache(cache):
+    tmp = STARTUP_CACHE_FILENAME + ".tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(cache, f, indent=1)
+        os.replace(tmp, STARTUP_CACHE_FILENAME)
+    except OSError as e:
+        print(f"启动缓存写入失败: {e}")
+
 def find_max_mono_font(root, family_candidates, max_width_px, max_height_px, cols, rows, max_try=120):
     """
     返回一个 tkfont.Font 对象（等宽字体首选），尽可能大的字号以满足 cols x rows
     在指定像素框内显示。
+    每个字体按字号二分查找（字宽、行高随字号单调增加），结果（字体、字号、字宽、行高）
+    按字体列表与几何参数缓存到 STARTUP_CACHE_FILENAME；下次启动只创建一个字体并核对字宽。
     """
-    for family in family_candidates:
-        for size in range(min(max_try, 200), 4, -1):
-            try:
-                f = tkfont.Font(root=root, family=family, size=size)
-            except tk.TclError:
-                # 系统上可能没有这个字体
-                break
-            char_w = f.measure("0")
-            line_h = f.metrics("linespace")
-            if char_w * cols <= max_width_px * TEXT_SIZE_RATIO and line_h * rows <= max_height_px * TEXT_SIZE_RATIO:
+    max_w = max_width_px * TEXT_SIZE_RATIO
+    max_h = max_height_px * TEXT_SIZE_RATIO
+    key = hashlib.sha1(json.dumps([family_candidates, max_width_px, max_height_px, cols, rows, max_try,
+                                   TEXT_SIZE_RATIO, root.tk.call("tk", "scaling")]).encode()).hexdigest()
+    cache = _load_startup_cache()
+    hit = cache.get("font", {}).get(key)
+    if hit:
+        try:
+            f = tkfont.Font(root=root, family=hit["family"], size=hit["size"])
+            # 字体被卸载或替换时字宽会变，重新查找
+            if f.measure("0") == hit["char_w"] and f.metrics("linespace") == hit["linespace"]:
                 return f
+        except tk.TclError:
+            pass
+
+    def fits(f):
+        return f.measure("0") * cols <= max_w and f.metrics("linespace") * rows <= max_h
+
+    for family in family_candidates:
+        try:
+            lo_font = tkfont.Font(root=root, family=family, size=5)
+        except tk.TclError:
+            # 系统上可能没有这个字体
+            continue
+        if not fits(lo_font):
+            continue
+        # 不变式：lo 满足，hi 之上都不满足
+        lo, hi, best = 5, min(max_try, 200), lo_font
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            f = tkfont.Font(root=root, family=family, size=mid)
+            if fits(f):
+                lo, best = mid, f
+            else:
+                hi = mid - 1
+        cache.setdefault("font", {})[key] = {"family": family, "size": lo,
+                                             "char_w": best.measure("0"),
+                                             "linespace": best.metrics("linespace")}
+        _save_startup_cache(cache)
+        return best
     # 回退到系统默认等宽近似（尝试最后一个候选字体小字号），或默认字号
     try:
         return tkfont.Font(root=root, family=family_candidates[-1], size=12)
     except Exception:
         return tkfont.Font(root=root, size=12)
 
+def load_background(path, size):
+    """
+    读取背景图并缩放到 size；缩放结果以未压缩 PNG 缓存（解码更快），
+    背景图比缓存新时重建。返回 PIL Image
+    """
+    if not BG_CACHE:
+        img = Image.open(path)
+        return img if img.size == size else img.resize(size, Image.LANCZOS)
+    name, _ = os.path.splitext(path)
+    cache_path = f"{name}.{size[0]}x{size[1]}.cache.png"
+    try:
+        if os.path.getmtime(cache_path) >= os.path.getmtime(path):
+            img = Image.open(cache_path)
+            img.load()
+            if img.size == size:
+                return img
+    except OSError:
+        pass
+    img = Image.open(path)
+    if img.size != size:
+        img = img.resize(size, Image.LANCZOS)
+    try:
+        img.save(cache_path, compress_level=0)
+    except OSError as e:
+        print(f"背景图缓存写入失败: {e}")
+    return img
+
+def make_provider(name):
+    """
+    按名称创建模型提供方
+    """
+    if name == "deepseek":
+        return OpenAICompatibleProvider("deepseek", API_KEY, DEEPSEEK_BASE_URL, DEEPSEEK_MODEL)
+    if name == "local":
+        return OpenAICompatibleProvider("local", "none", LOCAL_LLM_BASE_URL, LOCAL_LLM_MODEL)
+    if name == "mock":
+        return MockProvider()
+    raise ValueError(f"未知的模型提供方: {name}")
+
 class TransparentTextEditor:
     def __init__(self, root):
         self.root = root
 
-        # 串口初始化
-        try:
-            self.ser = serial.Serial(port = SERIAL_PORT, baudrate = BAUDRATE, bytesize = BYTESIZE, parity = PARITY, stopbits = STOPBITS, timeout=0.3)
-        except Exception as e:
-            print(f"串口打开失败: {e}")
-            self.ser = None
-
-        # 启动串口读取线程
-        if self.ser:
-            self.serial_thread = threading.Thread(target=self.read_serial, daemon=True)
-            self.serial_thread.start()
-        self.buffer = ""
-
         # GUI初始化
         # 背景画布
         self.canvas = tk.Canvas(root, width=WINDOW_W, height=WINDOW_H, highlightthickness=0, bd=0, takefocus=1)
@@ -83,24 +238,82 @@ class TransparentTextEditor:
         if not os.path.exists(BG_FILENAME):
             print(f"错误：找不到背景图片 '{BG_FILENAME}'。请将图片放在脚本同目录并命名为 {BG_FILENAME}")
             sys.exit(1)
-        pil_img = Image.open(BG_FILENAME)
-        if pil_img.size != (WINDOW_W, WINDOW_H):
-            pil_img = pil_img.resize((WINDOW_W, WINDOW_H), Image.LANCZOS)
+        # 启动各阶段耗时（秒），首帧绘制后输出
+        self.boot = {"imports": BOOT_IMPORTED - BOOT_T0}
+        t = time.perf_counter()
+        pil_img = load_background(BG_FILENAME, (WINDOW_W, WINDOW_H))
         self.bg_img = ImageTk.PhotoImage(pil_img)
         self.canvas.create_image(0, 0, anchor="nw", image=self.bg_img)
+        self.boot["background"] = time.perf_counter() - t
 
         # 选定字体（尽量等宽并最大化）
+        t = time.perf_counter()
         self.font = find_max_mono_font(root, PREFERRED_FONTS, TEXT_W_PIXELS, TEXT_H_PIXELS, TEXT_COLS, TEXT_ROWS)
+        self.boot["font"] = time.perf_counter() - t
         # 字符宽高（以单字符为准）
         self.char_width = max(1, self.font.measure("0"))
         self.line_height = max(1, self.font.metrics("linespace")) + LINE_SPACING
-
-        # 文本存储：单一字符串 + 光标索引（相对于 raw_text 的位置）
-        self.raw_text = ""      # 原始文本，包含换行符 '\n'
-        self.cursor_index = 0   # 插入点在 raw_text 中的位置 (0..len(raw_text))
+        # 字符网格渲染器：一次性创建 TEXT_COLS x TEXT_ROWS 个文本项，之后只更新变化的格子；
+        # 或光栅后端：整屏合成为一张图像
+        self.renderer = None
+        if RENDER_BACKEND == "raster":
+            try:
+                from raster import RasterRenderer
+                self.renderer = RasterRenderer(self.canvas, self.font, TEXT_X, TEXT_Y, TEXT_COLS, TEXT_ROWS,
+                                               self.char_width + TEXT_SPACING, self.line_height,
+                                               background=pil_img, font_files=FONT_FILES,
+                                               contrast=LCD_CONTRAST, pixel_grid=LCD_PIXEL_GRID)
+            except ImportError as e:
+                print(f"光栅渲染不可用（{e}），改用画布文本渲染")
+        if self.renderer is None:
+            self.renderer = CellGridRenderer(self.canvas, self.font, TEXT_X, TEXT_Y, TEXT_COLS, TEXT_ROWS,
+                                             self.char_width + TEXT_SPACING, self.line_height)
+        # 帧调度器：refresh() 只标记 dirty，同一帧内的多次刷新合并为一次绘制
+        self.frames = FrameScheduler(root, self.paint, FRAME_RATE)
+        # 性能统计（计数器 / 延迟直方图）、HUD 与 cProfile 采集
+        self.metrics = Metrics()
+        self.key_at = None          # 尚未绘制的最早一次按键时间
+        self.hud_item = None
+        self.hud_back = None
+        self.hud_id = None
+        self.profiler = Profiler(PROFILE_FILENAME)
+
+        # 串口线程只把数据放入队列，由主线程批量插入（Tk 只能在主线程访问）
+        self.bridge = GuiBridge(root)
+        # DEEPSEEK 初始化
+        # 长期复用的客户端（所有会话共用），请求在工作线程中以流式方式执行，带时限、重试和可选的对冲请求
+        cache = None
+        if RESPONSE_CACHE:
+            try:
+                cache = ResponseCache(RESPONSE_CACHE_FILENAME, RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_TTL)
+            except sqlite3.Error as e:
+                print(f"回复缓存打开失败: {e}")
+        providers = [make_provider(LLM_PROVIDER)]
+        if LLM_HEDGE_PROVIDER:
+            providers.append(make_provider(LLM_HEDGE_PROVIDER))
+        self.deepseek = ChatBackend(providers, SYSTEM_PROMPT, deadline=LLM_DEADLINE, retries=LLM_RETRIES,
+                                    backoff=LLM_BACKOFF, hedge_after=LLM_HEDGE_AFTER,
+                                    max_workers=len(SERIAL_PORTS), cache=cache)
+        # 会话录制（所有会话共用，后台线程写盘）
+        self.capture = None
+        if CAPTURE:
+            try:
+                self.capture = CaptureWriter(CAPTURE_FILENAME, CAPTURE_FLUSH_INTERVAL,
+                                             max_file_bytes=CAPTURE_MAX_BYTES)
+            except OSError as e:
+                print(f"录制文件打开失败: {e}")
+        # 状态行（会话名 / 文件传输进度）
+        self.status_item = self.canvas.create_text(TEXT_X, TEXT_Y + TEXT_H_PIXELS, anchor="nw", text="",
+                                                   font=("Courier", 14), tags="status")
+        # 每个串口一个会话（串口、终端核心、协议与 DeepSeek 模式、输出节拍器、文件传输），画布显示其中一个
+        self.sessions = [SerialSession(self, i, port) for i, port in enumerate(SERIAL_PORTS)]
+        self.session = self.sessions[0]
+        # 增量搜索：search_query 为 None 表示不在搜索中；起点与当前匹配均为 (绝对行号, 列)
+        self.search_query = None
+        self.search_origin = None
+        self.search_match = None
 
         # 可视化配置
-        self.view_start = 0      # display_lines 的起始可视行索引
         self.cursor_visible = True
 
         # 闪烁周期（ms）
@@ -124,6 +337,16 @@ class TransparentTextEditor:
         # 使 canvas 成为可聚焦控件并接收键盘事件
         self.canvas.focus_set()
         self.canvas.bind("<Key>", self.on_key)
+        # 切换会话
+        self.canvas.bind("<Control-Tab>", lambda e: self.switch_session(self.session.index + 1))
+        for i in range(min(9, len(SERIAL_PORTS))):
+            self.canvas.bind(f"<Control-Key-{i + 1}>", lambda e, i=i: self.switch_session(i))
+        # 性能 HUD / 导出统计 / cProfile
+        self.canvas.bind(HUD_KEY, self.toggle_hud)
+        self.canvas.bind(METRICS_DUMP_KEY, self.dump_metrics)
+        self.canvas.bind(PROFILE_KEY, self.toggle_profile)
+        # 在滚动缓冲区中搜索
+        self.canvas.bind(SEARCH_KEY, self.start_search)
         # 同时保留对粘贴的处理（如果之前用 root.bind_all("<Control-v>"...)，改为 canvas）
         self.canvas.bind("<Control-v>", self.on_paste)
         # macOS 的 Command-v 可选
@@ -142,7 +365,8 @@ class TransparentTextEditor:
             self.canvas.bind("<Button-5>", lambda e: self.on_mouse_wheel(e, step= 1))
 
         # 初始化显示（必须在 scrollbar 创建、事件绑定、字体测量之后）
-        self.rebuild_display()
+        self.core.rebuild_display()
+        self.refresh()
         # 启动光标闪烁（要在 view_start 等属性初始化之后）
         self.blink_id = None  # 初始化
         self.blink_cursor()
@@ -150,8 +374,34 @@ class TransparentTextEditor:
         # 确保窗口能接收键盘焦点
         #root.focus_force()
 
-        # DEEPSEEK 初始化
-        self.deepseek_mode = False  # 是否进入 DeepSeek 模式
+        # 所有串口共用一个读取线程（所有状态初始化完成之后启动）
+        self.mux = SerialMux(SERIAL_READ_TIMEOUT)
+        for session in self.sessions:
+            if session.ser:
+                self.mux.add(session.ser, session.on_serial_data)
+        self.mux.start()
+        self.show_status()
+        # 空闲调度：长时间无活动时停止光标闪烁，读取线程完全阻塞
+        self.governor = IdleGovernor(root, IDLE_TIMEOUT, self.enter_idle, self.leave_idle)
+
+        m = self.metrics
+        m.counter("serial.bytes_in", source=self.mux.bytes_total)
+        m.counter("serial.wakeups", source=self.mux.wakeups_total)
+        m.counter("serial.bytes_out")
+        m.counter("paint.item_updates", source=lambda: self.renderer.item_updates)
+        m.gauge("tk.items", self.renderer.item_count)
+        m.gauge("frames", self.frames.stats)
+        m.gauge("boot", lambda: self.boot)
+        m.gauge("idle", self.governor.stats)
+        if self.capture is not None:
+            m.gauge("capture", self.capture.stats)
+        m.counter("process.cpu_seconds", source=time.process_time)
+        m.counter("process.wakeups", source=process_wakeups)
+        m.counter("llm.errors", source=lambda: self.deepseek.failures)
+        if self.deepseek.cache is not None:
+            m.counter("llm.cache_hits", source=lambda: self.deepseek.cache.hits)
+        self.boot["init"] = time.perf_counter() - BOOT_T0
+
         if platform.system() == "Linux":
             self.focus_on_cavans()
 
@@ -189,176 +439,43 @@ class TransparentTextEditor:
         # 当窗口获得焦点时确保 canvas 也获得焦点
         self.root.bind("<FocusIn>", lambda e: self.canvas.focus_set())
  
-    # ---------------- 文本与显示行重建 ----------------
-    def rebuild_display(self):
-        """
-        根据 raw_text 和 TEXT_COLS（每行最大字符数）生成 display_lines（列表）和 line_ranges（每行对应的 raw_text 索引范围）。
-        line_ranges[i] = (start_raw_index, end_raw_index_exclusive)
-        """
-        s = self.raw_text
-        n = len(s)
-        self.display_lines = []
-        self.line_ranges = []
-
-        if n == 0:
-            # 空文本，显示一行空白
-            self.display_lines.append("")
-            self.line_ranges.append((0, 0))
-            return
-
-        i = 0
-        while i < n:
-            next_nl = s.find("\n", i)
-            if next_nl == -1:
-                # 段落到末尾
-                segment = s[i:n]
-                if len(segment) == 0:
-                    # 末尾正好是空，不添加额外行（已在上次 newline 处理）
-                    pass
-                else:
-                    for k in range(0, len(segment), TEXT_COLS):
-                        start_raw = i + k
-                        end_raw = min(i + k + TEXT_COLS, n)
-                        self.display_lines.append(s[start_raw:end_raw])
-                        self.line_ranges.append((start_raw, end_raw))
-                break
-            else:
-                segment = s[i:next_nl]
-                if len(segment) == 0:
-                    # 空行
-                    self.display_lines.append("")
-                    self.line_ranges.append((i, i))
-                else:
-                    for k in range(0, len(segment), TEXT_COLS):
-                        start_raw = i + k
-                        end_raw = min(i + k + TEXT_COLS, next_nl)
-                        self.display_lines.append(s[start_raw:end_raw])
-                        self.line_ranges.append((start_raw, end_raw))
-                # 如果换行符在文本末尾（raw_text 最后一位是 '\n'），需要额外一个空行来表示末尾空行
-                if next_nl == n - 1:
-                    self.display_lines.append("")
-                    self.line_ranges.append((n, n))
-                i = next_nl + 1
-
-        # 边界保护：至少有一行
-        if not self.display_lines:
-            self.display_lines.append("")
-            self.line_ranges.append((0, 0))
-
-    def raw_index_to_display_pos(self, raw_idx):
-        """
-        将 raw_text 的索引映射为 (display_line_index, column_in_that_line)
-        """
-        # clamp
-        if raw_idx < 0:
-            raw_idx = 0
-        if raw_idx > len(self.raw_text):
-            raw_idx = len(self.raw_text)
-
-        for i, (a, b) in enumerate(self.line_ranges):
-            # 区间是 [a, b)
-            if raw_idx >= a and raw_idx <= b:
-                col = raw_idx - a
-                return i, col
-        # 没找到（理论上不该发生） -> 放到最后一行行尾
-        last = len(self.display_lines) - 1
-        last_start, last_end = self.line_ranges[last]
-        return last, last_end - last_start
-
-    def display_pos_to_raw_index(self, display_line_idx, col):
-        """
-        将显示行索引和列映射为 raw_text 的索引
-        """
-        if display_line_idx < 0:
-            display_line_idx = 0
-        if display_line_idx >= len(self.display_lines):
-            display_line_idx = len(self.display_lines) - 1
-        start, end = self.line_ranges[display_line_idx]
-        col = max(0, min(col, end - start))
-        return start + col
-
     # ----------------- 插入 / 删除 / 光标移动 -----------------
     def insert_text_at_cursor(self, text_to_insert: str):
-        if not text_to_insert:
-            return
-        # 插入
-        s = self.raw_text
-        pos = self.cursor_index
-        self.raw_text = s[:pos] + text_to_insert + s[pos:]
-        # 更新光标位置
-        self.cursor_index += len(text_to_insert)
-        # 重建显示，并确保光标可见
-        self.rebuild_display()
-        self.ensure_cursor_visible()
-        self.refresh()
+        return self._view_changed(self.core.insert(text_to_insert))
+
+    def leave_screen(self):
+        return self._view_changed(self.core.leave_screen())
 
     def backspace(self):
-        if self.cursor_index <= 0:
-            return
-        s = self.raw_text
-        pos = self.cursor_index
-        self.raw_text = s[:pos-1] + s[pos:]
-        self.cursor_index -= 1
-        self.rebuild_display()
-        self.ensure_cursor_visible()
-        self.refresh()
+        return self._view_changed(self.core.backspace())
 
     def move_left(self):
-        if self.cursor_index > 0:
-            self.cursor_index -= 1
-            self.rebuild_display()
-            self.ensure_cursor_visible()
-            self.refresh()
+        return self._view_changed(self.core.move_left())
 
     def move_right(self):
-        if self.cursor_index < len(self.raw_text):
-            self.cursor_index += 1
-            self.rebuild_display()
-            self.ensure_cursor_visible()
-            self.refresh()
+        return self._view_changed(self.core.move_right())
 
     def move_up(self):
-        self.rebuild_display()
-        line, col = self.raw_index_to_display_pos(self.cursor_index)
-        if line > 0:
-            prev_len = len(self.display_lines[line - 1])
-            new_col = min(col, prev_len)
-            self.cursor_index = self.display_pos_to_raw_index(line - 1, new_col)
-            self.ensure_cursor_visible()
-            self.refresh()
+        return self._view_changed(self.core.move_up())
 
     def move_down(self):
-        self.rebuild_display()
-        line, col = self.raw_index_to_display_pos(self.cursor_index)
-        if line < len(self.display_lines) - 1:
-            next_len = len(self.display_lines[line + 1])
-            new_col = min(col, next_len)
-            self.cursor_index = self.display_pos_to_raw_index(line + 1, new_col)
-            self.ensure_cursor_visible()
+        return self._view_changed(self.core.move_down())
+
+    def _view_changed(self, changed):
+        # 编辑或光标移动确有变化时才重绘；返回 changed
+        if changed:
+            self.update_scrollbar()
             self.refresh()
+        return changed
 
     # ----------------- UI / 滚动 / 刷新 -----------------
-    def ensure_cursor_visible(self):
-        """
-        确保光标所在的 display_line 在可视区域内；如果不在则调整 self.view_start
-        """
-        self.rebuild_display()
-        line_idx, _ = self.raw_index_to_display_pos(self.cursor_index)
-        max_start = max(0, len(self.display_lines) - TEXT_ROWS)
-        if line_idx < self.view_start:
-            self.view_start = max(0, min(line_idx, max_start))
-        elif line_idx >= self.view_start + TEXT_ROWS:
-            self.view_start = max(0, min(line_idx - TEXT_ROWS + 1, max_start))
-        # 更新 scrollbar 位置
-        self.update_scrollbar()
-
     def update_scrollbar(self):
-        total = len(self.display_lines)
+        total = self.core.line_count()
         if total <= TEXT_ROWS:
             self.scrollbar.set(0.0, 1.0)
         else:
-            a = self.view_start / total
-            b = min(1.0, (self.view_start + TEXT_ROWS) / total)
+            a = self.core.view_start / total
+            b = min(1.0, (self.core.view_start + TEXT_ROWS) / total)
             self.scrollbar.set(a, b)
 
     def scroll_command(self, *args):
@@ -366,23 +483,20 @@ class TransparentTextEditor:
         被 scrollbar 调用：
         args 格式可能为 ('moveto', fraction) 或 ('scroll', number, 'units'/'pages')
         """
-        total = len(self.display_lines)
+        total = self.core.line_count()
         if total == 0:
             return
         cmd = args[0]
         if cmd == "moveto":
             frac = float(args[1])
-            new_start = int(frac * total)
-            new_start = max(0, min(new_start, max(0, total - TEXT_ROWS)))
-            self.view_start = new_start
+            self.core.scroll_to(int(frac * total))
         elif cmd == "scroll":
             amount = int(args[1])
             what = args[2] if len(args) > 2 else "units"
             if what == "units":
-                self.view_start += amount
+                self.core.scroll(amount)
             else:  # pages
-                self.view_start += amount * TEXT_ROWS
-            self.view_start = max(0, min(self.view_start, max(0, total - TEXT_ROWS)))
+                self.core.scroll(amount * TEXT_ROWS)
         self.refresh()
 
     def on_mouse_wheel(self, event, step=None):
@@ -395,11 +509,12 @@ class TransparentTextEditor:
             # macOS delta smaller scale, normalize:
             step = -int(delta / 120) if delta != 0 else 0
         # 向上滚动 step < 0 ? adjust sign
-        self.view_start += step
-        self.view_start = max(0, min(self.view_start, max(0, len(self.display_lines) - TEXT_ROWS)))
+        self.governor.poke()
+        self.core.scroll(step)
         self.refresh()
 
     def on_mouse_click(self, event):
+        self.governor.poke()
         x, y = event.x, event.y
         # 仅在文本区内才定位光标
         if not (TEXT_X <= x <= TEXT_X + TEXT_W_PIXELS and TEXT_Y <= y <= TEXT_Y + TEXT_H_PIXELS):
@@ -407,184 +522,563 @@ class TransparentTextEditor:
         rel_x = x - TEXT_X
         rel_y = y - TEXT_Y
         clicked_row = int(rel_y // self.line_height)
-        clicked_row = max(0, min(clicked_row, TEXT_ROWS - 1))
-        target_display_idx = self.view_start + clicked_row
-        if target_display_idx >= len(self.display_lines):
-            # 放到最后一行行尾
-            self.cursor_index = len(self.raw_text)
-        else:
-            clicked_col = int(rel_x // self.char_width)
-            clicked_col = max(0, clicked_col)
-            self.cursor_index = self.display_pos_to_raw_index(target_display_idx, clicked_col)
-        self.ensure_cursor_visible()
+        clicked_col = int(rel_x // self.char_width)
+        self.core.place_cursor(clicked_row, clicked_col)
+        self.update_scrollbar()
         self.refresh()
 
     def on_key(self, event):
         # 处理按键（尽量覆盖常见的）
         # 注意：Ctrl/Alt 组合键仍会触发但 event.char 可能为空
         key = event.keysym
-        if key == "BackSpace":
-            self.backspace()
+        t = time.perf_counter()
+        self.governor.poke()
+        if self.transfer is not None and self.transfer.active:
+            # 传输期间独占串口：键盘只响应 Escape（取消传输）
+            if key == "Escape":
+                self.transfer.cancel()
             return "break"
+        if self.search_query is not None:
+            return self.on_search_key(event)
+        if key == "BackSpace":
+            changed = self.backspace()
         elif key == "Left":
-            self.move_left()
-            return "break"
+            changed = self.move_left()
         elif key == "Right":
-            self.move_right()
-            return "break"
+            changed = self.move_right()
         elif key == "Up":
-            self.move_up()
-            return "break"
+            changed = self.move_up()
         elif key == "Down":
-            self.move_down()
-            return "break"
+            changed = self.move_down()
+        elif key == "Escape":
+            # 全屏模式下：把屏幕内容放回滚动历史，回到行模式
+            changed = self.leave_screen()
         elif key == "Return":
-            self.insert_text_at_cursor("\n")
-            self.send_serial("\n\r")  # 发送字符到串口
-            return "break"
+            changed = self.insert_text_at_cursor("\n")
+            self.writer.write("\n\r")  # 发送字符到串口（回车立即连同缓冲区写出）
         else:
             ch = event.char
             # printable characters（排除 control keys）
-            if ch and ord(ch) >= 32:
-                self.insert_text_at_cursor(ch)
-                self.send_serial(ch)  # 发送字符到串口
-                return "break"
-        # 未处理的按键交给系统
-        return
+            if not (ch and ord(ch) >= 32):
+                # 未处理的按键（Shift/Ctrl 等）交给系统
+                return
+            changed = self.insert_text_at_cursor(ch)
+            self.writer.write(ch)  # 发送字符到串口（短时间内的连续按键合并写入）
+        # 按键到绘制的延迟只统计确实改变了屏幕的按键（从按键事件到达时起算）
+        if changed and self.key_at is None:
+            self.key_at = t
+        return "break"
 
     def on_paste(self, event):
+        self.governor.poke()
         try:
             text = self.root.clipboard_get()
         except tk.TclError:
             return "break"
-        # 将粘贴的内容直接插入（保留换行）
-        self.insert_text_at_cursor(text)
+        # 粘贴的内容经输出节拍器发送到串口并回显（换行与回车键一致）；
+        # 剪贴板中的 "\r\n" / "\r" 先统一为 "\n"，否则每行会多发一个回车
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+        self.pacer.send(text, newline="\n\r")
         return "break"
 
     def blink_cursor(self):
+        # 闪烁只需显隐光标图元，不重绘文本
         self.cursor_visible = not self.cursor_visible
-        self.refresh()
+        self.renderer.set_cursor(self.cursor_cell())
         self.blink_id = self.root.after(self.blink_period, self.blink_cursor)
 
+# ----------------- 空闲模式 -----------------
+    def enter_idle(self):
+        """
+        停止光标闪烁（光标保持显示），读取线程改为完全阻塞：进程空闲时没有定时唤醒
+        """
+        if self.blink_id is not None:
+            self.root.after_cancel(self.blink_id)
+            self.blink_id = None
+        self.cursor_visible = True
+        self.renderer.set_cursor(self.cursor_cell())
+        self.mux.set_timeout(None)
+
+    def leave_idle(self):
+        self.mux.set_timeout(SERIAL_READ_TIMEOUT)
+        # blink_cursor() 先翻转可见状态，这里让它从“显示”开始
+        self.cursor_visible = False
+        self.blink_cursor()
+
+    def cursor_cell(self):
+        """
+        返回光标在可视区中的 (row, col)；光标处于闪烁熄灭状态或不在可视区时返回 None
+        """
+        if not self.cursor_visible:
+            return None
+        return self.core.cursor_cell()
+
     def refresh(self):
+        """
+        请求重绘：标记视图为 dirty，由帧调度器在下一帧调用 paint()；
+        文本可能已变化（键盘编辑），同时安排当前会话的搜索索引补齐。
+        """
+        self.frames.request()
+        self.session.indexer.request()
+
+    def paint(self):
         """
         根据 current view_start 和 display_lines 绘制当前可视文本区以及光标。
+        由 CellGridRenderer 对比影子屏幕，只更新发生变化的字符格子。
         """
-        self.rebuild_display()
-        # 清除旧的文本/光标
-        self.canvas.delete("text")
-        # 绘制每一行（最多 TEXT_ROWS 行）
-        for i in range(TEXT_ROWS):
-            display_idx = self.view_start + i
-            if display_idx < len(self.display_lines):
-                line_text = self.display_lines[display_idx]
-            else:
-                line_text = ""
-            # 文本左上角放置，留一点内边距
-            for j in range(len(line_text)):
-                px = TEXT_X + 2 + j * (self.char_width + TEXT_SPACING)
-                py = TEXT_Y + i * self.line_height + 1
-                # create_text 支持 font 对象或(fontname, size) 元组
-                self.canvas.create_text(px, py, anchor="nw", text=line_text[j], font=self.font, tags="text")
-        # 绘制光标
-        if self.cursor_visible:
-            line_idx, col = self.raw_index_to_display_pos(self.cursor_index)
-            if self.view_start <= line_idx < self.view_start + TEXT_ROWS:
-                vis_row = line_idx - self.view_start
-                cx = TEXT_X + col * (self.char_width + TEXT_SPACING)
-                cy1 = TEXT_Y + vis_row * self.line_height + 2
-                cy2 = cy1 + self.line_height - 4
-                self.canvas.create_line(cx, cy1, cx, cy2, width=2, tags="text")
+        t0 = time.perf_counter()
+        self.renderer.draw(self.core.visible_lines(), self.cursor_cell(), self.core.visible_attrs())
         # 更新滚动条
         self.update_scrollbar()
+        t1 = time.perf_counter()
+        self.metrics.observe("paint", t1 - t0)
+        if self.key_at is not None:
+            self.metrics.observe("key_to_paint", t1 - self.key_at)
+            self.key_at = None
+        if "first_frame" not in self.boot:
+            self.boot["first_frame"] = t1 - BOOT_T0
+            print("启动耗时: " + ", ".join(f"{k} {v * 1000:.0f} ms" for k, v in self.boot.items()))
+
+# ----------------- 性能 HUD -----------------
+    def toggle_hud(self, event=None):
+        if self.hud_item is None:
+            self.hud_back = self.canvas.create_rectangle(0, 0, 0, 0, fill="black", outline="", tags="hud")
+            self.hud_item = self.canvas.create_text(8, 8, anchor="nw", text="", fill="#00ff00",
+                                                    font=("Courier", 11), tags="hud")
+            self.update_hud()
+        else:
+            if self.hud_id is not None:
+                self.root.after_cancel(self.hud_id)
+                self.hud_id = None
+            self.canvas.delete("hud")
+            self.hud_item = self.hud_back = None
+        return "break"
 
+    def hud_text(self):
+        snap = self.metrics.snapshot()
+        hist, counters, gauges = snap["histograms"], snap["counters"], snap["gauges"]
+
+        def ms(name, key):
+            return hist.get(name, {}).get(key, 0.0) * 1000
+
+        def rate(name):
+            return counters[name]["per_sec"] if name in counters else 0.0
+
+        frames = gauges["frames"]
+        lines = [
+            f"key->paint p50 {ms('key_to_paint', 'p50'):6.1f} p99 {ms('key_to_paint', 'p99'):6.1f} ms",
+            f"paint      p50 {ms('paint', 'p50'):6.1f} p99 {ms('paint', 'p99'):6.1f} ms"
+            f"  n={hist.get('paint', {}).get('count', 0)}",
+            f"tk items {gauges['tk.items']}  updates/s {rate('paint.item_updates'):.0f}"
+            f"  frames {frames['painted']}/{frames['requested']}",
+            f"serial in {rate('serial.bytes_in'):.0f} B/s  out {rate('serial.bytes_out'):.0f} B/s"
+            f"  wakeups {rate('serial.wakeups'):.1f}/s",
+            f"llm ttft p50 {ms('llm.first_token', 'p50'):6.0f} p99 {ms('llm.first_token', 'p99'):6.0f} ms",
+            f"llm total p50 {ms('llm.total', 'p50'):6.0f} p99 {ms('llm.total', 'p99'):6.0f} ms"
+            f"  n={hist.get('llm.total', {}).get('count', 0)}",
+            f"llm cache hits {counters.get('llm.cache_hits', {}).get('total', 0)}"
+            f"  errors {counters['llm.errors']['total']}",
+        ]
+        idle = gauges["idle"]
+        lines.append(f"{'idle' if idle['idle'] else 'active':>6}  cpu {rate('process.cpu_seconds') * 100:4.1f}%"
+                     f"  process wakeups {rate('process.wakeups'):.1f}/s  idle {idle['idle_seconds']:.0f} s")
+        if self.profiler.active:
+            lines.append("cProfile: recording")
+        return "\n".join(lines)
+
+    def update_hud(self):
+        # 定时刷新，只在 HUD 显示时运行
+        self.canvas.itemconfigure(self.hud_item, text=self.hud_text())
+        x1, y1, x2, y2 = self.canvas.bbox(self.hud_item)
+        self.canvas.coords(self.hud_back, x1 - 4, y1 - 4, x2 + 4, y2 + 4)
+        self.canvas.tag_raise("hud")
+        self.hud_id = self.root.after(HUD_INTERVAL_MS, self.update_hud)
+
+    def dump_metrics(self, event=None):
+        try:
+            self.metrics.dump(METRICS_FILENAME)
+            print(f"性能统计已导出到 {METRICS_FILENAME}")
+        except OSError as e:
+            print(f"性能统计导出失败: {e}")
+        return "break"
 
-# ----------------- 串口处理 -----------------
-    def read_serial(self):
-        while True:
+    def toggle_profile(self, event=None):
+        report = self.profiler.toggle()
+        if report is None:
+            print("cProfile 采集开始")
+        else:
+            print(f"cProfile 采集结束，已写入 {PROFILE_FILENAME}")
+            print(report)
+        return "break"
+
+# ----------------- 搜索 -----------------
+    def start_search(self, event=None):
+        """
+        开始增量搜索（从可视区第一行开始）；已在搜索中时跳到下一个匹配
+        """
+        self.governor.poke()
+        if self.search_query is None:
+            self.search_query = ""
+            self.search_origin = (self.core.view_start + self.core.lines_dropped, 0)
+            self.search_match = None
+            self.show_search()
+        else:
+            self.search_step(backward=False)
+        return "break"
+
+    def on_search_key(self, event):
+        """
+        搜索中的按键：可打印字符追加到查询串并从起点重新查找，BackSpace 删除最后一个字符，
+        Return / Down 跳到下一个匹配，Up 跳到上一个匹配，Escape 结束搜索
+        """
+        key = event.keysym
+        if key == "Escape":
+            self.end_search()
+        elif key == "BackSpace":
+            self.search_query = self.search_query[:-1]
+            self.run_search(*self.search_origin)
+        elif key in ("Return", "Down"):
+            self.search_step(backward=False)
+        elif key == "Up":
+            self.search_step(backward=True)
+        else:
+            ch = event.char
+            if ch and ord(ch) >= 32:
+                self.search_query += ch
+                self.run_search(*self.search_origin)
+        return "break"
+
+    def search_step(self, backward):
+        # 从当前匹配处继续查找，之后输入的字符也从这里开始
+        if self.search_match is not None:
+            self.search_origin = self.search_match
+        line, col = self.search_origin
+        self.run_search(line, col if backward or self.search_match is None else col + 1, backward)
+
+    def run_search(self, line, col, backward=False):
+        """
+        从 (绝对行号, 列) 开始查找 search_query，高亮匹配并把它滚动到可视区
+        """
+        core = self.core
+        pos = None
+        if self.search_query:
+            t0 = time.perf_counter()
+            pos = core.search(self.search_query, max(0, line - core.lines_dropped), col, backward)
+            self.metrics.observe("search", time.perf_counter() - t0)
+        if pos is None:
+            self.search_match = None
+            core.clear_highlight()
+        else:
+            self.search_match = (pos[0] + core.lines_dropped, pos[1])
+            core.set_highlight(pos[0], pos[1], len(self.search_query))
+            core.reveal(pos[0])
+        self.show_search()
+        self.update_scrollbar()
+        self.refresh()
+
+    def show_search(self):
+        text = f"Search: {self.search_query}"
+        if self.search_match is not None:
+            text += f"  [line {self.search_match[0] - self.core.lines_dropped + 1}]"
+        elif self.search_query:
+            text += "  [not found]"
+        self.canvas.itemconfigure(self.status_item, text=text)
+
+    def end_search(self):
+        if self.search_query is None:
+            return
+        self.search_query = None
+        self.search_match = None
+        self.core.clear_highlight()
+        self.show_status()
+        self.refresh()
+
+
+# ----------------- 会话切换 -----------------
+    # 编辑、绘制等方法作用于当前显示的会话
+    @property
+    def core(self):
+        return self.session.core
+
+    @property
+    def writer(self):
+        return self.session.writer
+
+    @property
+    def pacer(self):
+        return self.session.pacer
+
+    @property
+    def transfer(self):
+        return self.session.transfer
+
+    def switch_session(self, index):
+        index %= len(self.sessions)
+        if index != self.session.index:
+            self.end_search()
+            self.session = self.sessions[index]
+            self.show_status()
+            self.update_scrollbar()
+            self.refresh()
+        return "break"
+
+    def show_status(self, session=None):
+        """
+        状态行：当前会话编号与端口，以及该会话最近的传输状态
+        """
+        session = session or self.session
+        if session is not self.session or self.search_query is not None:
+            # 搜索中状态行显示查询串，结束搜索时再恢复
+            return
+        text = session.status
+        if len(self.sessions) > 1:
+            text = f"[{session.index + 1}/{len(self.sessions)} {session.port}] {text}"
+        self.canvas.itemconfigure(self.status_item, text=text)
+
+
+class SerialSession:
+    """
+    一个串口会话：串口、终端核心（独立的滚动缓冲区）、协议（独立的 DeepSeek 模式）、
+    写入合并、输出节拍器和文件传输。数据在共用的读取线程中进入 on_serial_data()，
+    经 GuiBridge 回到主线程；只有当前显示的会话会触发重绘。
+    """
+
+    def __init__(self, app, index, port):
+        self.app = app
+        self.index = index
+        self.port = port
+        root = app.root
+
+        # 串口初始化
+        try:
+            self.ser = serial.Serial(port = port, baudrate = BAUDRATE, bytesize = BYTESIZE, parity = PARITY, stopbits = STOPBITS, timeout=0.3, rtscts = FLOW_CONTROL == "rtscts")
+        except Exception as e:
+            print(f"串口打开失败: {e}")
+            self.ser = None
+
+        # 终端核心（文本模型、折行、光标、可视区），超出内存上限的旧内容溢出到磁盘环形文件
+        spill = None
+        if SCROLLBACK_SPILL:
+            name, ext = os.path.splitext(SPILL_FILENAME)
             try:
-                if self.ser and self.ser.in_waiting > 0:
-                    data = self.ser.read(self.ser.in_waiting).decode(errors="ignore")
-                    if data:
-                        if data != "\r":
-                            self.buffer += data
-                            self.insert_text_at_cursor(data)
-                        if data == "\n" :
-                            # 检查是否进入 DeepSeek 模式
-                            if "##DEEPSEEK##" in self.buffer:
-                                self.deepseek_mode = True
-                                self.buffer = ""
-                                self.insert_text_at_cursor("Enter DeepSeek mode...\n")
-                                self.send_serial("Enter DeepSeek mode...\r\n")
-                                continue
-
-                            # 检查是否退出 DeepSeek 模式
-                            if "##EXIT##" in self.buffer:
-                                self.deepseek_mode = False
-                                self.buffer = ""
-                                self.insert_text_at_cursor("Exit DeepSeek mode...\n")
-                                self.send_serial("Exit DeepSeek mode...\r\n")
-                                continue
-
-
-                            # 如果在 DeepSeek 模式，直接发送数据给 DeepSeek API
-                            if self.deepseek_mode and self.buffer :
-                                text_to_send = self.buffer
-                                self.buffer = ""
-                                self.insert_text_at_cursor("Message sent, please wait...\n")
-                                self.send_serial("Message sent, please wait...\r\n")
-                                response_text = self.deepseek_process(text_to_send)
-                                if response_text:
-                                    self.send_response_slowly(response_text, delay=5)  # 每字符间隔 0.005s
-            except Exception as e:
-                print(f"串口读取错误: {e}")
-                break
-            
-    def send_response_slowly(self, text, delay=5):
+                spill = SpillRing(SPILL_FILENAME if index == 0 else f"{name}.{index}{ext}", TEXT_COLS, SPILL_MAX_LINES)
+            except (OSError, ValueError) as e:
+                print(f"滚动缓冲区溢出文件创建失败: {e}")
+        self.core = TerminalCore(TEXT_COLS, TEXT_ROWS, SCROLLBACK_MAX_CHARS, SCROLLBACK_MAX_LINES, spill)
+        # 搜索索引在文本变化后分批建立，不占用插入路径
+        self.indexer = IdleTask(root, lambda: self.core.index_pending(SEARCH_INDEX_BLOCKS), SEARCH_INDEX_DELAY_MS)
+
+        # 主线程的串口写入合并：连续按键合并为一次写入
+        self.writer = WriteCoalescer(root, self.send_serial, WRITE_COALESCE_MS, WRITE_COALESCE_BYTES)
+        # 按波特率分块输出（回复与粘贴内容），屏幕按块批量更新
+        frame_bits = BYTESIZE + STOPBITS + 1 + (0 if PARITY == "N" else 1)
+        self.pacer = OutputPacer(root, self.ser, self.writer.send, self.insert_text, BAUDRATE,
+                                 frame_bits=frame_bits, interval_ms=PACER_INTERVAL_MS, flow=FLOW_CONTROL)
+
+        # 文件传输（同一时间只有一个，传输期间读取线程把数据交给它）
+        self.transfer = None
+        self.transfer_progress_at = 0.0
+        self.transfer_started = 0.0
+        self.status = ""
+        # DeepSeek 模式的对话历史（##RESET## 清空）
+        name, ext = os.path.splitext(HISTORY_FILENAME)
+        self.conversation = Conversation(HISTORY_FILENAME if index == 0 else f"{name}.{index}{ext}",
+                                         HISTORY_TOKEN_BUDGET)
+        commands = default_commands()
+        commands.register("RESET", self._cmd_reset)
+        for name, kind in (("XGET", "xmodem-send"), ("XPUT", "xmodem-recv"),
+                           ("DOWN", "text-send"), ("UP", "text-recv")):
+            commands.register(name, lambda proto, line, kind=kind, name=name:
+                              self.start_transfer(proto, kind, line.split(f"##{name}##", 1)[1]))
+
+        # 串口接收协议（在读取线程中运行）
+        self.protocol = SerialProtocol(
+            display=lambda text: app.bridge.post_text(text, self.write_device_text),
+            send=self.send_protocol,
+            query=self.deepseek_process,
+            pause=self.pacer.pause,
+            resume=self.pacer.resume,
+            xonxoff=FLOW_CONTROL == "xonxoff",
+            line_max=SERIAL_LINE_MAX,
+            commands=commands,
+        )
+
+    def _changed(self):
+        self.indexer.request()
+        # 只有当前显示的会话需要重绘
+        if self.app.session is self:
+            self.app.update_scrollbar()
+            self.app.refresh()
+
+    def insert_text(self, text):
+        self.app.governor.poke()
+        if self.core.insert(text):
+            self._changed()
+
+    def write_device_text(self, text):
         """
-        逐字符显示和发送
-        delay 单位是毫秒，5 表示 0.005s
+        串口收到的设备输出：整块交给 VT52 解析器（光标定位、清屏、反显等）
         """
-        def send_next(i=0):
-            if i < len(text):
-                c = text[i]
-                # 显示到屏幕
-                self.insert_text_at_cursor(c)
-                # 发送到串口
-                self.send_serial(c)
-                # 安排下一次调用
-                self.root.after(delay, send_next, i+1)
-            else:
-                self.insert_text_at_cursor("\n")
-                self.send_serial("\r\n")  # 最后输出换行结束
+        self.app.governor.poke()
+        if self.core.write(text):
+            self._changed()
+
+    def _cmd_reset(self, proto, line):
+        self.conversation.reset()
+        proto.notify("Conversation reset")
+
+    def close(self):
+        self.pacer.cancel()
+        self.indexer.cancel()
+        if self.transfer is not None:
+            self.transfer.cancel()
+        self.writer.flush()
+        self.core.close()
 
-        send_next(0)  # 从第一个字符开始
+# ----------------- 串口处理 -----------------
+    def on_serial_data(self, raw):
+        # 在共用的读取线程中调用
+        job = self.transfer
+        capture = self.app.capture
+        if job is not None and job.active:
+            if capture is not None:
+                capture.record(KIND_TRANSFER_IN, self.index, raw)
+            job.feed(raw)
+        else:
+            if capture is not None:
+                capture.record(KIND_IN, self.index, raw)
+            self.protocol.feed(raw)
 
     def send_serial(self, text):
         if self.ser:
             try:
-                self.ser.write(text.encode())
+                data = text.encode()
+                self.ser.write(data)
+                self.app.metrics.add("serial.bytes_out", len(data))
+                if self.app.capture is not None:
+                    self.app.capture.record(KIND_OUT, self.index, data)
             except Exception as e:
                 print(f"串口发送错误: {e}")
 
+    def send_protocol(self, text):
+        """
+        协议回送（命令提示等，在读取线程中调用）：转到主线程排进输出节拍器，
+        与粘贴内容和模型回复经同一条写入路径按顺序发出（已由 display 显示，不再回显）
+        """
+        self.app.bridge.post_call(self.pacer.send, text, "\n", False)
+
+    def write_serial_bytes(self, data):
+        # 文件传输的原始字节（在传输线程中调用）
+        if self.ser:
+            self.ser.write(data)
+            self.app.metrics.add("serial.bytes_out", len(data))
+            if self.app.capture is not None:
+                self.app.capture.record(KIND_TRANSFER_OUT, self.index, data)
+
+# ----------------- 文件传输 -----------------
+    def start_transfer(self, proto, kind, name):
+        """
+        ##XGET## / ##XPUT## / ##DOWN## / ##UP## 命令的处理（在读取线程中调用）：
+        创建传输并立即切换读取线程的数据去向，传输在工作线程中进行
+        """
+        path = transfer_path(TRANSFER_DIR, name)
+        if path is None:
+            proto.notify("Usage: ##XGET## FILE.DO")
+            return
+        job = self.transfer
+        # 已创建但尚未开始（等待提示写完）的传输也算占用
+        pending = job is not None and job.thread is None and not job.cancelled
+        if (job is not None and job.active) or pending or not self.pacer.idle() or not self.ser:
+            proto.notify("Transfer busy")
+            return
+        if kind in ("xmodem-send", "text-send") and not os.path.isfile(path):
+            proto.notify(f"No such file: {os.path.basename(path)}")
+            return
+        os.makedirs(TRANSFER_DIR, exist_ok=True)
+        frame_bits = BYTESIZE + STOPBITS + 1 + (0 if PARITY == "N" else 1)
+        label = f"{kind} {os.path.basename(path)}"
+        app = self.app
+        proto.notify(f"Ready: {label}")
+        self.transfer = Transfer(
+            kind, path, self.write_serial_bytes,
+            on_progress=lambda done, total: self._transfer_progress(label, done, total),
+            on_done=lambda ok, message: app.bridge.post_call(self.finish_transfer, label, ok, message),
+            baudrate=BAUDRATE, frame_bits=frame_bits,
+            newline=TEXT_UPLOAD_NEWLINE, line_delay=TEXT_LINE_DELAY_MS / 1000,
+            start_delay=TEXT_START_DELAY, timeout=TRANSFER_TIMEOUT,
+        )
+        app.bridge.post_call(self._begin_transfer, self.transfer)
+
+    def _begin_transfer(self, job):
+        """
+        主线程：等 "Ready" 提示经输出节拍器写完后再开始传输（传输期间由传输线程独占串口）
+        """
+        if job.cancelled or job is not self.transfer:
+            return
+        if not self.pacer.idle():
+            self.app.root.after(PACER_INTERVAL_MS, self._begin_transfer, job)
+            return
+        # 传输期间暂停输出节拍器（例如仍在到达的模型回复），结束后恢复；与设备的 XOFF/XON 分开记录
+        self.pacer.hold()
+        self.transfer_started = time.perf_counter()
+        job.start()
+
+    def _transfer_progress(self, label, done, total):
+        # 传输线程中调用；最多每 100ms 更新一次画布
+        now = time.perf_counter()
+        if now - self.transfer_progress_at < 0.1 and done != total:
+            return
+        self.transfer_progress_at = now
+        rate = done / max(1e-6, now - self.transfer_started)
+        if total:
+            text = f"{label}: {done}/{total} bytes ({done * 100 // total}%)"
+        else:
+            text = f"{label}: {done} bytes"
+        self.app.bridge.post_call(self.show_transfer_status, f"{text} {rate:.0f} B/s")
+
+    def show_transfer_status(self, text):
+        self.app.governor.poke()
+        self.status = text
+        self.app.show_status(self)
+
+    def finish_transfer(self, label, ok, message):
+        job = self.transfer
+        status = "done" if ok else "failed"
+        text = f"{label} {status}: {message}"
+        self.pacer.release()
+        if job is not None:
+            text += f" ({job.rate():.0f} B/s, {job.retransmits} retries)"
+        self.show_transfer_status(text)
+        self.write_device_text(text + "\n")
+
 # ----------------- DEEPSEEK处理 -----------------
     def deepseek_process(self, text):
-        try:
-            client = OpenAI(api_key=API_KEY, base_url="https://api.deepseek.com")
-            response = client.chat.completions.create(
-                model="deepseek-chat",
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant"},
-                    {"role": "user", "content": text},
-                ],
-                stream=False
-            )
-
-            # 返回内容
-            return response.choices[0].message.content
-        except Exception as e:
-            print(f"DeepSeek API 请求失败: {e}")
-            return "[DeepSeek Error]\n"
+        """
+        提交给 DeepSeek，立即返回；回复以流式分段回到主线程，收到第一段就开始显示和发送
+        """
+        app = self.app
+        if REPLY_REFLOW:
+            # 每次提问一个整理器，在工作线程中逐段整理；折行产生的换行在串口上发送为 CR LF
+            fmt = ReplyFormatter(TEXT_COLS)
+            send_token = lambda t: app.bridge.post_call(self.pacer.send, fmt.feed(t), "\r\n")
+            send_done = lambda: app.bridge.post_call(self.pacer.send, fmt.flush(), "\r\n")
+        else:
+            send_token = lambda t: app.bridge.post_call(self.pacer.send, t)
+            # 最后输出换行结束
+            send_done = lambda: app.bridge.post_call(self.pacer.send, "\n", "\r\n")
+
+        # 首段时间（只统计提供方流式返回的真实首段，缓存命中和出错另行计数）与总时间，从提交算起，含排队
+        t0 = time.perf_counter()
+
+        def on_first():
+            app.metrics.observe("llm.first_token", time.perf_counter() - t0)
+
+        def on_done():
+            app.metrics.observe("llm.total", time.perf_counter() - t0)
+            send_done()
+
+        app.deepseek.submit(text, on_token=send_token, on_done=on_done, history=self.conversation,
+                            on_first=on_first)
 
 # ----------------- 主程序 -----------------
 def main():
@@ -618,6 +1112,40 @@ def main():
             if hasattr(app, "blink_id") and app.blink_id is not None:
                 app.root.after_cancel(app.blink_id)  # 安全取消定时器
                 app.blink_id = None
+            app.frames.cancel()
+            app.governor.cancel()
+            if app.hud_id is not None:
+                app.root.after_cancel(app.hud_id)
+                app.hud_id = None
+            if app.profiler.active:
+                app.toggle_profile()
+            app.mux.close()
+            if app.deepseek.cache is not None:
+                cs = app.deepseek.cache.stats()
+                print(f"回复缓存: 命中 {cs['hits']} 次, 未命中 {cs['misses']} 次, 命中率 {cs['hit_rate']:.0%}, "
+                      f"{cs['bytes']} 字节")
+            ls = app.deepseek.stats()
+            print(f"模型请求: {ls['requests']} 次, 重试 {ls['retries']} 次, 对冲 {ls['hedged']} 次"
+                  f"（胜出 {ls['hedge_wins']} 次）, 失败 {ls['failures']} 次, "
+                  f"首段 p50 {ls['first_token_p50'] * 1000:.0f} ms / p99 {ls['first_token_p99'] * 1000:.0f} ms")
+            app.deepseek.close()
+            st = app.frames.stats()
+            print(f"重绘统计: 请求 {st['requested']} 次, 实际绘制 {st['painted']} 帧, 合并跳过 {st['skipped']} 次")
+            print(f"串口读取: {app.mux.wakeups_total()} 次唤醒, {app.mux.bytes_total()} 字节")
+            gs = app.governor.stats()
+            print(f"空闲模式: 进入 {gs['idle_count']} 次, 累计 {gs['idle_seconds']:.0f} 秒")
+            for session in app.sessions:
+                session.close()
+                print(f"[{session.port}] 串口输出: {session.pacer.bytes_sent} 字节, 平均 {session.pacer.rate():.0f} 字节/秒, "
+                      f"流控暂停 {session.pacer.stalls} 次")
+                print(f"[{session.port}] 串口写入: {session.writer.requests} 次请求, {session.writer.syscalls} 次系统调用, "
+                      f"{session.writer.syscalls_per_byte():.3f} 次/字节")
+            # 会话关闭时写出的最后一块数据也要录下
+            if app.capture is not None:
+                app.capture.close()
+                cs = app.capture.stats()
+                print(f"会话录制: {cs['records']} 条记录, {cs['bytes']} 字节, 写盘 {cs['flushes']} 次, "
+                      f"丢弃 {cs['dropped']} 条")
             app.canvas.delete("all")  # 清空CANVAS
             del app.bg_img  # 释放 PhotoImage
             app.root.quit()
@@ -0,0 +1,247 @@
+# raster.py
+# 光栅 LCD 渲染后端：用 PIL 预渲染字形图集，NumPy 把整屏合成到一块像素缓冲区，每帧推送一次 PhotoImage
+import os, shutil, subprocess
+import numpy as np
+from PIL import Image, ImageColor, ImageDraw, ImageFont, ImageTk
+
+from renderer import GridCursor
+
+
+def find_font_file(family, known=None):
+    """
+    按字体名找字体文件：先查 known（字体名 -> 路径），再用 fontconfig 的 fc-match；找不到返回 None
+    """
+    path = (known or {}).get(family)
+    if path and os.path.exists(path):
+        return path
+    if shutil.which("fc-match") is None:
+        return None
+    try:
+        out = subprocess.run(["fc-match", "-f", "%{file}", family], capture_output=True, text=True, timeout=2)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    path = out.stdout.strip()
+    return path if path and os.path.exists(path) else None
+
+
+def load_pil_font(family, size_px, known=None):
+    path = find_font_file(family, known)
+    if path:
+        try:
+            return ImageFont.truetype(path, size_px)
+        except OSError:
+            pass
+    try:
+        return ImageFont.load_default(size_px)
+    except TypeError:
+        # 旧版 Pillow 的默认字体没有字号参数
+        return ImageFont.load_default()
+
+
+class GlyphAtlas:
+    """
+    字形图集：每个字符一张 cell_h x cell_w x 3 的覆盖度掩码（float32，0..1，三个通道相同），
+    ASCII 可打印字符在创建时预渲染，其余字符第一次用到时渲染并缓存。
+    contrast 放大覆盖度（LCD 对比度）；pixel_grid > 1 时把字形量化为 pixel_grid 像素一格的点阵，
+    每格之间留 1 像素间隙，模拟 LCD 像素网格。
+    """
+
+    def __init__(self, font, cell_w, cell_h, offset=(2, 1), contrast=1.0, pixel_grid=0):
+        self.font = font
+        self.cell_w = cell_w
+        self.cell_h = cell_h
+        self.offset = offset
+        self.contrast = contrast
+        self.pixel_grid = pixel_grid
+        self.cache = {}
+        for code in range(32, 127):
+            self.get(chr(code))
+
+    def get(self, ch):
+        mask = self.cache.get(ch)
+        if mask is None:
+            mask = self.cache[ch] = self._render(ch)
+        return mask
+
+    def _render(self, ch):
+        img = Image.new("L", (self.cell_w, self.cell_h), 0)
+        ImageDraw.Draw(img).text(self.offset, ch, fill=255, font=self.font)
+        a = np.asarray(img, dtype=np.float32) / 255.0
+        if self.contrast != 1.0:
+            a = np.clip(a * self.contrast, 0.0, 1.0)
+        g = self.pixel_grid
+        if g > 1:
+            h2, w2 = self.cell_h // g * g, self.cell_w // g * g
+            dots = a[:h2, :w2].reshape(h2 // g, g, w2 // g, g).mean(axis=(1, 3)) >= 0.35
+            up = np.repeat(np.repeat(dots.astype(np.float32), g, axis=0), g, axis=1)
+            up[g - 1::g, :] = 0.0
+            up[:, g - 1::g] = 0.0
+            a = np.zeros_like(a)
+            a[:h2, :w2] = up
+        # 复制为 RGB 三个通道：整行合成时与像素数组形状相同，不走广播，乘法快约 2 倍
+        return np.repeat(a[:, :, None], 3, axis=2)
+
+
+class RasterFrame:
+    """
+    整屏像素缓冲区（rows*cell_h x cols*cell_w x RGB，uint8）。
+    compose() 按行比较影子屏幕，只重新合成字符或反显属性变化的格子（NumPy 切片；
+    一行中大部分格子都变化时整行一次合成）。
+    格子像素 = 底色 + (字色 - 底色) * 字形覆盖度；底色为背景图对应区域，反显时为实色。
+    背景图逐行不同，滚屏时不能直接平移像素；整行合成使用预先算好的 (字色 - 底色) 与预分配的缓冲区
+    （np.multiply / np.add 的 out= 参数），不产生临时数组。
+    """
+
+    def __init__(self, atlas, cols, rows, background=None, fg="black", reverse_fg="white"):
+        self.atlas = atlas
+        self.cols = cols
+        self.rows = rows
+        self.cell_w = atlas.cell_w
+        self.cell_h = atlas.cell_h
+        size = (cols * self.cell_w, rows * self.cell_h)
+        if background is None:
+            background = Image.new("RGB", size, "white")
+        elif background.size != size:
+            background = background.resize(size)
+        self.bg = np.asarray(background.convert("RGB"), dtype=np.uint8)
+        self.bg_f = self.bg.astype(np.float32)
+        self.fg = np.array(ImageColor.getrgb(fg)[:3], dtype=np.float32)
+        self.reverse_fg = np.array(ImageColor.getrgb(reverse_fg)[:3], dtype=np.float32)
+        self.delta = self.fg - self.bg_f
+        self.buf = self.bg.copy()
+        # 整行合成用的覆盖度与像素缓冲区
+        self._row_cov = np.empty((self.cell_h, size[0], 3), dtype=np.float32)
+        self._row_px = np.empty((self.cell_h, size[0], 3), dtype=np.float32)
+
+        # 影子屏幕：每行一个字符串（补齐到 cols）和一个反显标志元组
+        blank = " " * cols
+        self.shadow = [blank] * rows
+        self.shadow_attr = [None] * rows
+
+        # 统计：重新合成的格子数
+        self.cells_composed = 0
+
+    def compose(self, lines, attrs=None):
+        """
+        把可视行合成到缓冲区，返回重新合成的格子数
+        """
+        updates = 0
+        cols = self.cols
+        for i in range(self.rows):
+            line = lines[i] if i < len(lines) else ""
+            line = line[:cols].ljust(cols)
+            row_attrs = attrs[i] if attrs is not None and i < len(attrs) else None
+            if row_attrs is not None:
+                row_attrs = tuple(bool(x) for x in row_attrs[:cols]) + (False,) * max(0, cols - len(row_attrs))
+                if not any(row_attrs):
+                    row_attrs = None
+            old, old_attrs = self.shadow[i], self.shadow_attr[i]
+            if line == old and row_attrs == old_attrs:
+                continue
+            changed = []
+            for j in range(cols):
+                rev = row_attrs[j] if row_attrs is not None else False
+                old_rev = old_attrs[j] if old_attrs is not None else False
+                if line[j] != old[j] or rev != old_rev:
+                    changed.append(j)
+            if len(changed) > cols // 4:
+                # 大部分格子都变了（滚屏）：整行一次合成
+                self._row(i, line, row_attrs)
+            else:
+                for j in changed:
+                    self._cell(i, j, line[j], row_attrs[j] if row_attrs is not None else False)
+            updates += len(changed)
+            self.shadow[i] = line
+            self.shadow_attr[i] = row_attrs
+        self.cells_composed += updates
+        return updates
+
+    def _cell(self, i, j, ch, rev):
+        h, w = self.cell_h, self.cell_w
+        y, x = i * h, j * w
+        if ch == " " and not rev:
+            self.buf[y:y + h, x:x + w] = self.bg[y:y + h, x:x + w]
+            return
+        a = self.atlas.get(ch)
+        if rev:
+            base, ink = self.fg, self.reverse_fg
+        else:
+            base, ink = self.bg_f[y:y + h, x:x + w], self.fg
+        self.buf[y:y + h, x:x + w] = base + (ink - base) * a
+
+    def _row(self, i, line, row_attrs):
+        h, w = self.cell_h, self.cell_w
+        y = i * h
+        get = self.atlas.get
+        a = np.concatenate([get(ch) for ch in line], axis=1, out=self._row_cov)
+        base = self.bg_f[y:y + h]
+        if row_attrs is None:
+            px = self._row_px
+            np.multiply(self.delta[y:y + h], a, out=px)
+            np.add(px, base, out=px)
+            self.buf[y:y + h] = px
+            return
+        base = base.copy()
+        ink = np.empty((1, self.cols * w, 3), dtype=np.float32)
+        ink[:] = self.fg
+        for j, rev in enumerate(row_attrs):
+            if rev:
+                base[:, j * w:(j + 1) * w] = self.fg
+                ink[:, j * w:(j + 1) * w] = self.reverse_fg
+        self.buf[y:y + h] = base + (ink - base) * a
+
+    def image(self):
+        return Image.fromarray(self.buf, "RGB")
+
+
+class RasterRenderer(GridCursor):
+    """
+    与 CellGridRenderer 接口相同的光栅渲染后端：画布上只有一个图像项和一个光标项，
+    每帧（有格子变化时）把整屏缓冲区推送到同一个 PhotoImage，帧成本与可见字符数无关。
+    font 为程序选定的 tkfont.Font，按其字体名和像素字号用 PIL 渲染字形；
+    background 为整个窗口的背景图（PIL Image），文本区对应的部分作为底色。
+    """
+
+    def __init__(self, canvas, font, origin_x, origin_y, cols, rows, cell_w, line_h, tag="text",
+                 fg="black", reverse_fg="white", background=None, font_files=None,
+                 contrast=1.0, pixel_grid=0):
+        self.canvas = canvas
+        self.cols = cols
+        self.rows = rows
+        self.origin_x = origin_x
+        self.origin_y = origin_y
+        self.cell_w = cell_w
+        self.line_h = line_h
+        self.tag = tag
+
+        # Tk 字号为正数时单位是点，负数时是像素
+        actual = font.actual()
+        size = actual["size"]
+        size_px = -size if size < 0 else round(size * float(canvas.tk.call("tk", "scaling")))
+        pil_font = load_pil_font(actual["family"], size_px, font_files)
+        atlas = GlyphAtlas(pil_font, cell_w, line_h, contrast=contrast, pixel_grid=pixel_grid)
+        if background is not None:
+            background = background.crop((origin_x, origin_y, origin_x + cols * cell_w, origin_y + rows * line_h))
+        self.frame = RasterFrame(atlas, cols, rows, background, fg, reverse_fg)
+        self.photo = ImageTk.PhotoImage(self.frame.image())
+        self.image_item = canvas.create_image(origin_x, origin_y, anchor="nw", image=self.photo, tags=tag)
+
+        self._init_cursor(tag)
+
+        # 统计：累计的图元更新次数（每次推送图像计 1）
+        self.item_updates = 0
+        self.pushes = 0
+
+    def item_count(self):
+        return 2
+
+    def draw(self, lines, cursor=None, attrs=None):
+        """
+        与 CellGridRenderer.draw 相同；返回重新合成的格子数（加光标更新）
+        """
+        updates = self.frame.compose(lines, attrs)
+        if updates:
+            self.photo.paste(self.frame.image())
+            self.pushes += 1
+            self.item_updates += 1
+        return updates + self.set_cursor(cursor)
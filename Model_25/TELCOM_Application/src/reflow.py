@@ -0,0 +1,192 @@
+# reflow.py
+# 模型回复的流式整理：去掉 Markdown、转写为 Model 100 可显示的字符、按列宽折行
+import re, unicodedata
+
+# Unicode 标点等 -> ASCII（Model 100 只能显示 ASCII 和它自己的图形字符）
+_TRANSLIT = {
+    "‘": "'", "’": "'", "‚": "'", "‛": "'", "′": "'",
+    "“": '"', "”": '"', "„": '"', "‟": '"', "″": '"',
+    "«": '"', "»": '"', "「": '"', "」": '"', "『": '"', "』": '"',
+    "‐": "-", "‑": "-", "‒": "-", "–": "-", "—": "-", "―": "-", "−": "-",
+    "…": "...", "•": "*", "·": ".", "・": ".",
+    " ": " ", " ": " ", " ": " ", " ": " ", "​": "", "　": " ",
+    "。": ".", "、": ",", "×": "x", "÷": "/",
+    "→": "->", "←": "<-", "↔": "<->", "⇒": "=>",
+    "≤": "<=", "≥": ">=", "≠": "!=", "≈": "~", "±": "+/-",
+    "©": "(c)", "®": "(R)", "™": "TM", "€": "EUR", "£": "GBP", "¥": "JPY",
+    "°": " deg", "ß": "ss", "æ": "ae", "Æ": "AE", "ø": "o", "Ø": "O",
+    "œ": "oe", "Œ": "OE", "ł": "l", "Ł": "L", "đ": "d", "Đ": "D",
+    "✓": "v", "✔": "v", "✗": "x", "✘": "x",
+}
+_TRANSLIT_TABLE = str.maketrans(_TRANSLIT)
+_NON_ASCII = re.compile(r"[^\x00-\x7f]+")
+
+_TOKEN = re.compile(r"(\n)|([^\s]+)")
+_LINK_TARGET = re.compile(r"\]\([^\s)]*\)?")
+_EMPHASIS = re.compile(r"^[*_]+|[*_]+(?=[^\w]*$)")
+_HEADER = re.compile(r"#{1,6}")
+_RULE = re.compile(r"([-*_])\1{2,}")
+
+
+def _translit_run(match):
+    out = []
+    unknown = False
+    for ch in match.group(0):
+        mapped = unicodedata.normalize("NFKD", ch).encode("ascii", "ignore").decode()
+        if mapped:
+            out.append(mapped)
+            unknown = False
+        elif unicodedata.combining(ch):
+            continue
+        elif not unknown:
+            # 连续无法显示的字符（如中日韩文字）只用一个 '?' 表示
+            out.append("?")
+            unknown = True
+    return "".join(out)
+
+
+def transliterate(text):
+    """
+    转写为 ASCII：先查表，剩下的字符做兼容分解并去掉重音，仍无法表示的用 '?' 代替
+    """
+    if text.isascii():
+        return text
+    text = text.translate(_TRANSLIT_TABLE)
+    if text.isascii():
+        return text
+    return _NON_ASCII.sub(_translit_run, text)
+
+
+class ReplyFormatter:
+    """
+    模型回复的流式整理器，位于流式回复与串口输出之间：
+    - 去掉 Markdown 标记（标题 #、引用 >、代码围栏 ```、粗体/斜体/删除线/行内代码、链接地址、分隔线），
+      列表符号统一为 '-'；
+    - 转写为 Model 100 可显示的 ASCII；
+    - 按 cols 列折行（按词，不拆开单词；超长单词硬拆），合并连续空格和连续空行。
+    feed() 每次接收一段流式文本，只保留末尾尚未结束的单词，其余立即整理输出；
+    回复结束时调用 flush() 取出剩余部分。输出中的换行为 '\\n'。
+    """
+
+    def __init__(self, cols=40, max_pending=None):
+        self.cols = cols
+        # 一直没有空白（例如整段中文）时，积累到该长度也先输出
+        self.max_pending = max_pending or cols * 2
+        self.pending = ""
+        self.col = 0                # 当前输出行的列
+        self.line_words = 0         # 当前源行已处理的单词数
+        self.skip_line = False      # 当前源行不输出（代码围栏、分隔线）
+        self.in_fence = False
+        self.blank = True           # 输出当前以空行结束（含开头），用于合并空行
+
+        # 统计：输入 / 输出字符数
+        self.chars_in = 0
+        self.chars_out = 0
+
+    def feed(self, text):
+        self.chars_in += len(text)
+        text = self.pending + text
+        # 末尾没有空白结束的部分可能是半个单词，留到下一段
+        end = len(text)
+        while end > 0 and not text[end - 1].isspace():
+            end -= 1
+        if end == 0 and len(text) < self.max_pending:
+            self.pending = text
+            return ""
+        if end == 0:
+            end = len(text)
+        self.pending = text[end:]
+        return self._process(text[:end])
+
+    def flush(self):
+        """
+        回复结束：输出剩余部分，并保证以换行结束
+        """
+        text, self.pending = self.pending, ""
+        out = self._process(text)
+        if self.col > 0:
+            out += "\n"
+            self.col = 0
+            self.chars_out += 1
+        return out
+
+    def _process(self, text):
+        out = []
+        for newline, word in _TOKEN.findall(text):
+            if newline:
+                self._newline(out)
+            else:
+                self._word(word, out)
+        result = "".join(out)
+        self.chars_out += len(result)
+        return result
+
+    def _newline(self, out):
+        if self.col > 0:
+            out.append("\n")
+            self.col = 0
+            self.blank = False
+        elif self.line_words == 0 and not self.skip_line and not self.blank:
+            # 源文本中的空行（段落分隔）；连续空行只保留一个
+            out.append("\n")
+            self.blank = True
+        self.line_words = 0
+        self.skip_line = False
+
+    def _word(self, word, out):
+        if self.skip_line:
+            return
+        if self.line_words == 0:
+            if word.startswith("```"):
+                self.in_fence = not self.in_fence
+                self.skip_line = True
+                return
+            if not self.in_fence:
+                if word == ">" or _HEADER.fullmatch(word):
+                    return
+                if _RULE.fullmatch(word):
+                    self.skip_line = True
+                    return
+                if word in ("*", "+"):
+                    word = "-"
+        self.line_words += 1
+        if not self.in_fence:
+            word = self._inline(word)
+        word = transliterate(word)
+        if word:
+            self._emit(word, out)
+
+    @staticmethod
+    def _inline(word):
+        if "](" in word:
+            word = _LINK_TARGET.sub("", word)
+        if word.startswith("[") and "]" not in word:
+            word = word[1:]
+        for mark in ("**", "__", "~~", "`"):
+            if mark in word:
+                word = word.replace(mark, "")
+        if "*" in word or "_" in word:
+            word = _EMPHASIS.sub("", word)
+        return word
+
+    def _emit(self, word, out):
+        cols = self.cols
+        # 比一行还长的单词硬拆
+        while len(word) > cols:
+            if self.col > 0:
+                out.append("\n")
+                self.col = 0
+            out.append(word[:cols])
+            out.append("\n")
+            word = word[cols:]
+        if not word:
+            return
+        if self.col > 0 and self.col + 1 + len(word) > cols:
+            out.append("\n")
+            self.col = 0
+        if self.col > 0:
+            out.append(" ")
+            self.col += 1
+        out.append(word)
+        self.col += len(word)
+        self.blank = False
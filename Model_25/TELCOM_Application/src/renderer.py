@@ -0,0 +1,180 @@
+# renderer.py
+import time
+
+
+class GridCursor:
+    """
+    字符网格上的单一光标图元（两种渲染后端共用）：闪烁时只移动 / 显隐这一个图元
+    """
+
+    def _init_cursor(self, tag):
+        self.cursor_item = self.canvas.create_line(0, 0, 0, 0, width=2, state="hidden", tags=tag)
+        self.cursor_pos = None      # (row, col)，None 表示隐藏
+
+    def _cursor_coords(self, row, col):
+        cx = self.origin_x + col * self.cell_w
+        cy1 = self.origin_y + row * self.line_h + 2
+        cy2 = cy1 + self.line_h - 4
+        return cx, cy1, cx, cy2
+
+    def set_cursor(self, cursor):
+        """
+        只更新光标图元（例如光标闪烁），返回更新的图元数量
+        """
+        if cursor == self.cursor_pos:
+            return 0
+        if cursor is None:
+            self.canvas.itemconfigure(self.cursor_item, state="hidden")
+        else:
+            self.canvas.coords(self.cursor_item, *self._cursor_coords(*cursor))
+            if self.cursor_pos is None:
+                self.canvas.itemconfigure(self.cursor_item, state="normal")
+        self.cursor_pos = cursor
+        self.item_updates += 1
+        return 1
+
+
+class CellGridRenderer(GridCursor):
+    """
+    保留模式（retained-mode）字符网格渲染器。
+    初始化时一次性创建 cols x rows 个文本项和一个光标项，并保存屏幕的影子副本；
+    之后每次绘制只对字符发生变化的格子调用 itemconfigure，光标只移动/显隐同一个图元。
+    反显（VT52 ESC p）通过格子后面的背景矩形和交换前景色实现。
+    """
+
+    def __init__(self, canvas, font, origin_x, origin_y, cols, rows, cell_w, line_h, tag="text",
+                 fg="black", reverse_fg="white"):
+        self.canvas = canvas
+        self.fg = fg
+        self.reverse_fg = reverse_fg
+        self.cols = cols
+        self.rows = rows
+        self.origin_x = origin_x
+        self.origin_y = origin_y
+        self.cell_w = cell_w
+        self.line_h = line_h
+        self.tag = tag
+
+        # 影子屏幕：与画布上当前显示的字符（及反显属性）一一对应
+        self.shadow = [[" "] * cols for _ in range(rows)]
+        self.shadow_attr = [[False] * cols for _ in range(rows)]
+        # 反显格子的背景矩形，第一次用到时才创建
+        self.back_items = {}
+        self.items = []
+        for i in range(rows):
+            py = origin_y + i * line_h + 1
+            row_items = []
+            for j in range(cols):
+                px = origin_x + 2 + j * cell_w
+                row_items.append(canvas.create_text(px, py, anchor="nw", text=" ", font=font, fill=fg, tags=tag))
+            self.items.append(row_items)
+
+        # 单一光标图元
+        self._init_cursor(tag)
+
+        # 统计：累计的图元更新次数
+        self.item_updates = 0
+
+    def item_count(self):
+        return self.rows * self.cols + 1 + len(self.back_items)
+
+    def draw(self, lines, cursor=None, attrs=None):
+        """
+        lines：最多 rows 行可视文本；cursor：(row, col) 或 None（隐藏光标）
+        attrs：可选，每行一个反显标志列表（或 None 表示整行正常显示）
+        返回本次更新的图元数量
+        """
+        updates = 0
+        canvas = self.canvas
+        for i in range(self.rows):
+            line = lines[i] if i < len(lines) else ""
+            shadow_row = self.shadow[i]
+            row_items = self.items[i]
+            for j in range(self.cols):
+                ch = line[j] if j < len(line) else " "
+                if shadow_row[j] != ch:
+                    canvas.itemconfigure(row_items[j], text=ch)
+                    shadow_row[j] = ch
+                    updates += 1
+            row_attrs = attrs[i] if attrs is not None and i < len(attrs) else None
+            if row_attrs is not None or any(self.shadow_attr[i]):
+                updates += self._draw_attrs(i, row_attrs)
+        self.item_updates += updates
+        return updates + self.set_cursor(cursor)
+
+    def _draw_attrs(self, i, row_attrs):
+        updates = 0
+        canvas = self.canvas
+        shadow_row = self.shadow_attr[i]
+        for j in range(self.cols):
+            rev = bool(row_attrs[j]) if row_attrs is not None and j < len(row_attrs) else False
+            if shadow_row[j] == rev:
+                continue
+            back = self.back_items.get((i, j))
+            if back is None:
+                x = self.origin_x + 2 + j * self.cell_w
+                y = self.origin_y + i * self.line_h
+                back = canvas.create_rectangle(x, y, x + self.cell_w, y + self.line_h,
+                                               fill=self.fg, width=0, state="hidden", tags=self.tag)
+                canvas.tag_lower(back, self.items[i][j])
+                self.back_items[(i, j)] = back
+            canvas.itemconfigure(back, state="normal" if rev else "hidden")
+            canvas.itemconfigure(self.items[i][j], fill=self.reverse_fg if rev else self.fg)
+            shadow_row[j] = rev
+            updates += 2
+        return updates
+
+
+class FrameScheduler:
+    """
+    合并重绘请求的帧调度器。
+    request() 只把视图标记为 dirty；同一帧内的多次请求合并为一次 paint 回调。
+    max_fps > 0 时两次绘制至少间隔 1/max_fps 秒；max_fps <= 0 时只用 after_idle 合并。
+    """
+
+    def __init__(self, root, paint, max_fps=60):
+        self.root = root
+        self.paint = paint
+        self.frame_interval = 1.0 / max_fps if max_fps > 0 else 0.0
+        self.pending_id = None
+        self.last_paint = 0.0
+
+        # 统计：请求次数 / 实际绘制帧数（被合并掉的 = 请求 - 绘制）
+        self.requested = 0
+        self.painted = 0
+
+    @property
+    def skipped(self):
+        return self.requested - self.painted
+
+    def request(self):
+        self.requested += 1
+        if self.pending_id is not None:
+            return
+        delay = self.last_paint + self.frame_interval - time.perf_counter()
+        if delay <= 0:
+            self.pending_id = self.root.after_idle(self._run)
+        else:
+            self.pending_id = self.root.after(int(delay * 1000) + 1, self._run)
+
+    def flush(self):
+        """
+        如有待绘制的帧，立即绘制
+        """
+        if self.pending_id is not None:
+            self.root.after_cancel(self.pending_id)
+            self._run()
+
+    def cancel(self):
+        if self.pending_id is not None:
+            self.root.after_cancel(self.pending_id)
+            self.pending_id = None
+
+    def _run(self):
+        self.pending_id = None
+        self.last_paint = time.perf_counter()
+        self.painted += 1
+        self.paint()
+
+    def stats(self):
+        return {"requested": self.requested, "painted": self.painted, "skipped": self.skipped}
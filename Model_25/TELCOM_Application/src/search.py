@@ -0,0 +1,116 @@
+# search.py
+# 滚动缓冲区的增量搜索索引：按文本块编号的三字组（trigram）倒排表
+from array import array
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TrigramIndex:
+    """
+    以文本块（调用方决定，例如连续的若干显示行）为单位的三字组倒排索引（大小写不敏感，由调用方传入小写文本）。
+    块号为递增的绝对编号，前面的块被丢弃时已有的倒排项仍然有效；以块为单位使倒排项少、查询时的交集小。
+    - add(line_id, text)：加入一块的三字组，倒排表只在末尾追加（array，紧凑）；
+    - invalidate(line_id)：该块及之后的块需要重新索引（中间编辑时）；
+      旧的倒排项不删除，查询时由调用方用实际文本校验，过期项只会产生多余的候选；
+    - candidates(query)：可能包含 query 的块号（已排序）；query 少于 3 个字符，或最稀有的三字组也出现在
+      超过 DENSE_FRACTION 的块中（求交集比直接扫描还慢）时返回 None（调用方逐块扫描）。
+    过期项（重新索引、已丢弃的块）累计超过有效项时，compact() 重建倒排表。
+    """
+
+    DENSE_FRACTION = 0.25
+
+    def __init__(self):
+        self.postings = {}      # 三字组 -> array('I') 块号
+        self.indexed = 0        # [min_id, indexed) 的块已建立索引
+        self.high = 0           # 曾经索引过的最大块号 + 1
+        self.min_id = 0         # 更早的块已被丢弃
+        self.entries = 0        # 倒排项总数
+        self.stale = 0          # 其中过期的倒排项（估计值）
+
+        # 统计
+        self.lines_indexed = 0
+        self.compactions = 0
+
+    def add(self, line_id, text):
+        grams = trigrams(text)
+        postings = self.postings
+        added = 0
+        for g in grams:
+            p = postings.get(g)
+            if p is None:
+                p = postings[g] = array("I")
+            if not p or p[-1] != line_id:
+                p.append(line_id)
+                added += 1
+        if line_id < self.high:
+            # 重新索引：以新的项数估计该块原有的（已过期的）项数
+            self.stale += added
+        self.entries += added
+        self.indexed = line_id + 1
+        self.high = max(self.high, self.indexed)
+        self.lines_indexed += 1
+
+    def invalidate(self, line_id):
+        line_id = max(line_id, self.min_id)
+        if line_id < self.indexed:
+            self.indexed = line_id
+
+    def drop_before(self, min_id):
+        """
+        min_id 之前的块已被丢弃
+        """
+        if min_id <= self.min_id:
+            return
+        lines = max(1, self.high - self.min_id)
+        self.stale += self.entries * (min(min_id, self.high) - self.min_id) // lines
+        self.min_id = min_id
+        self.indexed = max(self.indexed, min_id)
+        self.high = max(self.high, min_id)
+
+    def needs_compact(self):
+        return self.stale > max(4096, self.entries - self.stale)
+
+    def compact(self):
+        """
+        去掉已丢弃和未索引范围内的块号以及重复项（同一块重新索引前的过期项仍由查询时的校验排除）
+        """
+        lo, hi = self.min_id, self.indexed
+        postings = {}
+        entries = 0
+        for g, p in self.postings.items():
+            ids = sorted({i for i in p if lo <= i < hi})
+            if ids:
+                postings[g] = array("I", ids)
+                entries += len(ids)
+        self.postings = postings
+        self.entries = entries
+        self.stale = 0
+        self.high = hi
+        self.compactions += 1
+
+    def candidates(self, query):
+        grams = trigrams(query)
+        if not grams:
+            return None
+        lists = []
+        for g in grams:
+            p = self.postings.get(g)
+            if p is None:
+                return []
+            lists.append(p)
+        # 从最短的倒排表开始求交集，结果为空时提前结束
+        lists.sort(key=len)
+        if len(lists[0]) > self.DENSE_FRACTION * max(1, self.indexed - self.min_id):
+            return None
+        result = set(lists[0])
+        for p in lists[1:]:
+            result.intersection_update(p)
+            if not result:
+                break
+        lo, hi = self.min_id, self.indexed
+        return sorted(i for i in result if lo <= i < hi)
+
+    def memory_bytes(self):
+        return sum(p.buffer_info()[1] * p.itemsize for p in self.postings.values())
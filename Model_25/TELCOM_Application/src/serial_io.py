@@ -0,0 +1,494 @@
+# serial_io.py
+import os, queue, threading, selectors, time
+from collections import deque
+
+
+class GuiBridge:
+    """
+    串口线程 -> Tk 主线程的事件桥。
+    后台线程只调用 post_text()/post_call() 把数据放进队列；
+    主线程在一次调度回调中取出全部待处理项：连续的文本合并为一次批量插入，回调按顺序执行。
+    这样后台线程不会直接访问 Tk 画布，快速串口输入也只触发一次折行和重绘。
+    """
+
+    EVENT = "<<SerialData>>"
+
+    def __init__(self, root, on_text=None):
+        self.root = root
+        self.on_text = on_text
+        self.queue = queue.SimpleQueue()
+        self._wake_pending = threading.Event()
+        root.bind(self.EVENT, self._drain)
+
+        # 统计：收到的数据项数 / 主线程处理批次数
+        self.items = 0
+        self.batches = 0
+
+    # ---------------- 后台线程调用 ----------------
+    def post_text(self, text, on_text=None):
+        """
+        on_text 为空时交给默认的 on_text；多会话时每个会话传入自己的处理函数
+        """
+        if text:
+            self.queue.put((on_text or self.on_text, text))
+            self._wake()
+
+    def post_call(self, fn, *args):
+        self.queue.put((fn, args))
+        self._wake()
+
+    def _wake(self):
+        # 已有一次唤醒在排队时不再重复发送事件
+        if self._wake_pending.is_set():
+            return
+        self._wake_pending.set()
+        try:
+            self.root.event_generate(self.EVENT, when="tail")
+        except Exception as e:
+            # 主循环已退出
+            self._wake_pending.clear()
+            print(f"事件投递失败: {e}")
+
+    # ---------------- 主线程调用 ----------------
+    def _drain(self, event=None):
+        # 先清除标记再取数据，保证之后放入的数据一定会触发新的唤醒
+        self._wake_pending.clear()
+        pending = []
+        pending_fn = None
+        while True:
+            try:
+                fn, arg = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            self.items += 1
+            if isinstance(arg, str):
+                # 同一目标的连续文本合并为一次调用
+                if pending and fn != pending_fn:
+                    pending_fn("".join(pending))
+                    pending = []
+                pending_fn = fn
+                pending.append(arg)
+                continue
+            if pending:
+                pending_fn("".join(pending))
+                pending = []
+            fn(*arg)
+        if pending:
+            pending_fn("".join(pending))
+        self.batches += 1
+
+
+class SerialReader:
+    """
+    阻塞式串口读取（替代轮询 in_waiting 的忙循环）。
+    - POSIX 且串口有 fileno() 时：用 selectors 在内核中等待可读，唤醒后一次读出全部可用数据；
+    - 否则（如 Windows）：read(1) 阻塞到第一个字节或超时，再读出 in_waiting 中剩余的数据。
+    空闲时线程不占用 CPU，只在数据到达或超时时被唤醒。
+    """
+
+    def __init__(self, ser, timeout=1.0, use_select=None):
+        self.ser = ser
+        self.timeout = timeout
+        if use_select is None:
+            use_select = os.name == "posix" and hasattr(ser, "fileno")
+        self.selector = None
+        if use_select:
+            try:
+                self.selector = selectors.DefaultSelector()
+                self.selector.register(ser.fileno(), selectors.EVENT_READ)
+            except (OSError, ValueError, AttributeError):
+                self.selector = None
+        if self.selector is None:
+            # read(1) 的阻塞上限
+            ser.timeout = timeout
+
+        # 统计：唤醒次数 / 读取字节数
+        self.wakeups = 0
+        self.bytes_read = 0
+
+    def read_chunk(self):
+        """
+        阻塞直到有数据（或超时），返回本次读到的全部字节（超时返回 b""）
+        """
+        ser = self.ser
+        if self.selector is not None:
+            ready = self.selector.select(self.timeout)
+            self.wakeups += 1
+            if not ready:
+                return b""
+            data = ser.read(max(1, ser.in_waiting))
+        else:
+            data = ser.read(1)
+            self.wakeups += 1
+            if data:
+                n = ser.in_waiting
+                if n:
+                    data += ser.read(n)
+        self.bytes_read += len(data)
+        return data
+
+    def run(self, on_data, stop_event=None):
+        """
+        读取循环：每次唤醒把读到的字节交给 on_data，直到 stop_event 被设置
+        """
+        while stop_event is None or not stop_event.is_set():
+            data = self.read_chunk()
+            if data:
+                on_data(data)
+
+    def attach(self, loop, on_data):
+        """
+        asyncio 方式：把串口注册到事件循环（loop.add_reader），可读时回调 on_data(bytes)。
+        仅支持有 fileno() 的 POSIX 串口。
+        """
+        fd = self.ser.fileno()
+
+        def _readable():
+            data = self.ser.read(max(1, self.ser.in_waiting))
+            self.wakeups += 1
+            self.bytes_read += len(data)
+            if data:
+                on_data(data)
+
+        loop.add_reader(fd, _readable)
+        return lambda: loop.remove_reader(fd)
+
+    def close(self):
+        if self.selector is not None:
+            self.selector.close()
+            self.selector = None
+
+
+class SerialMux:
+    """
+    多个串口共用一个读取线程。
+    - POSIX：所有串口注册到同一个 selectors 选择器，一次 select() 等待全部端口，
+      哪个端口可读就读出它的全部可用数据，空闲时线程阻塞在内核中，CPU 不随端口数增长；
+    - 没有 fileno() 的串口（如 Windows）：退回到每个端口一个 SerialReader 阻塞线程。
+    选择器上还注册了一个唤醒管道：close() 通过它立即唤醒 select()，
+    因此 timeout 可以设为 None（完全阻塞，空闲时没有任何唤醒），见 set_timeout()。
+    """
+
+    def __init__(self, timeout=1.0):
+        self.timeout = timeout
+        self.selector = selectors.DefaultSelector() if os.name == "posix" else None
+        self.wake_fds = None
+        self.wake_lock = threading.Lock()
+        if self.selector is not None:
+            self.wake_fds = os.pipe()
+            os.set_blocking(self.wake_fds[0], False)
+            os.set_blocking(self.wake_fds[1], False)
+            self.selector.register(self.wake_fds[0], selectors.EVENT_READ, None)
+        self.fallback = []      # [(SerialReader, thread)]
+        self.ports = 0          # 注册在选择器上的串口数
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        # 统计：唤醒次数 / 读取字节数
+        self.wakeups = 0
+        self.bytes_read = 0
+
+    def add(self, ser, on_data):
+        """
+        注册一个串口；可读时在读取线程中调用 on_data(bytes)
+        """
+        if self.selector is not None and hasattr(ser, "fileno"):
+            try:
+                self.selector.register(ser.fileno(), selectors.EVENT_READ, (ser, on_data))
+                self.ports += 1
+                return
+            except (OSError, ValueError, AttributeError):
+                pass
+        reader = SerialReader(ser, self.timeout, use_select=False)
+        t = threading.Thread(target=self._run_fallback, args=(reader, on_data), daemon=True)
+        self.fallback.append((reader, t))
+        if self.thread is not None:
+            t.start()
+
+    def _run_fallback(self, reader, on_data):
+        try:
+            reader.run(on_data, self.stop_event)
+        except Exception as e:
+            print(f"串口读取错误: {e}")
+
+    def start(self):
+        if self.selector is not None and self.ports:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+        else:
+            self.thread = threading.current_thread()
+        for _, t in self.fallback:
+            t.start()
+
+    def run(self):
+        """
+        读取循环（selectors）：一次唤醒处理所有已就绪的端口
+        """
+        selector = self.selector
+        try:
+            self._loop(selector)
+        finally:
+            # 在读取线程中关闭，避免与正在进行的 select() 竞争
+            self._close_selector()
+
+    def _loop(self, selector):
+        while not self.stop_event.is_set():
+            ready = selector.select(self.timeout)
+            self.wakeups += 1
+            for key, _ in ready:
+                if key.data is None:
+                    # 唤醒管道（close() / set_timeout()）
+                    try:
+                        os.read(key.fd, 64)
+                    except OSError:
+                        pass
+                    continue
+                ser, on_data = key.data
+                try:
+                    data = ser.read(max(1, ser.in_waiting))
+                except Exception as e:
+                    print(f"串口读取错误: {e}")
+                    selector.unregister(key.fd)
+                    continue
+                if data:
+                    self.bytes_read += len(data)
+                    try:
+                        on_data(data)
+                    except Exception as e:
+                        print(f"串口数据处理错误: {e}")
+
+    def wakeups_total(self):
+        return self.wakeups + sum(reader.wakeups for reader, _ in self.fallback)
+
+    def bytes_total(self):
+        return self.bytes_read + sum(reader.bytes_read for reader, _ in self.fallback)
+
+    def set_timeout(self, timeout):
+        """
+        修改 select() 的超时；None 表示完全阻塞，只在数据到达或 close() 时唤醒（空闲省电）。
+        只作用于选择器；退回的 SerialReader 线程保持原来的超时。
+        """
+        self.timeout = timeout
+        self._wake()
+
+    def _wake(self):
+        with self.wake_lock:
+            if self.wake_fds is not None:
+                try:
+                    os.write(self.wake_fds[1], b"\0")
+                except BlockingIOError:
+                    # 管道已满：已有唤醒在排队
+                    pass
+
+    def _close_selector(self):
+        self.selector.close()
+        with self.wake_lock:
+            if self.wake_fds is not None:
+                for fd in self.wake_fds:
+                    os.close(fd)
+                self.wake_fds = None
+
+    def close(self):
+        self.stop_event.set()
+        if self.selector is not None and (self.thread is None or self.thread is threading.current_thread()):
+            # 读取线程没有运行
+            self._close_selector()
+        else:
+            self._wake()
+
+
+class OutputPacer:
+    """
+    按波特率节奏输出到串口（在 Tk 主线程中以 root.after 定时运行）。
+    - 令牌桶：每个周期按 baudrate / frame_bits 字节每秒累积额度，按块写入串口，而不是每字符一个定时器；
+    - 流控：RTS/CTS 时 CTS 无效则暂停；XON/XOFF 由读取线程收到 XOFF/XON 后调用 pause()/resume()；
+      串口发送缓冲区积压时也暂停；
+    - hold()/release()：程序自身需要暂停输出（如文件传输独占串口），与设备的 XOFF/XON 状态互不影响；
+    - 每块文本同时回显到屏幕（on_echo），一块只触发一次插入和重绘；
+    - 统计实际达到的字节/秒。
+    """
+
+    def __init__(self, root, ser, write, on_echo, baudrate, frame_bits=10, interval_ms=20, flow="none"):
+        self.root = root
+        self.ser = ser
+        self.write = write
+        self.on_echo = on_echo
+        self.bytes_per_sec = baudrate / frame_bits
+        self.interval_ms = interval_ms
+        self.flow = flow
+        # 每周期的字节额度（至少 1）
+        self.chunk = max(1, int(self.bytes_per_sec * interval_ms / 1000))
+
+        self.pending = deque()      # [text, pos, newline, echo]
+        self.tick_id = None
+        self.allowance = 0.0
+        self.last_tick = 0.0
+        self._xoff = threading.Event()
+        self.held = False           # hold() 设置，只在主线程中访问
+
+        # 统计
+        self.bytes_sent = 0
+        self.busy_time = 0.0
+        self.stalls = 0
+
+    # ---------------- 流控 ----------------
+    def pause(self):
+        """
+        收到 XOFF（可在任意线程调用）
+        """
+        self._xoff.set()
+
+    def resume(self):
+        """
+        收到 XON（可在任意线程调用）
+        """
+        self._xoff.clear()
+
+    def hold(self):
+        """
+        暂停输出直到 release()（主线程调用），不改变 XOFF 状态
+        """
+        self.held = True
+
+    def release(self):
+        """
+        结束 hold()；设备此间发来的 XOFF 仍然有效，直到收到 XON
+        """
+        self.held = False
+
+    def _blocked(self):
+        if self.held or self._xoff.is_set():
+            return True
+        ser = self.ser
+        if ser is None:
+            return False
+        try:
+            if self.flow == "rtscts" and not ser.cts:
+                return True
+            # 串口驱动发送缓冲区还有较多未发出的数据时等待
+            if ser.out_waiting > self.chunk * 2:
+                return True
+        except Exception:
+            pass
+        return False
+
+    # ---------------- 发送 ----------------
+    def send(self, text, newline="\n", echo=True):
+        """
+        排队发送 text（主线程调用）；串口上的 '\\n' 替换为 newline，屏幕上保持 '\\n'
+        """
+        if not text:
+            return
+        self.pending.append([text, 0, newline, echo])
+        if self.tick_id is None:
+            self.allowance = float(self.chunk)
+            self.last_tick = time.perf_counter()
+            self._tick()
+
+    def idle(self):
+        return not self.pending
+
+    def _tick(self):
+        now = time.perf_counter()
+        elapsed = now - self.last_tick
+        self.last_tick = now
+        self.busy_time += elapsed
+        if self._blocked():
+            self.stalls += 1
+        else:
+            self.allowance = min(self.allowance + elapsed * self.bytes_per_sec, self.chunk * 2.0)
+            self._send_budget()
+        if self.pending:
+            self.tick_id = self.root.after(self.interval_ms, self._tick)
+        else:
+            self.tick_id = None
+
+    def _send_budget(self):
+        while self.pending and self.allowance >= 1:
+            item = self.pending[0]
+            text, pos, newline, echo = item
+            n = min(int(self.allowance), len(text) - pos)
+            piece = text[pos:pos + n]
+            wire = piece.replace("\n", newline) if newline != "\n" else piece
+            data_len = len(wire.encode())
+            self.write(wire)
+            if echo:
+                self.on_echo(piece)
+            self.bytes_sent += data_len
+            self.allowance -= data_len
+            item[1] = pos + n
+            if item[1] >= len(text):
+                self.pending.popleft()
+
+    def rate(self):
+        """
+        实际达到的字节/秒（只统计有数据待发送的时间）
+        """
+        return self.bytes_sent / self.busy_time if self.busy_time > 0 else 0.0
+
+    def cancel(self):
+        if self.tick_id is not None:
+            self.root.after_cancel(self.tick_id)
+            self.tick_id = None
+        self.pending.clear()
+
+
+class WriteCoalescer:
+    """
+    串口写入合并（类似 Nagle 算法，在 Tk 主线程使用）。
+    键盘回显的单个字符先放进缓冲区，满足以下任一条件时合并成一次写入：
+    - 距第一个未发送字符超过 delay_ms（远小于一帧，感觉不到延迟）；
+    - 缓冲区达到 max_bytes；
+    - 遇到回车/换行，或调用 send()/flush()。
+    """
+
+    def __init__(self, root, raw_write, delay_ms=4, max_bytes=32):
+        self.root = root
+        self.raw_write = raw_write
+        self.delay_ms = delay_ms
+        self.max_bytes = max_bytes
+        self.pending = []
+        self.pending_len = 0
+        self.flush_id = None
+
+        # 统计：实际写入（系统调用）次数 / 字节数 / 调用 write 的次数
+        self.syscalls = 0
+        self.bytes_out = 0
+        self.requests = 0
+
+    def write(self, text):
+        if not text:
+            return
+        self.requests += 1
+        self.pending.append(text)
+        self.pending_len += len(text)
+        if self.pending_len >= self.max_bytes or "\n" in text or "\r" in text:
+            self.flush()
+        elif self.flush_id is None:
+            self.flush_id = self.root.after(self.delay_ms, self.flush)
+
+    def send(self, text):
+        """
+        连同缓冲区中的内容立即写出（保持先后顺序）
+        """
+        if text:
+            self.requests += 1
+            self.pending.append(text)
+            self.pending_len += len(text)
+        self.flush()
+
+    def flush(self):
+        if self.flush_id is not None:
+            self.root.after_cancel(self.flush_id)
+            self.flush_id = None
+        if not self.pending:
+            return
+        text = "".join(self.pending)
+        self.pending = []
+        self.pending_len = 0
+        self.raw_write(text)
+        self.syscalls += 1
+        self.bytes_out += len(text.encode())
+
+    def syscalls_per_byte(self):
+        return self.syscalls / self.bytes_out if self.bytes_out else 0.0
@@ -0,0 +1,725 @@
+# terminal_core.py
+# 与图形界面无关的终端核心：文本模型、折行、光标、可视区以及串口协议处理。
+# 不依赖 Tk，可以在没有显示器的环境中直接驱动和测量（见 benchmark.py）。
+import codecs
+from bisect import bisect_left, bisect_right
+
+from textbuffer import GapBuffer, ScrollbackView
+from wrapindex import WrapIndex
+from commands import CommandRegistry
+from vt52 import ScreenGrid, VT52Parser
+from search import TrigramIndex
+
+XON, XOFF = "\x11", "\x13"
+
+
+class TerminalCore:
+    """
+    终端文本模型。
+    raw_text（间隙缓冲区）+ cursor_index 保存文本与插入点；WrapIndex 增量折行；
+    超出上限的旧内容溢出到 spill（SpillRing，可为 None）；view_start 为可视区第一行。
+    编辑和光标方法返回是否有变化，由界面决定是否重绘。
+    设备输出经 write() 交给 VT52 解析器；收到光标定位/清屏等转义序列后进入全屏模式，
+    此时最后 rows 行由 ScreenGrid 提供，从网格顶部滚出的行追加到 raw_text 作为历史。
+    search() 在整个滚动缓冲区（含磁盘溢出行）中查找，由三字组索引支持；索引不在插入路径上建立，
+    而是由界面在空闲时分批调用 index_pending() 为写完的块增量建立，搜索开始时只需补齐剩余的少量块。
+    """
+
+    # 搜索索引以 SEARCH_BLOCK_LINES 个显示行为一块
+    SEARCH_BLOCK_LINES = 64
+
+    def __init__(self, cols, rows, max_chars=None, max_lines=None, spill=None, search_index=True):
+        self.cols = cols
+        self.rows = rows
+        self.max_chars = max_chars
+        self.max_lines = max_lines
+
+        # 文本存储：间隙缓冲区 + 光标索引（相对于 raw_text 的位置）
+        self.raw_text = GapBuffer()  # 原始文本，包含换行符 '\n'；接口与 str 相同
+        self.cursor_index = 0   # 插入点在 raw_text 中的位置 (0..len(raw_text))
+        # 折行索引
+        self.wrap = WrapIndex(self.raw_text, cols)
+        # 超出内存上限的旧内容溢出到磁盘环形文件
+        self.spill = spill
+        # display_lines / line_ranges：磁盘溢出行 + 内存折行索引的只读视图
+        # （溢出行不在 raw_text 中，其 line_ranges 为 (0, 0)）
+        self.display_lines = ScrollbackView(self.spill, self.wrap.lines)
+        self.line_ranges = ScrollbackView(self.spill, self.wrap.ranges, (0, 0))
+
+        self.view_start = 0      # display_lines 的起始可视行索引
+
+        # 全屏模式的字符网格（None 表示普通的行模式）与设备输出的转义序列解析器
+        self.screen = None
+        self.parser = VT52Parser(self)
+
+        # 搜索：绝对行号 = 显示行号 + lines_dropped（从滚动缓冲区开头丢弃的行数），索引中的块号 = 绝对行号 // SEARCH_BLOCK_LINES
+        self.search_index = TrigramIndex() if search_index else None
+        self.lines_dropped = 0
+        self.highlight = None   # 搜索匹配的高亮 (绝对行号, 列, 长度)
+
+        # 统计
+        self.inserts = 0
+        self.chars_inserted = 0
+
+    # ---------------- 文本与显示行重建 ----------------
+    def rebuild_display(self):
+        """
+        display_lines（显示行）和 line_ranges（每行对应的 raw_text 索引范围）由增量折行索引提供：
+        line_ranges[i] = (start_raw_index, end_raw_index_exclusive)
+        编辑时只重新折行被修改的段落；这里仅在索引被标记为 dirty（整体替换文本）时才全量重建，
+        单纯的重绘、光标移动不会触发重建。
+        """
+        if self.wrap.dirty:
+            self.wrap.rebuild()
+            if self.search_index is not None:
+                self.search_index.invalidate(self.lines_dropped // self.SEARCH_BLOCK_LINES)
+
+    def line_count(self):
+        if self.screen is not None:
+            return self._history_count() + self.rows
+        return len(self.display_lines)
+
+    def _history_count(self):
+        # 全屏模式下 raw_text 以 '\n' 结尾（或为空），最后的空行不显示
+        return len(self.display_lines) - 1
+
+    def raw_index_to_display_pos(self, raw_idx):
+        """
+        将 raw_text 的索引映射为 (display_line_index, column_in_that_line)，O(log n)
+        """
+        # clamp
+        if raw_idx < 0:
+            raw_idx = 0
+        if raw_idx > len(self.raw_text):
+            raw_idx = len(self.raw_text)
+        line, col = self.wrap.raw_index_to_display_pos(raw_idx)
+        return line + self.display_lines.base(), col
+
+    def display_pos_to_raw_index(self, display_line_idx, col):
+        """
+        将显示行索引和列映射为 raw_text 的索引
+        """
+        if display_line_idx < 0:
+            display_line_idx = 0
+        if display_line_idx >= len(self.display_lines):
+            display_line_idx = len(self.display_lines) - 1
+        start, end = self.line_ranges[display_line_idx]
+        col = max(0, min(col, end - start))
+        return start + col
+
+    # ----------------- 插入 / 删除 / 光标移动 -----------------
+    def insert(self, text_to_insert):
+        if not text_to_insert:
+            return False
+        if self.screen is not None:
+            return self.write(text_to_insert)
+        # 插入（间隙缓冲区，光标处 O(1) 摊还）
+        self._text_changed(self.cursor_index)
+        self.raw_text.insert(self.cursor_index, text_to_insert)
+        self.wrap.insert(self.cursor_index, text_to_insert)
+        # 更新光标位置
+        self.cursor_index += len(text_to_insert)
+        self.inserts += 1
+        self.chars_inserted += len(text_to_insert)
+        # 超出滚动缓冲区上限时裁剪最旧的内容
+        self.trim_scrollback()
+        # 确保光标可见（折行索引已增量更新）
+        self.ensure_cursor_visible()
+        return True
+
+    def trim_scrollback(self):
+        """
+        raw_text 超过 max_chars / max_lines 时，从头部裁掉约 1/4 的内容
+        （批量裁剪，使裁剪成本摊还到每次插入），被裁掉的显示行写入磁盘溢出文件。
+        裁剪位置对齐到显示行边界，且不越过光标所在的行。
+        """
+        n = len(self.raw_text)
+        over_chars = self.max_chars is not None and n > self.max_chars
+        over_lines = self.max_lines is not None and self.wrap.line_count() > self.max_lines
+        if not (over_chars or over_lines):
+            return
+        cut = 0
+        if over_chars:
+            cut = n - self.max_chars * 3 // 4
+        if over_lines:
+            cut = max(cut, self.wrap.line_range(self.wrap.line_count() - self.max_lines * 3 // 4)[0])
+        # 对齐到段落开头；单个段落过长时对齐到折行边界（剩余部分折行不变）
+        nl = self.raw_text.find("\n", max(0, cut - 1))
+        if nl != -1:
+            cut = nl + 1
+        else:
+            para_start = self.raw_text.rfind("\n", 0, cut) + 1
+            cut = para_start + (cut - para_start) // self.cols * self.cols
+        # 不越过光标所在的显示行
+        cursor_line, _ = self.wrap.raw_index_to_display_pos(self.cursor_index)
+        cut = min(cut, self.wrap.line_range(cursor_line)[0])
+        if cut <= 0:
+            return
+
+        line, col = self.wrap.raw_index_to_display_pos(cut)
+        nlines = line + (1 if col > 0 else 0)
+        if self.spill is not None:
+            # 行号不变（从内存移到磁盘），只有磁盘环形文件覆盖掉的行会让后面的行号前移
+            dropped = self.spill.extend(self.wrap.line_text(i) for i in range(nlines))
+        else:
+            dropped = nlines
+        self.view_start = max(0, self.view_start - dropped)
+        self.lines_dropped += dropped
+        if self.search_index is not None:
+            self.search_index.drop_before(self.lines_dropped // self.SEARCH_BLOCK_LINES)
+
+        removed = self.raw_text[0:cut]
+        self.raw_text.delete(0, cut)
+        self.wrap.delete(0, removed)
+        self.cursor_index -= cut
+
+    def backspace(self):
+        if self.screen is not None:
+            s = self.screen
+            if s.col == 0:
+                return False
+            s.col -= 1
+            s.cells[s.row][s.col] = " "
+            s.attrs[s.row][s.col] = False
+            return True
+        if self.cursor_index <= 0:
+            return False
+        pos = self.cursor_index
+        self._text_changed(pos - 1)
+        removed = self.raw_text[pos - 1:pos]
+        self.raw_text.delete(pos - 1, pos)
+        self.wrap.delete(pos - 1, removed)
+        self.cursor_index -= 1
+        self.ensure_cursor_visible()
+        return True
+
+    def move_left(self):
+        if self.screen is not None:
+            return self._move_screen_cursor(0, -1)
+        if self.cursor_index > 0:
+            self.cursor_index -= 1
+            self.ensure_cursor_visible()
+            return True
+        return False
+
+    def move_right(self):
+        if self.screen is not None:
+            return self._move_screen_cursor(0, 1)
+        if self.cursor_index < len(self.raw_text):
+            self.cursor_index += 1
+            self.ensure_cursor_visible()
+            return True
+        return False
+
+    def move_up(self):
+        if self.screen is not None:
+            return self._move_screen_cursor(-1, 0)
+        line, col = self.raw_index_to_display_pos(self.cursor_index)
+        if line > 0:
+            prev_len = len(self.display_lines[line - 1])
+            new_col = min(col, prev_len)
+            self.cursor_index = self.display_pos_to_raw_index(line - 1, new_col)
+            self.ensure_cursor_visible()
+            return True
+        return False
+
+    def move_down(self):
+        if self.screen is not None:
+            return self._move_screen_cursor(1, 0)
+        line, col = self.raw_index_to_display_pos(self.cursor_index)
+        if line < len(self.display_lines) - 1:
+            next_len = len(self.display_lines[line + 1])
+            new_col = min(col, next_len)
+            self.cursor_index = self.display_pos_to_raw_index(line + 1, new_col)
+            self.ensure_cursor_visible()
+            return True
+        return False
+
+    def place_cursor(self, row, col):
+        """
+        把光标放到可视区第 row 行第 col 列（鼠标点击）
+        """
+        row = max(0, min(row, self.rows - 1))
+        target_display_idx = self.view_start + row
+        if self.screen is not None:
+            # 只能把光标放进全屏网格（历史行是只读的）
+            grid_row = target_display_idx - self._history_count()
+            if grid_row >= 0:
+                self.screen.row, self.screen.col = grid_row, col
+                self.screen.clamp()
+            return
+        if target_display_idx >= len(self.display_lines):
+            # 放到最后一行行尾
+            self.cursor_index = len(self.raw_text)
+        else:
+            self.cursor_index = self.display_pos_to_raw_index(target_display_idx, max(0, col))
+        self.ensure_cursor_visible()
+
+    # ----------------- 可视区 / 滚动 -----------------
+    def ensure_cursor_visible(self):
+        """
+        确保光标所在的 display_line 在可视区域内；如果不在则调整 self.view_start
+        """
+        if self.screen is not None:
+            # 全屏模式下光标总在网格中，回到底部
+            self.view_start = self._history_count()
+            return
+        line_idx, _ = self.raw_index_to_display_pos(self.cursor_index)
+        max_start = max(0, len(self.display_lines) - self.rows)
+        if line_idx < self.view_start:
+            self.view_start = max(0, min(line_idx, max_start))
+        elif line_idx >= self.view_start + self.rows:
+            self.view_start = max(0, min(line_idx - self.rows + 1, max_start))
+
+    def scroll_to(self, line):
+        self.view_start = max(0, min(line, max(0, self.line_count() - self.rows)))
+
+    def scroll(self, amount):
+        self.scroll_to(self.view_start + amount)
+
+    def visible_lines(self):
+        """
+        当前可视区的文本行（最多 rows 行）
+        """
+        if self.screen is None:
+            total = len(self.display_lines)
+            return [self.display_lines[i] for i in range(self.view_start, min(self.view_start + self.rows, total))]
+        history = self._history_count()
+        grid = self.screen.lines()
+        return [self.display_lines[i] if i < history else grid[i - history]
+                for i in range(self.view_start, min(self.view_start + self.rows, history + self.rows))]
+
+    def visible_attrs(self):
+        """
+        可视区每行的反显属性（每列一个 bool）；行模式或历史行为 None（搜索匹配处反显）
+        """
+        if self.screen is None:
+            if self.highlight is None:
+                return None
+            end = min(self.view_start + self.rows, len(self.display_lines))
+            return [self._highlight_attrs(i) for i in range(self.view_start, end)]
+        history = self._history_count()
+        return [self.screen.attrs[i - history] if i >= history else self._highlight_attrs(i)
+                for i in range(self.view_start, min(self.view_start + self.rows, history + self.rows))]
+
+    def cursor_cell(self):
+        """
+        返回光标在可视区中的 (row, col)；不在可视区时返回 None
+        """
+        if self.screen is not None:
+            if not self.screen.cursor_on:
+                return None
+            line_idx = self._history_count() + self.screen.row
+            if self.view_start <= line_idx < self.view_start + self.rows:
+                return line_idx - self.view_start, self.screen.col
+            return None
+        line_idx, col = self.raw_index_to_display_pos(self.cursor_index)
+        if self.view_start <= line_idx < self.view_start + self.rows:
+            return line_idx - self.view_start, col
+        return None
+
+    # ----------------- 设备输出（VT52 转义序列） -----------------
+    def write(self, text):
+        """
+        设备输出：整块交给 VT52 解析器，文本段批量写入，转义序列作用于屏幕
+        """
+        if not text:
+            return False
+        self.parser.feed(text)
+        self.ensure_cursor_visible()
+        return True
+
+    def put_text(self, text):
+        if self.screen is None:
+            self.insert(text)
+            return
+        for line in self.screen.put_text(text):
+            self._push_history(line)
+
+    def put_newline(self):
+        if self.screen is None:
+            self.insert("\n")
+            return
+        self.screen.col = 0
+        line = self.screen.linefeed()
+        if line is not None:
+            self._push_history(line)
+
+    def put_backspace(self):
+        if self.screen is None:
+            self.backspace()
+        elif self.screen.col > 0:
+            # VT52 的退格只左移光标，不擦除
+            self.screen.col -= 1
+
+    def put_tab(self):
+        if self.screen is None:
+            _, col = self.raw_index_to_display_pos(self.cursor_index)
+            self.insert(" " * (8 - col % 8))
+        else:
+            self.screen.col = min(self.cols - 1, (self.screen.col // 8 + 1) * 8)
+
+    def enter_screen(self):
+        """
+        进入全屏模式（已在全屏模式时直接返回网格）。
+        当前最后 rows 个显示行移入网格，光标位置随之保留；raw_text 只保留完整的历史行。
+        """
+        if self.screen is not None:
+            return self.screen
+        screen = ScreenGrid(self.cols, self.rows)
+        wrap = self.wrap
+        n = wrap.line_count()
+        first = max(0, n - self.rows)
+        for r, i in enumerate(range(first, n)):
+            text = wrap.line_text(i)
+            screen.cells[r][:len(text)] = text
+        line, col = wrap.raw_index_to_display_pos(self.cursor_index)
+        if line >= first:
+            screen.row, screen.col = line - first, col
+        else:
+            screen.row, screen.col = n - 1 - first, 0
+        screen.clamp()
+
+        start = wrap.line_range(first)[0]
+        self._text_changed(start)
+        if start < len(self.raw_text):
+            removed = self.raw_text[start:len(self.raw_text)]
+            self.raw_text.delete(start, len(self.raw_text))
+            wrap.delete(start, removed)
+        if start > 0 and self.raw_text[start - 1] != "\n":
+            # 第一行是折行的后半段：在折行边界断开，前面部分的折行不变
+            self.raw_text.insert(start, "\n")
+            wrap.insert(start, "\n")
+        self.cursor_index = len(self.raw_text)
+        self.screen = screen
+        self.ensure_cursor_visible()
+        return screen
+
+    def leave_screen(self):
+        """
+        退出全屏模式：网格内容（去掉末尾空行）追加到历史，回到行模式
+        """
+        if self.screen is None:
+            return False
+        lines = [line.rstrip() for line in self.screen.lines()]
+        while lines and not lines[-1]:
+            lines.pop()
+        self.screen = None
+        self.cursor_index = len(self.raw_text)
+        text = "\n".join(lines)
+        if text:
+            self.insert(text)
+        self.ensure_cursor_visible()
+        return True
+
+    def _push_history(self, line):
+        # 从网格顶部滚出的行追加到 raw_text 末尾
+        end = len(self.raw_text)
+        text = line.rstrip() + "\n"
+        self._text_changed(end)
+        self.raw_text.insert(end, text)
+        self.wrap.insert(end, text)
+        self.cursor_index = len(self.raw_text)
+        self.trim_scrollback()
+
+    def _move_screen_cursor(self, dr, dc):
+        s = self.screen
+        row, col = s.row, s.col
+        s.row += dr
+        s.col += dc
+        s.clamp()
+        return (s.row, s.col) != (row, col)
+
+    # ----------------- 搜索 -----------------
+    def _search_line_count(self):
+        # 可搜索的显示行：行模式为全部，全屏模式为历史行（网格本身就在屏幕上）
+        if self.screen is not None:
+            return self._history_count()
+        return len(self.display_lines)
+
+    def _text_changed(self, raw_pos):
+        """
+        raw_pos 处的文本即将改变：该显示行所在的块（及上一行所在的块，其文本接有本行开头）需要重新索引。
+        还没有索引任何块（尚未搜索过）时无需定位
+        """
+        idx = self.search_index
+        if idx is not None and idx.indexed > idx.min_id:
+            line, _ = self.raw_index_to_display_pos(raw_pos)
+            idx.invalidate((line - 1 + self.lines_dropped) // self.SEARCH_BLOCK_LINES)
+
+    def _search_block(self, block, n):
+        """
+        第 block 块（绝对块号）的搜索文本（小写），返回 (首行显示行号, 文本, 本块文本长度, 原始索引起点, 各行起始偏移)。
+        整块都在内存中时直接切取 raw_text（原始索引起点为切片起点，各行偏移为 None，按需由 WrapIndex 换算）；
+        含溢出行时逐行拼接：整行写满视为折行，与下一行直接相连，否则以 '\n' 分隔。
+        文本末尾接上其后最多 cols 个字符，使跨块的匹配也能找到（匹配起点在本块文本长度之内才属于本块）
+        """
+        B = self.SEARCH_BLOCK_LINES
+        dropped = self.lines_dropped
+        first = max(0, block * B - dropped)
+        last = min((block + 1) * B - dropped, n)
+        cols = self.cols
+        if first >= self.display_lines.base():
+            a = self.line_ranges[first][0]
+            b = self.line_ranges[last - 1][1]
+            end = b + cols if last < n else b
+            return first, self.raw_text[a:end].lower(), b - a, a, None
+        lines = self.display_lines
+        parts = []
+        offsets = []
+        pos = 0
+        for i in range(first, last):
+            line = lines[i]
+            offsets.append(pos)
+            parts.append(line)
+            pos += len(line)
+            if len(line) < cols:
+                parts.append("\n")
+                pos += 1
+        if last < n:
+            parts.append(lines[last])
+        return first, "".join(parts).lower(), pos, None, offsets
+
+    def _block_offset(self, block, line, col):
+        first, _, _, base, offsets = block
+        if offsets is None:
+            return self.line_ranges[line][0] - base + col
+        return offsets[line - first] + col
+
+    def _block_pos(self, block, pos):
+        first, _, _, base, offsets = block
+        if offsets is None:
+            line, col = self.raw_index_to_display_pos(base + pos)
+            if col >= self.cols:
+                # 折行处的索引属于下一行的开头
+                line, col = line + 1, col - self.cols
+            return line, col
+        k = bisect_right(offsets, pos) - 1
+        return first + k, pos - offsets[k]
+
+    def index_pending(self, max_blocks=None):
+        """
+        为尚未索引的完整块建立索引，本次最多 max_blocks 块（None 表示全部）；返回是否还有未索引的完整块。
+        由界面在空闲回调中分批调用，插入路径上不做索引
+        """
+        return self._index_lines(max_blocks)
+
+    def _index_lines(self, max_blocks=None):
+        """
+        为尚未索引的完整块建立索引（行模式下最后一行仍在增长，所在的块暂不索引）；返回是否还有剩余
+        """
+        idx = self.search_index
+        if idx is None:
+            return False
+        B = self.SEARCH_BLOCK_LINES
+        n = self._search_line_count()
+        end = n if self.screen is not None else n - 1
+        dropped = self.lines_dropped
+        block = max(idx.indexed, dropped // B)
+        stop = (end + dropped) // B     # 之前的块都已完整
+        last = stop if max_blocks is None else min(stop, block + max_blocks)
+        for b in range(block, last):
+            idx.add(b, self._search_block(b, n)[1])
+        if idx.needs_compact():
+            idx.compact()
+        return last < stop
+
+    def search(self, query, line, col, backward=False):
+        """
+        从显示行 line 的第 col 列开始查找 query（不区分大小写）：向前找起点不早于该位置的第一个匹配，
+        向后找起点早于该位置的最后一个匹配，到头后从另一端继续；返回匹配起点 (显示行, 列)，找不到返回 None。
+        有索引且 query 至少 3 个字符时只检查候选块（及尚未索引的末尾块）；
+        query 太短或其三字组几乎在每块中都出现（候选块不比顺序扫描少）时按块顺序扫描。
+        """
+        q = query.lower()
+        n = self._search_line_count()
+        if not q or n == 0:
+            return None
+        B = self.SEARCH_BLOCK_LINES
+        dropped = self.lines_dropped
+        line = max(0, min(line, n - 1))
+        first_block = dropped // B
+        end_block = (n - 1 + dropped) // B + 1
+        blocks = None
+        if self.search_index is not None:
+            self._index_lines()
+            ids = self.search_index.candidates(q)
+            if ids is not None:
+                blocks = ids + list(range(max(first_block, self.search_index.indexed), end_block))
+        if blocks is None:
+            blocks = range(first_block, end_block)
+
+        # 起始块先查 (line, col) 之后（向后时为之前）的部分，再按方向依次查其他块（绕回），最后查起始块的另一部分
+        start_block = (line + dropped) // B
+        k = bisect_left(blocks, start_block)
+        k2 = k + 1 if k < len(blocks) and blocks[k] == start_block else k
+        if backward:
+            order = [blocks[j] for j in range(k - 1, -1, -1)] + [blocks[j] for j in range(len(blocks) - 1, k2 - 1, -1)]
+        else:
+            order = [blocks[j] for j in range(k2, len(blocks))] + [blocks[j] for j in range(k)]
+        extra = len(q) - 1
+
+        block = self._search_block(start_block, n)
+        _, text, own, _, _ = block
+        at = min(self._block_offset(block, line, col), own)
+        pos = text.rfind(q, 0, at + extra) if backward else text.find(q, at)
+        if pos != -1 and pos < own:
+            return self._block_pos(block, pos)
+        for b in order:
+            other = self._search_block(b, n)
+            _, text2, own2, _, _ = other
+            pos = text2.rfind(q, 0, own2 + extra) if backward else text2.find(q)
+            if pos != -1 and pos < own2:
+                return self._block_pos(other, pos)
+        pos = text.rfind(q, at, own + extra) if backward else text.find(q, 0, at + extra)
+        if pos != -1 and pos < own:
+            return self._block_pos(block, pos)
+        return None
+
+    def set_highlight(self, line, col, length):
+        self.highlight = (line + self.lines_dropped, col, length)
+
+    def clear_highlight(self):
+        changed = self.highlight is not None
+        self.highlight = None
+        return changed
+
+    def _highlight_attrs(self, i):
+        if self.highlight is None:
+            return None
+        hl_line, hl_col, length = self.highlight
+        start = (hl_line - self.lines_dropped) * self.cols + hl_col
+        a = max(start, i * self.cols)
+        b = min(start + length, (i + 1) * self.cols)
+        if a >= b:
+            return None
+        attrs = [False] * self.cols
+        attrs[a - i * self.cols:b - i * self.cols] = [True] * (b - a)
+        return attrs
+
+    def reveal(self, line):
+        """
+        显示行 line 不在可视区时滚动到使其居中
+        """
+        if not self.view_start <= line < self.view_start + self.rows:
+            self.scroll_to(line - self.rows // 2)
+
+    def close(self):
+        if self.spill is not None:
+            self.spill.close()
+            self.spill = None
+
+
+def default_commands():
+    """
+    内置命令：##DEEPSEEK## 进入 DeepSeek 模式，##EXIT## 退出
+    """
+    registry = CommandRegistry()
+    registry.register("DEEPSEEK", _cmd_deepseek)
+    registry.register("EXIT", _cmd_exit)
+    return registry
+
+
+def _cmd_deepseek(proto, line):
+    proto.deepseek_mode = True
+    proto.notify("Enter DeepSeek mode...")
+
+
+def _cmd_exit(proto, line):
+    proto.deepseek_mode = False
+    proto.notify("Exit DeepSeek mode...")
+
+
+class SerialProtocol:
+    """
+    串口接收协议处理（在读取线程中运行，不直接访问文本模型）：
+    增量解码、XON/XOFF 流控字符、按行缓冲（行缓冲中去掉 '\r'，显示输出中保留给 VT52 解析器），
+    并用流式匹配器识别 ##COMMAND## 命令。
+    命令在所在行结束时执行（处理函数来自 CommandRegistry）。
+    对外通过回调输出：
+    - display(text)：需要显示到屏幕的文本
+    - send(text)：需要回送到串口的文本
+    - query(text)：DeepSeek 模式下一行完整的提问
+    - pause() / resume()：收到 XOFF / XON
+    """
+
+    def __init__(self, display, send, query, pause=None, resume=None, xonxoff=False, line_max=4096, commands=None):
+        self.display = display
+        self.send = send
+        self.query = query
+        self.pause = pause
+        self.resume = resume
+        self.xonxoff = xonxoff
+        self.line_max = line_max
+        self.commands = commands if commands is not None else default_commands()
+        self.matcher = self.commands.new_matcher()
+        self._commands_version = self.commands.version
+        self.pending_command = None     # 当前行中第一个匹配到的命令
+        self.buffer = ""
+        self.deepseek_mode = False  # 是否进入 DeepSeek 模式
+        # 增量解码：多字节字符被拆在两次读取之间也能正确拼接
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+
+    def notify(self, message):
+        """
+        在屏幕上显示并回送一行提示
+        """
+        self.display(message + "\n")
+        self.send(message + "\r\n")
+
+    def feed(self, raw):
+        """
+        处理一次读取到的字节；块内可能包含多行，逐行处理
+        """
+        # '\r' 保留给 VT52 解析器（全屏模式下回到行首），行缓冲与命令匹配中去掉
+        data = self.decoder.decode(raw)
+        if self.xonxoff and (XON in data or XOFF in data):
+            # 软件流控：以最后出现的控制字符为准
+            if data.rfind(XOFF) > data.rfind(XON):
+                if self.pause:
+                    self.pause()
+            elif self.resume:
+                self.resume()
+            data = data.replace(XON, "").replace(XOFF, "")
+        if not data:
+            return
+        if self._commands_version != self.commands.version:
+            # 注册了新命令
+            self.matcher = self.commands.new_matcher()
+            self._commands_version = self.commands.version
+        start = 0
+        while start < len(data):
+            nl = data.find("\n", start)
+            end = len(data) if nl == -1 else nl + 1
+            segment = data[start:end]
+            self.display(segment)
+            if "\r" in segment:
+                segment = segment.replace("\r", "")
+            self.buffer += segment
+            if len(self.buffer) > self.line_max:
+                # 设备持续输出而不换行时，只保留末尾部分
+                self.buffer = self.buffer[-self.line_max:]
+            # 每个字符只经过匹配器一次，命令被拆在两次读取中也能识别
+            found = self.matcher.feed(segment)
+            if found and self.pending_command is None:
+                self.pending_command = found[0]
+            if nl != -1:
+                self._end_line()
+            start = end
+
+    def _end_line(self):
+        line = self.buffer
+        self.buffer = ""
+        self.matcher.reset()
+        command, self.pending_command = self.pending_command, None
+        if command is not None:
+            handler = self.commands.handler_for(command)
+            if handler:
+                handler(self, line)
+            return
+
+        # 如果在 DeepSeek 模式，直接发送数据给 DeepSeek API
+        if self.deepseek_mode and line:
+            self.display("Message sent, please wait...\n")
+            self.send("Message sent, please wait...\r\n")
+            self.query(line)
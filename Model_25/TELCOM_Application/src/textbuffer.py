@@ -0,0 +1,274 @@
+# textbuffer.py
+import os, mmap, struct
+from array import array, typecodes
+
+# array 的 Unicode 类型码：3.13+ 使用 'w'，旧版本使用 'u'
+_TYPECODE = "w" if "w" in typecodes else "u"
+
+# 缓冲区初始容量与最小扩容量（字符数）
+MIN_GAP = 64
+
+
+class GapBuffer:
+    """
+    间隙缓冲区（gap buffer）文本模型。
+    在光标处插入/删除为 O(1) 摊还；光标移动只搬移两次编辑之间的距离。
+    对外表现得像一个只读的 str：支持 len()、下标/切片、find()/rfind()、str()，
+    因此原来按 raw_text 字符串编写的折行、光标映射、绘制代码无需修改。
+    内存：array('u'/'w') 每个字符占 4 字节，容量按翻倍扩张且删除后不收缩，峰值约为 8 字节/字符
+    （不设上限时灌入 10 MB 文本约占 80 MB）。缓冲区本身不限制大小，由 TerminalCore 的 max_chars
+    （model100.py 中的 SCROLLBACK_MAX_CHARS，默认 512K 字符，约 4 MB）把内存占用限制在树莓派可接受的范围内。
+    """
+
+    def __init__(self, text=""):
+        n = len(text)
+        cap = max(MIN_GAP, n * 2)
+        self._buf = array(_TYPECODE, text)
+        self._buf.extend(array(_TYPECODE, " " * (cap - n)))
+        # 间隙为 [_gap_start, _gap_end)
+        self._gap_start = n
+        self._gap_end = cap
+
+    # ---------------- 基本属性 ----------------
+    def __len__(self):
+        return len(self._buf) - (self._gap_end - self._gap_start)
+
+    def __str__(self):
+        return self._buf[:self._gap_start].tounicode() + self._buf[self._gap_end:].tounicode()
+
+    def __repr__(self):
+        return f"GapBuffer({str(self)!r})"
+
+    def __eq__(self, other):
+        if isinstance(other, GapBuffer):
+            other = str(other)
+        if isinstance(other, str):
+            return len(self) == len(other) and str(self) == other
+        return NotImplemented
+
+    def __getitem__(self, key):
+        n = len(self)
+        if isinstance(key, slice):
+            start, stop, step = key.indices(n)
+            if step != 1:
+                return str(self)[key]
+            return self._slice(start, stop)
+        if key < 0:
+            key += n
+        if not 0 <= key < n:
+            raise IndexError("GapBuffer index out of range")
+        if key >= self._gap_start:
+            key += self._gap_end - self._gap_start
+        return self._buf[key]
+
+    def _slice(self, start, stop):
+        """
+        返回 [start, stop) 的字符串，跳过间隙
+        """
+        if stop <= start:
+            return ""
+        gs, ge = self._gap_start, self._gap_end
+        gap = ge - gs
+        if stop <= gs:
+            return self._buf[start:stop].tounicode()
+        if start >= gs:
+            return self._buf[start + gap:stop + gap].tounicode()
+        return self._buf[start:gs].tounicode() + self._buf[ge:stop + gap].tounicode()
+
+    # ---------------- 查找 ----------------
+    def find(self, sub, start=0, end=None):
+        """
+        与 str.find 语义一致（start/end 为逻辑索引）
+        """
+        n = len(self)
+        if end is None or end > n:
+            end = n
+        if start < 0:
+            start = max(0, start + n)
+        if start > end:
+            return -1
+        gs = self._gap_start
+        if len(sub) == 1:
+            # 单字符：在间隙两侧分别用 array.index 查找，不复制文本
+            gap = self._gap_end - gs
+            if start < gs:
+                try:
+                    return self._buf.index(sub, start, min(end, gs))
+                except ValueError:
+                    pass
+            lo = max(start, gs)
+            if lo < end:
+                try:
+                    return self._buf.index(sub, lo + gap, end + gap) - gap
+                except ValueError:
+                    pass
+            return -1
+        # 多字符：取出 [start, end) 再查找（跨越间隙时会拼接一次）
+        r = self._slice(start, end).find(sub)
+        return -1 if r < 0 else r + start
+
+    def rfind(self, sub, start=0, end=None):
+        n = len(self)
+        if end is None or end > n:
+            end = n
+        if start < 0:
+            start = max(0, start + n)
+        r = self._slice(start, end).rfind(sub)
+        return -1 if r < 0 else r + start
+
+    # ---------------- 编辑 ----------------
+    def _move_gap(self, pos):
+        """
+        把间隙移到逻辑位置 pos（只搬移 |pos - gap_start| 个字符）
+        """
+        gs, ge = self._gap_start, self._gap_end
+        if pos == gs:
+            return
+        buf = self._buf
+        if pos < gs:
+            # 把 [pos, gs) 搬到间隙末尾
+            d = gs - pos
+            buf[ge - d:ge] = buf[pos:gs]
+            self._gap_start, self._gap_end = pos, ge - d
+        else:
+            # 把间隙之后的 d 个字符搬到间隙开头
+            d = pos - gs
+            buf[gs:gs + d] = buf[ge:ge + d]
+            self._gap_start, self._gap_end = gs + d, ge + d
+
+    def _ensure_gap(self, need):
+        gap = self._gap_end - self._gap_start
+        if gap >= need:
+            return
+        # 容量翻倍扩张，保证插入摊还 O(1)
+        grow = max(need - gap, len(self._buf), MIN_GAP)
+        self._buf[self._gap_end:self._gap_end] = array(_TYPECODE, " " * grow)
+        self._gap_end += grow
+
+    def insert(self, pos, text):
+        """
+        在逻辑位置 pos 插入 text
+        """
+        k = len(text)
+        if not k:
+            return
+        pos = max(0, min(pos, len(self)))
+        self._move_gap(pos)
+        self._ensure_gap(k)
+        gs = self._gap_start
+        if k == 1:
+            self._buf[gs] = text
+        else:
+            self._buf[gs:gs + k] = array(_TYPECODE, text)
+        self._gap_start = gs + k
+
+    def delete(self, start, end):
+        """
+        删除逻辑区间 [start, end)
+        """
+        n = len(self)
+        start = max(0, min(start, n))
+        end = max(start, min(end, n))
+        if end == start:
+            return
+        self._move_gap(start)
+        self._gap_end += end - start
+
+    def clear(self):
+        self.__init__()
+
+
+class SpillRing:
+    """
+    溢出到磁盘的滚动缓冲区：固定容量的环形记录文件，通过 mmap 读写。
+    每条记录保存一个已折行的显示行（2 字节长度 + 最多 cols 个 UTF-8 字符），
+    写满后覆盖最旧的记录。页面由操作系统按需换入换出，不常驻内存。
+    """
+
+    _LEN = struct.Struct("<H")
+
+    def __init__(self, path, cols, capacity):
+        self.path = path
+        self.cols = cols
+        self.capacity = capacity
+        self.record = self._LEN.size + cols * 4
+        self._file = open(path, "w+b")
+        self._file.truncate(self.record * capacity)   # 稀疏文件，未写入的部分不占磁盘
+        self._map = mmap.mmap(self._file.fileno(), self.record * capacity)
+        self.head = 0       # 最旧记录所在的槽位
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError("spill index out of range")
+        off = ((self.head + i) % self.capacity) * self.record
+        (n,) = self._LEN.unpack_from(self._map, off)
+        start = off + self._LEN.size
+        return self._map[start:start + n].decode("utf-8", errors="replace")
+
+    def append(self, line):
+        """
+        追加一行；返回因写满而丢弃的最旧行数（0 或 1）
+        """
+        data = line[:self.cols].encode("utf-8")
+        if self.count < self.capacity:
+            slot = (self.head + self.count) % self.capacity
+            self.count += 1
+            dropped = 0
+        else:
+            slot = self.head
+            self.head = (self.head + 1) % self.capacity
+            dropped = 1
+        off = slot * self.record
+        self._LEN.pack_into(self._map, off, len(data))
+        self._map[off + self._LEN.size:off + self._LEN.size + len(data)] = data
+        return dropped
+
+    def extend(self, lines):
+        dropped = 0
+        for line in lines:
+            dropped += self.append(line)
+        return dropped
+
+    def close(self, remove=True):
+        self._map.close()
+        self._file.close()
+        if remove:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+class ScrollbackView:
+    """
+    把磁盘上的溢出行与内存中的显示行拼成一个连续的只读序列。
+    spilled_item 不为 None 时，溢出部分统一返回该值（例如 line_ranges 用 (0, 0)，
+    表示这些行不在 raw_text 中，光标落在其上时会被放到内存文本开头）。
+    """
+
+    def __init__(self, spilled, live, spilled_item=None):
+        self.spilled = spilled
+        self.live = live
+        self.spilled_item = spilled_item
+
+    def base(self):
+        return len(self.spilled) if self.spilled is not None else 0
+
+    def __len__(self):
+        return self.base() + len(self.live)
+
+    def __getitem__(self, i):
+        base = self.base()
+        if i < 0:
+            i += base + len(self.live)
+        if i < base:
+            if i < 0:
+                raise IndexError("display line index out of range")
+            return self.spilled[i] if self.spilled_item is None else self.spilled_item
+        return self.live[i - base]
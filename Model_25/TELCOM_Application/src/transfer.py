@@ -0,0 +1,406 @@
+# transfer.py
+# 文件传输：XMODEM（校验和 / CRC-16）与 TELCOM 纯文本上传/下载，在工作线程中运行
+import os, threading, time
+
+SOH, STX, EOT, ACK, NAK, CAN, SUB = 0x01, 0x02, 0x04, 0x06, 0x15, 0x18, 0x1A
+CRC_REQUEST = ord("C")
+XON, XOFF = 0x11, 0x13
+
+
+def _make_crc_table():
+    table = []
+    for i in range(256):
+        crc = i << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+        table.append(crc & 0xFFFF)
+    return table
+
+
+_CRC_TABLE = _make_crc_table()
+
+
+def crc16_xmodem(data, crc=0):
+    """
+    CRC-16/XMODEM（多项式 0x1021，初值 0），查表计算
+    """
+    table = _CRC_TABLE
+    for b in data:
+        crc = ((crc << 8) & 0xFFFF) ^ table[((crc >> 8) ^ b) & 0xFF]
+    return crc
+
+
+class TransferCancelled(Exception):
+    pass
+
+
+class ByteChannel:
+    """
+    读取线程 -> 传输工作线程的字节通道。
+    传输期间读取线程把收到的数据交给 feed()，工作线程用 read() 带超时地取出。
+    """
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._cond = threading.Condition()
+
+    def feed(self, data):
+        with self._cond:
+            self._buf += data
+            self._cond.notify()
+
+    def read(self, n, timeout):
+        """
+        最多等待 timeout 秒读出 n 个字节；超时返回已收到的部分
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while len(self._buf) < n:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            data = bytes(self._buf[:n])
+            del self._buf[:n]
+            return data
+
+    def read_byte(self, timeout):
+        data = self.read(1, timeout)
+        return data[0] if data else None
+
+    def purge(self):
+        with self._cond:
+            self._buf.clear()
+
+
+class Transfer:
+    """
+    一次文件传输（kind 见 KINDS），在独立的工作线程中运行，不阻塞界面和读取线程。
+    - write(bytes)：直接写串口（传输期间独占串口）；
+    - 传输期间读取线程调用 feed() 把收到的数据交给传输，而不是交给 SerialProtocol；
+    - on_progress(done, total) / on_done(ok, message) 在工作线程中调用，由调用方转到主线程；
+    - 纯文本上传按波特率节奏发送，并遵守 XON/XOFF。
+    """
+
+    KINDS = ("xmodem-send", "xmodem-recv", "text-send", "text-recv")
+
+    def __init__(self, kind, path, write, on_progress, on_done, baudrate, frame_bits=10,
+                 newline=b"\r", line_delay=0.0, start_delay=0.0, timeout=10.0, retries=10):
+        if kind not in self.KINDS:
+            raise ValueError(f"unknown transfer kind: {kind}")
+        self.kind = kind
+        self.path = path
+        self.write = write
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.bytes_per_sec = baudrate / frame_bits
+        self.newline = newline
+        self.line_delay = line_delay
+        self.start_delay = start_delay
+        self.timeout = timeout
+        self.retries = retries
+
+        self.channel = ByteChannel()
+        self.active = False
+        self.cancelled = False
+        self._xoff = threading.Event()
+        self.thread = None
+
+        # 统计：有效数据字节 / 线路上的字节 / 重传次数 / 用时
+        self.payload_bytes = 0
+        self.wire_bytes = 0
+        self.retransmits = 0
+        self.elapsed = 0.0
+
+    # ---------------- 控制 ----------------
+    def start(self):
+        self.active = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def cancel(self):
+        self.cancelled = True
+
+    def feed(self, data):
+        """
+        读取线程调用：收到的数据交给传输
+        """
+        if self.kind == "text-send":
+            # 纯文本上传只关心流控字符
+            if XOFF in data or XON in data:
+                if data.rfind(XOFF) > data.rfind(XON):
+                    self._xoff.set()
+                else:
+                    self._xoff.clear()
+            return
+        self.channel.feed(data)
+
+    def _run(self):
+        t0 = time.perf_counter()
+        ok, message = False, ""
+        try:
+            if self.kind == "xmodem-send":
+                ok, message = self._xmodem_send()
+            elif self.kind == "xmodem-recv":
+                ok, message = self._xmodem_recv()
+            elif self.kind == "text-send":
+                ok, message = self._text_send()
+            else:
+                ok, message = self._text_recv()
+        except TransferCancelled:
+            message = "cancelled"
+            if self.kind.startswith("xmodem"):
+                self._send(bytes([CAN, CAN, CAN]))
+        except OSError as e:
+            message = str(e)
+        finally:
+            self.elapsed = time.perf_counter() - t0
+            self.active = False
+            self.on_done(ok, message)
+
+    def _send(self, data):
+        self.write(data)
+        self.wire_bytes += len(data)
+
+    def _check_cancel(self):
+        if self.cancelled:
+            raise TransferCancelled()
+
+    def rate(self):
+        """
+        有效数据字节/秒
+        """
+        return self.payload_bytes / self.elapsed if self.elapsed > 0 else 0.0
+
+    # ---------------- XMODEM 发送 ----------------
+    def _xmodem_send(self):
+        with open(self.path, "rb") as f:
+            data = f.read()
+        total = len(data)
+
+        # 等待接收方的 'C'（CRC 模式）或 NAK（校验和模式）
+        use_crc = None
+        deadline = time.monotonic() + 60
+        while use_crc is None:
+            self._check_cancel()
+            if time.monotonic() > deadline:
+                return False, "receiver not ready"
+            b = self.channel.read_byte(1.0)
+            if b == CRC_REQUEST:
+                use_crc = True
+            elif b == NAK:
+                use_crc = False
+            elif b == CAN:
+                return False, "cancelled by receiver"
+
+        blk = 1
+        for offset in range(0, max(total, 1), 128):
+            chunk = data[offset:offset + 128]
+            if not chunk:
+                break
+            chunk = chunk.ljust(128, bytes([SUB]))
+            if use_crc:
+                crc = crc16_xmodem(chunk)
+                trailer = bytes([crc >> 8, crc & 0xFF])
+            else:
+                trailer = bytes([sum(chunk) & 0xFF])
+            packet = bytes([SOH, blk & 0xFF, 0xFF - (blk & 0xFF)]) + chunk + trailer
+            for attempt in range(self.retries):
+                self._check_cancel()
+                if attempt:
+                    self.retransmits += 1
+                self.channel.purge()
+                self._send(packet)
+                reply = self.channel.read_byte(self.timeout)
+                if reply == ACK:
+                    break
+                if reply == CAN:
+                    return False, "cancelled by receiver"
+            else:
+                self._send(bytes([CAN, CAN, CAN]))
+                return False, f"block {blk}: too many retries"
+            self.payload_bytes = min(total, offset + 128)
+            self.on_progress(self.payload_bytes, total)
+            blk += 1
+
+        for _ in range(self.retries):
+            self._send(bytes([EOT]))
+            if self.channel.read_byte(self.timeout) == ACK:
+                return True, f"{total} bytes sent"
+        return False, "no ACK for EOT"
+
+    # ---------------- XMODEM 接收 ----------------
+    def _xmodem_recv(self):
+        received = 0
+        expected = 1
+        last = None         # 最后一块先缓存，结束时去掉 SUB 填充
+        use_crc = True
+        start_byte = bytes([CRC_REQUEST])
+        with open(self.path, "wb") as out:
+            # 发起：先请求 CRC 模式，3 次无响应后退回校验和模式
+            header = None
+            for attempt in range(self.retries):
+                self._check_cancel()
+                if attempt == 3:
+                    use_crc = False
+                    start_byte = bytes([NAK])
+                self._send(start_byte)
+                header = self.channel.read_byte(3.0)
+                if header is not None:
+                    break
+            if header is None:
+                return False, "sender not responding"
+
+            errors = 0
+            while True:
+                self._check_cancel()
+                if header == EOT:
+                    if last is not None:
+                        last = last.rstrip(bytes([SUB]))
+                        out.write(last)
+                        received += len(last)
+                    self._send(bytes([ACK]))
+                    self.payload_bytes = received
+                    return True, f"{received} bytes received"
+                if header == CAN:
+                    return False, "cancelled by sender"
+                ok = False
+                if header in (SOH, STX):
+                    size = 128 if header == SOH else 1024
+                    rest = self.channel.read(2 + size + (2 if use_crc else 1), 1.0)
+                    if len(rest) == 2 + size + (2 if use_crc else 1):
+                        blk, inv = rest[0], rest[1]
+                        payload = rest[2:2 + size]
+                        trailer = rest[2 + size:]
+                        if use_crc:
+                            good = crc16_xmodem(payload) == (trailer[0] << 8 | trailer[1])
+                        else:
+                            good = sum(payload) & 0xFF == trailer[0]
+                        if good and blk == 0xFF - inv:
+                            ok = True
+                            if blk == expected & 0xFF:
+                                if last is not None:
+                                    out.write(last)
+                                    received += len(last)
+                                last = payload
+                                expected += 1
+                                self.on_progress(received + len(payload), 0)
+                            elif blk != (expected - 1) & 0xFF:
+                                self._send(bytes([CAN, CAN, CAN]))
+                                return False, "block sequence error"
+                            # 重复块（ACK 丢失）：只回 ACK
+                if ok:
+                    errors = 0
+                    self._send(bytes([ACK]))
+                else:
+                    errors += 1
+                    self.retransmits += 1
+                    if errors >= self.retries:
+                        self._send(bytes([CAN, CAN, CAN]))
+                        return False, "too many errors"
+                    # 等待线路安静后请求重传
+                    while self.channel.read(1, 0.2):
+                        pass
+                    self._send(bytes([NAK]))
+                header = self.channel.read_byte(self.timeout)
+                if header is None:
+                    errors += 1
+                    if errors >= self.retries:
+                        return False, "timeout"
+                    self._send(bytes([NAK]))
+                    header = self.channel.read_byte(self.timeout)
+                    if header is None:
+                        return False, "timeout"
+
+    # ---------------- TELCOM 纯文本 ----------------
+    def _text_send(self):
+        """
+        Model 100 TELCOM 的 DOWN（下载）：按波特率节奏发送纯文本，'\\n' 换为 newline，遇 XOFF 暂停
+        """
+        with open(self.path, "rb") as f:
+            data = f.read().replace(b"\r\n", b"\n").replace(b"\n", self.newline)
+        total = len(data)
+        chunk = max(1, int(self.bytes_per_sec * 0.02))     # 每 20ms 一块
+        # 留出时间在 Model 100 上按下 DOWN 并输入文件名
+        deadline = time.monotonic() + self.start_delay
+        while time.monotonic() < deadline:
+            self._check_cancel()
+            time.sleep(0.1)
+        t0 = time.perf_counter()
+        sent = 0
+        while sent < total:
+            self._check_cancel()
+            if self._xoff.is_set():
+                time.sleep(0.01)
+                t0 = time.perf_counter() - sent / self.bytes_per_sec
+                continue
+            piece = data[sent:sent + chunk]
+            if self.line_delay and self.newline in piece:
+                # 每行之后留出时间让 Model 100 处理（行尾之前的部分先发出）
+                piece = piece[:piece.index(self.newline) + len(self.newline)]
+            self._send(piece)
+            sent += len(piece)
+            self.payload_bytes = sent
+            self.on_progress(sent, total)
+            if self.line_delay and piece.endswith(self.newline):
+                time.sleep(self.line_delay)
+                t0 += self.line_delay
+            # 按线路速率节奏：不超前于 bytes_per_sec
+            ahead = t0 + sent / self.bytes_per_sec - time.perf_counter()
+            if ahead > 0:
+                time.sleep(ahead)
+        return True, f"{total} bytes sent"
+
+    def _text_recv(self):
+        """
+        Model 100 TELCOM 的 UP（上传）：接收纯文本直到 ^Z，或空闲 timeout 秒后结束
+        """
+        received = 0
+        last_data = time.monotonic()
+        pending_cr = False      # 上一块末尾的 '\r' 暂不写出：CRLF 可能被拆在两次读取之间
+        with open(self.path, "wb") as out:
+            while True:
+                self._check_cancel()
+                data = self.channel.read(4096, 0.2)
+                if not data:
+                    # 开始前最多等 60 秒，开始后空闲 timeout 秒视为结束
+                    idle = time.monotonic() - last_data
+                    started = received or pending_cr
+                    if idle > (self.timeout if started else 60):
+                        if not started:
+                            return False, "nothing received"
+                        break
+                    continue
+                last_data = time.monotonic()
+                end = data.find(bytes([SUB]))
+                if end != -1:
+                    data = data[:end]
+                if pending_cr:
+                    data = b"\r" + data
+                    pending_cr = False
+                if end == -1 and data.endswith(b"\r"):
+                    data = data[:-1]
+                    pending_cr = True
+                data = data.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+                out.write(data)
+                received += len(data)
+                self.payload_bytes = received
+                self.on_progress(received, 0)
+                if end != -1:
+                    break
+            if pending_cr:
+                # 空闲结束时最后一个字符是 '\r'
+                out.write(b"\n")
+                received += 1
+        return True, f"{received} bytes received"
+
+
+def transfer_path(directory, name):
+    """
+    传输目录中的文件路径；只取文件名部分，防止访问目录之外的文件
+    """
+    name = os.path.basename(name.strip())
+    if not name:
+        return None
+    return os.path.join(directory, name)
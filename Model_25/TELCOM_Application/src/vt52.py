@@ -0,0 +1,255 @@
+# vt52.py
+# Model 100（VT52 风格）转义序列解析与屏幕网格
+import re
+
+ESC = "\x1b"
+
+# 一次匹配一个记号：连续的可打印字符 | ESC Y 行 列 | ESC x | 单个控制字符
+_TOKEN = re.compile(r"([^\x00-\x1f\x7f]+)|\x1bY(.)(.)|\x1b([^Y])|([\x00-\x1f\x7f])", re.S)
+# 块末尾不完整的转义序列，留到下一块
+_PARTIAL = re.compile(r"\x1b(?:Y.?)?\Z", re.S)
+
+
+class ScreenGrid:
+    """
+    cols x rows 的字符网格（全屏程序使用），带反显属性。
+    文本按整段写入（切片赋值），到行尾自动换行，到底部时向上滚动并返回滚出的行。
+    """
+
+    def __init__(self, cols, rows):
+        self.cols = cols
+        self.rows = rows
+        self.cells = [[" "] * cols for _ in range(rows)]
+        self.attrs = [[False] * cols for _ in range(rows)]
+        self.row = 0
+        self.col = 0
+        self.reverse = False
+        self.cursor_on = True
+
+    def lines(self):
+        return ["".join(r) for r in self.cells]
+
+    def clamp(self):
+        self.row = max(0, min(self.row, self.rows - 1))
+        self.col = max(0, min(self.col, self.cols - 1))
+
+    def put_text(self, text):
+        """
+        在光标处覆盖写入；返回因滚屏移出顶部的行列表
+        """
+        scrolled = []
+        pos = 0
+        n = len(text)
+        while pos < n:
+            if self.col >= self.cols:
+                self.col = 0
+                line = self.linefeed()
+                if line is not None:
+                    scrolled.append(line)
+            k = min(self.cols - self.col, n - pos)
+            self.cells[self.row][self.col:self.col + k] = text[pos:pos + k]
+            self.attrs[self.row][self.col:self.col + k] = [self.reverse] * k
+            self.col += k
+            pos += k
+        return scrolled
+
+    def linefeed(self):
+        """
+        换到下一行；在最后一行时向上滚动，返回滚出的行
+        """
+        if self.row < self.rows - 1:
+            self.row += 1
+            return None
+        top = "".join(self.cells.pop(0))
+        self.attrs.pop(0)
+        self.cells.append([" "] * self.cols)
+        self.attrs.append([False] * self.cols)
+        return top
+
+    def erase_eol(self):
+        c = min(self.col, self.cols)
+        k = self.cols - c
+        self.cells[self.row][c:] = [" "] * k
+        self.attrs[self.row][c:] = [False] * k
+
+    def erase_line(self):
+        self.cells[self.row] = [" "] * self.cols
+        self.attrs[self.row] = [False] * self.cols
+
+    def erase_eos(self):
+        self.erase_eol()
+        for r in range(self.row + 1, self.rows):
+            self.cells[r] = [" "] * self.cols
+            self.attrs[r] = [False] * self.cols
+
+    def clear(self):
+        self.cells = [[" "] * self.cols for _ in range(self.rows)]
+        self.attrs = [[False] * self.cols for _ in range(self.rows)]
+        self.row = self.col = 0
+
+    def insert_line(self):
+        self.cells.insert(self.row, [" "] * self.cols)
+        self.attrs.insert(self.row, [False] * self.cols)
+        self.cells.pop()
+        self.attrs.pop()
+
+    def delete_line(self):
+        self.cells.pop(self.row)
+        self.attrs.pop(self.row)
+        self.cells.append([" "] * self.cols)
+        self.attrs.append([False] * self.cols)
+
+
+class VT52Parser:
+    """
+    表驱动的 VT52 / Model 100 转义序列解析器。
+    每次处理整块文本：用正则把块切成“可打印文本段 / 转义序列 / 控制字符”记号，
+    文本段整段写入，转义与控制字符通过预先生成的分派表调用对应操作，
+    不在 Python 中逐字符分支。块末尾不完整的转义序列保留到下一块。
+    term 为 TerminalCore，提供 put_text / put_newline / put_backspace / put_tab / enter_screen 和 screen 属性。
+    """
+
+    def __init__(self, term):
+        self.term = term
+        self.pending = ""
+        # 分派表：转义字符 / 控制字符 -> 绑定方法
+        self.esc_table = {ch: getattr(self, name) for ch, name in ESC_ACTIONS.items()}
+        self.ctrl_table = {ch: getattr(self, name) for ch, name in CTRL_ACTIONS.items()}
+        self.bells = 0
+
+    def feed(self, text):
+        if self.pending:
+            text = self.pending + text
+            self.pending = ""
+        m = _PARTIAL.search(text)
+        if m:
+            self.pending = text[m.start():]
+            text = text[:m.start()]
+        esc_table, ctrl_table = self.esc_table, self.ctrl_table
+        for run, y_row, y_col, esc, ctrl in _TOKEN.findall(text):
+            if run:
+                self.term.put_text(run)
+            elif y_row:
+                self.goto(ord(y_row) - 32, ord(y_col) - 32)
+            elif esc:
+                action = esc_table.get(esc)
+                if action:
+                    action()
+            elif ctrl:
+                action = ctrl_table.get(ctrl)
+                if action:
+                    action()
+
+    # ---------------- 屏幕操作 ----------------
+    def _screen(self):
+        return self.term.enter_screen()
+
+    def goto(self, row, col):
+        s = self._screen()
+        s.row, s.col = row, col
+        s.clamp()
+
+    def _move(self, dr, dc):
+        s = self._screen()
+        s.row += dr
+        s.col += dc
+        s.clamp()
+
+    def up(self):
+        self._move(-1, 0)
+
+    def down(self):
+        self._move(1, 0)
+
+    def right(self):
+        self._move(0, 1)
+
+    def left(self):
+        self._move(0, -1)
+
+    def home(self):
+        self.goto(0, 0)
+
+    def clear(self):
+        self._screen().clear()
+
+    def erase_eos(self):
+        self._screen().erase_eos()
+
+    def erase_eol(self):
+        self._screen().erase_eol()
+
+    def erase_line(self):
+        self._screen().erase_line()
+
+    def insert_line(self):
+        self._screen().insert_line()
+
+    def delete_line(self):
+        self._screen().delete_line()
+
+    # 属性只在全屏模式下有意义，行模式中忽略
+    def reverse_on(self):
+        if self.term.screen is not None:
+            self.term.screen.reverse = True
+
+    def reverse_off(self):
+        if self.term.screen is not None:
+            self.term.screen.reverse = False
+
+    def cursor_on(self):
+        if self.term.screen is not None:
+            self.term.screen.cursor_on = True
+
+    def cursor_off(self):
+        if self.term.screen is not None:
+            self.term.screen.cursor_on = False
+
+    # ---------------- 控制字符 ----------------
+    def newline(self):
+        self.term.put_newline()
+
+    def carriage_return(self):
+        # 全屏模式下回到行首（覆盖式重绘）；行模式中换行由 '\n' 处理，忽略
+        if self.term.screen is not None:
+            self.term.screen.col = 0
+
+    def backspace(self):
+        self.term.put_backspace()
+
+    def tab(self):
+        self.term.put_tab()
+
+    def bell(self):
+        self.bells += 1
+
+
+# Model 100 / VT52 转义序列（ESC 之后的字符）
+ESC_ACTIONS = {
+    "A": "up",
+    "B": "down",
+    "C": "right",
+    "D": "left",
+    "E": "clear",
+    "j": "clear",
+    "H": "home",
+    "J": "erase_eos",
+    "K": "erase_eol",
+    "l": "erase_line",
+    "L": "insert_line",
+    "M": "delete_line",
+    "p": "reverse_on",
+    "q": "reverse_off",
+    "P": "cursor_on",
+    "Q": "cursor_off",
+}
+
+# 控制字符（'\n' 按回车换行处理，'\r' 只回到行首）
+CTRL_ACTIONS = {
+    "\n": "newline",
+    "\r": "carriage_return",
+    "\b": "backspace",
+    "\t": "tab",
+    "\x07": "bell",
+    "\x0c": "clear",
+}
@@ -0,0 +1,260 @@
+# wrapindex.py
+
+
+class Fenwick:
+    """
+    树状数组（Fenwick tree），元素下标从 0 开始。
+    支持单点增量、前缀和、按前缀和二分查找，以及在末尾追加/弹出元素（O(log n)）。
+    """
+
+    def __init__(self, values=()):
+        self.build(values)
+
+    def build(self, values):
+        """
+        O(n) 构建
+        """
+        self._vals = list(values)
+        n = len(self._vals)
+        tree = [0] + self._vals
+        for i in range(1, n + 1):
+            j = i + (i & -i)
+            if j <= n:
+                tree[j] += tree[i]
+        self._tree = tree
+
+    def __len__(self):
+        return len(self._vals)
+
+    def __getitem__(self, i):
+        return self._vals[i]
+
+    def add(self, i, delta):
+        self._vals[i] += delta
+        i += 1
+        n = len(self._vals)
+        tree = self._tree
+        while i <= n:
+            tree[i] += delta
+            i += i & -i
+
+    def set(self, i, value):
+        delta = value - self._vals[i]
+        if delta:
+            self.add(i, delta)
+
+    def prefix(self, i):
+        """
+        前 i 个元素之和
+        """
+        s = 0
+        tree = self._tree
+        while i > 0:
+            s += tree[i]
+            i -= i & -i
+        return s
+
+    def append(self, value):
+        # 新节点覆盖区间 (i - lowbit(i), i]
+        self._vals.append(value)
+        i = len(self._vals)
+        self._tree.append(value + self.prefix(i - 1) - self.prefix(i - (i & -i)))
+
+    def pop(self):
+        # 末尾节点不参与任何前面节点的求和，可直接弹出
+        self._tree.pop()
+        return self._vals.pop()
+
+    def search(self, target):
+        """
+        返回最小的下标 k，使 prefix(k + 1) > target；若不存在则返回 len(self)
+        （要求所有元素非负）
+        """
+        n = len(self._vals)
+        pos = 0
+        step = 1 << n.bit_length()
+        tree = self._tree
+        while step:
+            nxt = pos + step
+            if nxt <= n and tree[nxt] <= target:
+                pos = nxt
+                target -= tree[nxt]
+            step >>= 1
+        return pos
+
+
+class WrapIndex:
+    """
+    增量折行索引。
+    文本按 '\\n' 切分为段落，每个段落按 cols 折成 max(1, ceil(len / cols)) 个显示行。
+    段落长度与显示行数分别存放在两个树状数组中：
+    - 编辑只重新计算被修改的段落，其后各段的偏移通过前缀和自动平移；
+    - 原始索引 <-> (显示行, 列) 的映射为 O(log n)。
+    折行规则与原来的 rebuild_display 完全一致。
+    """
+
+    def __init__(self, text, cols):
+        self.text = text          # GapBuffer（或 str），用于取显示行内容
+        self.cols = cols
+        self.dirty = True
+        self.lines = _LinesView(self)
+        self.ranges = _RangesView(self)
+        self.rebuild()
+
+    def _wrap_count(self, length):
+        return max(1, -(-length // self.cols))
+
+    # ---------------- 全量重建 ----------------
+    def rebuild(self):
+        """
+        根据 text 全量重建（仅在 dirty 时调用，例如整体替换文本之后）
+        """
+        lens = [len(p) for p in str(self.text).split("\n")]
+        self._para_len = lens
+        # 每段占用的字符数（含换行符），最后一段多算的 1 不影响查找
+        self._chars = Fenwick([n + 1 for n in lens])
+        self._lines = Fenwick([self._wrap_count(n) for n in lens])
+        self._total_lines = self._lines.prefix(len(lens))
+        self.dirty = False
+
+    def invalidate(self):
+        self.dirty = True
+
+    # ---------------- 段落工具 ----------------
+    def _para_of(self, raw_idx):
+        """
+        返回 (段落号, 段落起始索引)
+        """
+        p = self._chars.search(raw_idx)
+        if p >= len(self._para_len):
+            p = len(self._para_len) - 1
+        return p, self._chars.prefix(p)
+
+    def _set_para(self, p, length):
+        self._para_len[p] = length
+        self._chars.set(p, length + 1)
+        count = self._wrap_count(length)
+        old = self._lines[p]
+        if count != old:
+            self._lines.add(p, count - old)
+            self._total_lines += count - old
+
+    def _replace_paras(self, p, count, new_lens):
+        """
+        用 new_lens 替换从 p 开始的 count 个段落
+        """
+        lens = self._para_len
+        if p + count == len(lens):
+            # 发生在文本末尾（终端输出的常见情况）：只在树状数组末尾弹出/追加
+            for _ in range(count - 1):
+                lens.pop()
+                self._chars.pop()
+                self._total_lines -= self._lines.pop()
+            self._set_para(p, new_lens[0])
+            for n in new_lens[1:]:
+                lens.append(n)
+                self._chars.append(n + 1)
+                c = self._wrap_count(n)
+                self._lines.append(c)
+                self._total_lines += c
+            return
+        # 中间段落数变化：O(段落数) 重建树状数组
+        lens[p:p + count] = new_lens
+        self._chars.build([n + 1 for n in lens])
+        self._lines.build([self._wrap_count(n) for n in lens])
+        self._total_lines = self._lines.prefix(len(lens))
+
+    # ---------------- 编辑通知 ----------------
+    def insert(self, pos, inserted):
+        """
+        在 pos 处插入了 inserted（在 text 修改之后或之前调用均可）
+        """
+        if self.dirty or not inserted:
+            return
+        p, start = self._para_of(pos)
+        col = pos - start
+        old = self._para_len[p]
+        parts = inserted.split("\n")
+        if len(parts) == 1:
+            self._set_para(p, old + len(inserted))
+            return
+        new_lens = [col + len(parts[0])]
+        new_lens.extend(len(x) for x in parts[1:-1])
+        new_lens.append(old - col + len(parts[-1]))
+        self._replace_paras(p, 1, new_lens)
+
+    def delete(self, start, removed):
+        """
+        从 start 处删除了 removed
+        """
+        if self.dirty or not removed:
+            return
+        p, _ = self._para_of(start)
+        nl = removed.count("\n")
+        merged = sum(self._para_len[p:p + nl + 1]) + nl - len(removed)
+        if nl == 0:
+            self._set_para(p, merged)
+        else:
+            self._replace_paras(p, nl + 1, [merged])
+
+    # ---------------- 查询 ----------------
+    def line_count(self):
+        return self._total_lines
+
+    def line_range(self, i):
+        """
+        第 i 个显示行对应的原始索引区间 [a, b)
+        """
+        p = self._lines.search(i)
+        j = i - self._lines.prefix(p)
+        start = self._chars.prefix(p)
+        a = start + j * self.cols
+        b = min(a + self.cols, start + self._para_len[p])
+        return a, b
+
+    def line_text(self, i):
+        a, b = self.line_range(i)
+        return self.text[a:b]
+
+    def raw_index_to_display_pos(self, raw_idx):
+        """
+        原始索引 -> (显示行, 列)；与原实现一样取第一个满足 a <= raw_idx <= b 的行
+        """
+        p, start = self._para_of(raw_idx)
+        col = raw_idx - start
+        j = (col - 1) // self.cols if col > 0 else 0
+        return self._lines.prefix(p) + j, col - j * self.cols
+
+
+class _LinesView:
+    """
+    display_lines 的只读视图：len() 与下标访问，按需取文本
+    """
+
+    def __init__(self, index):
+        self._index = index
+
+    def __len__(self):
+        return self._index.line_count()
+
+    def __getitem__(self, i):
+        n = self._index.line_count()
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("display line index out of range")
+        return self._index.line_text(i)
+
+
+class _RangesView(_LinesView):
+    """
+    line_ranges 的只读视图
+    """
+
+    def __getitem__(self, i):
+        n = self._index.line_count()
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("display line index out of range")
+        return self._index.line_range(i)
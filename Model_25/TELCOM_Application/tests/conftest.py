@@ -0,0 +1,5 @@
+# conftest.py
+# 测试直接导入 src 下的模块（与 python benchmark.py 在 src 目录中运行时相同）
+import os, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
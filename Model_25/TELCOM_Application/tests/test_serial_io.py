@@ -0,0 +1,143 @@
+# test_serial_io.py
+# SerialReader 的 pty 回环测试：master 端模拟 Model 100，slave 端由 pyserial 打开
+import asyncio, os, threading, time
+
+import pytest
+
+pty = pytest.importorskip("pty")
+serial = pytest.importorskip("serial")
+
+from serial_io import SerialReader
+
+
+@pytest.fixture
+def loopback():
+    master, slave = pty.openpty()
+    ser = serial.Serial(os.ttyname(slave), baudrate=9600, timeout=0.3)
+    os.close(slave)
+    yield master, ser
+    ser.close()
+    os.close(master)
+
+
+def _start(reader):
+    stop = threading.Event()
+    received = bytearray()
+    t = threading.Thread(target=reader.run, args=(received.extend, stop), daemon=True)
+    t.start()
+    return received, stop, t
+
+
+def _wait(cond, timeout):
+    deadline = time.monotonic() + timeout
+    while not cond() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return cond()
+
+
+def test_idle_reader_blocks(loopback):
+    # 没有数据时阻塞在 select() 中，超时之前不唤醒
+    master, ser = loopback
+    reader = SerialReader(ser, timeout=1.0)
+    received, stop, t = _start(reader)
+    time.sleep(0.5)
+    assert reader.wakeups == 0
+    stop.set()
+    t.join(2)
+    reader.close()
+
+
+def test_paced_bytes_arrive_intact(loopback):
+    # 按 9600 波特率的节奏（约 960 字节/秒）逐块写入
+    master, ser = loopback
+    reader = SerialReader(ser, timeout=1.0)
+    received, stop, t = _start(reader)
+    payload = b"0123456789ABCDEF" * 20
+    for i in range(0, len(payload), 16):
+        os.write(master, payload[i:i + 16])
+        time.sleep(16 / 960)
+    assert _wait(lambda: len(received) >= len(payload), 5)
+    assert bytes(received) == payload
+    stop.set()
+    t.join(2)
+    reader.close()
+
+
+def test_unthrottled_throughput(loopback):
+    # 整块写入 256 KB：全部按序收到，且每次唤醒读出多个字节（不是逐字节轮询）
+    master, ser = loopback
+    reader = SerialReader(ser, timeout=1.0)
+    received, stop, t = _start(reader)
+    block = bytes(range(256)) * 16
+    total = 256 * 1024
+    for _ in range(total // len(block)):
+        os.write(master, block)
+    assert _wait(lambda: len(received) >= total, 10)
+    assert bytes(received) == block * (total // len(block))
+    assert reader.bytes_read == total
+    assert total / reader.wakeups > 64
+    stop.set()
+    t.join(2)
+    reader.close()
+
+
+def test_attach_asyncio(loopback):
+    # asyncio 方式：add_reader 回调读出数据，detach 之后不再回调
+    master, ser = loopback
+    reader = SerialReader(ser, use_select=False)
+    loop = asyncio.new_event_loop()
+    received = bytearray()
+    payload = b"hello model 100\r\n" * 64
+
+    async def main():
+        detach = reader.attach(loop, received.extend)
+        os.write(master, payload)
+        deadline = loop.time() + 5
+        while len(received) < len(payload) and loop.time() < deadline:
+            await asyncio.sleep(0.005)
+        detach()
+        wakeups = reader.wakeups
+        os.write(master, b"late")
+        await asyncio.sleep(0.05)
+        return wakeups
+
+    try:
+        wakeups = loop.run_until_complete(main())
+    finally:
+        loop.close()
+    assert bytes(received) == payload
+    assert reader.bytes_read == len(payload)
+    assert reader.wakeups == wakeups > 0
+
+
+class _Root:
+    # 代替 Tk 根窗口：after() 只记录回调，由测试手动运行
+    def __init__(self):
+        self.calls = []
+
+    def after(self, ms, fn, *args):
+        self.calls.append((fn, args))
+        return len(self.calls)
+
+    def run_pending(self):
+        calls, self.calls = self.calls, []
+        for fn, args in calls:
+            fn(*args)
+
+
+def test_pacer_hold_keeps_device_xoff():
+    from serial_io import OutputPacer
+    root = _Root()
+    written = []
+    pacer = OutputPacer(root, None, written.append, lambda text: None, 9600)
+    pacer.hold()
+    pacer.send("hello")
+    assert written == []
+    # 传输期间设备发来 XOFF：结束传输不能解除它
+    pacer.pause()
+    pacer.release()
+    root.run_pending()
+    assert written == []
+    pacer.resume()
+    root.run_pending()
+    assert "".join(written) == "hello"